@@ -0,0 +1,168 @@
+'''
+aligncache.py: fast_align 形式のアラインメントファイルを NumPy の CSR 形式の配列に変換して保存する
+    jcsplit.py --alignment_cache DIR は配列を mmap して使い，アラインメントの文字列を解析しない
+    ワーカープロセスも同じファイルを mmap するので，配列はプロセスの間でコピーされない
+    アラインメントファイルの大きさか更新時刻が変わったら作り直す
+
+Cache directory:
+    meta.json    (CACHE_VERSION, アラインメントファイルの大きさ, 更新時刻 ns, 文の数, リンクの数)
+    offsets.npy  文ごとのリンクの開始位置 (int64, 文の数 + 1)
+    j2c.npy      (日本語トークン, 中国語トークン) の int32 の組
+                 文ごとに日本語トークンの順 (同じトークンのリンクは元の順)
+    c2j.npy      (中国語トークン, 日本語トークン) の int32 の組．文ごとに中国語トークンの順
+'''
+import array
+import json
+import os
+import re
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+import corpusio
+
+CACHE_VERSION = 2
+META_FILE = 'meta.json'
+# 変換する時に一度に解析する行数
+BUILD_BLOCK = 100000
+# 空白1つで区切った "i-j" の並び (空の要素は jcsplit.make_alignment_dicts() と同じく許す)
+# これに合わない行は parse_line() (make_alignment_dicts() と同じ規則) で1要素ずつ解析する
+ALIGNMENT_RE = re.compile('(?:[0-9]+-[0-9]+)?(?: (?:[0-9]+-[0-9]+)?)*')
+
+
+def parse_line(text):
+    '''
+    1行のアラインメントを (日本語トークン, 中国語トークン) のリストにする
+    jcsplit.make_alignment_dicts() と同じく "i-j" の形でない要素は無視する
+    '''
+    links = []
+    for pair in text.strip().split(' '):
+        a = pair.split('-')
+        if len(a) == 2:
+            links.append((int(a[0]), int(a[1])))
+    return links
+
+
+def parse_strict(texts):
+    '''
+    strip() した複数行を np.fromstring でまとめて解析する
+    "3-3-4" や "0-1\t2-3" のように parse_line() が無視する要素があれば None
+    :return: (日本語トークン, 中国語トークン, 行ごとのリンク数) の配列
+    '''
+    joined = ' '.join(texts)
+    if not ALIGNMENT_RE.fullmatch(joined):
+        return None
+    numbers = np.fromstring(joined.replace('-', ' '), dtype=np.int64, sep=' ')
+    n_links = np.array([text.count('-') for text in texts], dtype=np.int64)
+    return numbers[0::2], numbers[1::2], n_links
+
+
+def parse_block(texts):
+    '''
+    複数行をまとめて解析する
+    :return: (日本語トークン, 中国語トークン, 行ごとのリンク数) の配列
+    '''
+    texts = [text.strip() for text in texts]
+    parsed = parse_strict(texts)
+    if parsed is not None:
+        return parsed
+    # 形式が正しくない行があるので1行ずつ解析する
+    line_links = [parse_line(text) for text in texts]
+    numbers = np.array([n for links in line_links for link in links for n in link],
+                       dtype=np.int64)
+    return numbers[0::2], numbers[1::2], np.array([len(links) for links in line_links],
+                                                  dtype=np.int64)
+
+
+def sort_links(src_tokens, tgt_tokens, n_links):
+    ''' 行ごとに自分側トークンの順に並べる (同じトークンは元の順) '''
+    lines = np.repeat(np.arange(len(n_links)), n_links)
+    order = np.lexsort((src_tokens, lines))
+    return np.stack([src_tokens[order], tgt_tokens[order]], axis=1).astype(np.int32)
+
+
+def read_meta(directory):
+    try:
+        with open(os.path.join(directory, META_FILE), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def is_current(directory, alignment_file):
+    meta = read_meta(directory)
+    stat = os.stat(alignment_file)
+    return meta is not None and meta['version'] == CACHE_VERSION and \
+        meta['size'] == stat.st_size and meta['mtime_ns'] == stat.st_mtime_ns
+
+
+def build(directory, alignment_file):
+    '''
+    アラインメントファイルを変換して directory に保存する
+    変換中は一時ファイルに書き，最後に .npy にする (メモリに全体を持たない)
+    '''
+    os.makedirs(directory, exist_ok=True)
+    if os.path.exists(os.path.join(directory, META_FILE)):
+        os.remove(os.path.join(directory, META_FILE))
+    stat = os.stat(alignment_file)
+    offsets = array.array('q', [0])
+    tmp_paths = [os.path.join(directory, name + '.tmp') for name in ('j2c', 'c2j')]
+    with corpusio.open_file(alignment_file) as fin, \
+         open(tmp_paths[0], 'wb') as fj2c, open(tmp_paths[1], 'wb') as fc2j:
+        while True:
+            texts = [line for _, line in zip(range(BUILD_BLOCK), fin)]
+            if not texts:
+                break
+            j_tokens, c_tokens, n_links = parse_block(texts)
+            sort_links(j_tokens, c_tokens, n_links).tofile(fj2c)
+            sort_links(c_tokens, j_tokens, n_links).tofile(fc2j)
+            offsets.extend((np.cumsum(n_links) + offsets[-1]).tolist())
+    n_links = offsets[-1]
+    for name, tmp_path in zip(('j2c', 'c2j'), tmp_paths):
+        if n_links:
+            pairs = np.memmap(tmp_path, dtype=np.int32, mode='r', shape=(n_links, 2))
+        else:
+            pairs = np.zeros((0, 2), dtype=np.int32)
+        np.save(os.path.join(directory, name + '.npy'), pairs)
+        del pairs
+        os.remove(tmp_path)
+    np.save(os.path.join(directory, 'offsets.npy'), np.frombuffer(offsets, dtype=np.int64))
+    # meta.json は最後に書く (途中で止まったキャッシュは使わない)
+    with open(os.path.join(directory, META_FILE), 'w', encoding='utf-8') as f:
+        json.dump({'version': CACHE_VERSION, 'size': stat.st_size,
+                   'mtime_ns': stat.st_mtime_ns, 'sentences': len(offsets) - 1,
+                   'links': n_links}, f)
+
+
+class AlignmentCache:
+    def __init__(self, directory):
+        load = lambda name: np.load(os.path.join(directory, name + '.npy'), mmap_mode='r')
+        self.offsets = load('offsets')
+        self.j2c = load('j2c')
+        self.c2j = load('c2j')
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def links(self, rows):
+        '''
+        rows 番目 (0始まり) の文の J -> C と C -> J のリンクを
+        jcsplit.count_links_numpy() の links の形で返す
+        文対の番号は J -> C が 0 .. len(rows) - 1, C -> J がそのあとに続く
+        各文対の中は自分側トークンの順に並んでいる
+        '''
+        rows = np.asarray(rows, dtype=np.int64)
+        starts = self.offsets[rows]
+        n_links = self.offsets[rows + 1] - starts
+        # 各文のリンクの位置を1つの配列にする
+        index = np.repeat(starts - (np.cumsum(n_links) - n_links), n_links) + \
+            np.arange(int(n_links.sum()), dtype=np.int64)
+        j2c = self.j2c[index]
+        c2j = self.c2j[index]
+        pair_no = np.repeat(np.arange(len(rows), dtype=np.int64), n_links)
+        return (np.concatenate([j2c[:, 0], c2j[:, 0]]).astype(np.int64),
+                np.concatenate([j2c[:, 1], c2j[:, 1]]).astype(np.int64),
+                np.concatenate([pair_no, pair_no + len(rows)]))
+
@@ -0,0 +1,320 @@
+'''
+augment.py: README の手順 2, 4, 5, 6 (jcsplit.py, mix-segments.py, mktarget.py, cat) を
+    1つのプロセスの中でストリームとしてつなげて実行する
+    手順 3 の逆翻訳は translators.py の翻訳関数を差し込んで行う
+    中間ファイルは指定された場合だけ書き出す
+使い方:
+    $ python augment.py -m 0.5 -s -t dict:ja-zh.tsv symmetrized.align input-ja input-zh train-ja-mixed-source train-zh-extended-target
+'''
+import argparse
+import collections
+import importlib
+import multiprocessing
+import shutil
+import sys
+
+import btplan
+import corpusio
+import jcsplit
+import runstats
+import segmap
+import splitcache
+import translators
+
+mix_segments = importlib.import_module('mix-segments')
+
+
+def get_arguments():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('alignment',
+                        help='alignment data')
+    parser.add_argument('input_japanese_file',
+                        help='input Japanese file')
+    parser.add_argument('input_chinese_file',
+                        help='input Chinese file')
+    parser.add_argument('output_source_file',
+                        help='output source file (original + mixed sentences)')
+    parser.add_argument('output_target_file',
+                        help='output target file (original + extended sentences)')
+    parser.add_argument('-t', '--translator', required=True,
+                        help="back-translation: 'identity', 'dict:FILE' or 'module:function'")
+    parser.add_argument('-m', '--minimum_rate',
+                        help='minimum rate')
+    parser.add_argument('-s', '--simplify', action='store_true',
+                        help='simplify Japanese kanjis')
+    parser.add_argument('-r', '--reverse', action='store_true',
+                        help='from Chinese to Japanese (Chinese pseudo-source sentences)')
+    parser.add_argument('-d', '--debug', action='store_true',
+                        help='Debug mode')
+    parser.add_argument('-w', '--workers', type=int, default=1,
+                        help='number of worker processes')
+    parser.add_argument('--chunk_size', type=int, default=1000,
+                        help='number of sentences processed (and translated) at once')
+    parser.add_argument('--stats',
+                        help='write per-stage times and counters to this file (JSON)')
+    parser.add_argument('--cache',
+                        help='jcsplit.py result cache file (SQLite), reused across runs')
+    parser.add_argument('--cache_size', type=int, default=splitcache.DEFAULT_CACHE_SIZE,
+                        help='maximum size of the result cache in MB')
+    # 中間ファイル (任意)
+    parser.add_argument('-l', '--log_file',
+                        help='jcsplit.py log file')
+    parser.add_argument('-M', '--mapping_file',
+                        help='jcsplit.py mapping file')
+    parser.add_argument('--short_japanese_file',
+                        help='jcsplit.py output Japanese file')
+    parser.add_argument('--short_chinese_file',
+                        help='jcsplit.py output Chinese file')
+    parser.add_argument('--translated_file',
+                        help='back-translated short sentence file')
+    parser.add_argument('-n', '--number',
+                        help='sentence ID and number of short sentences')
+    parser.add_argument('--mixed_source_file',
+                        help='mix-segments.py output file')
+    parser.add_argument('--mixed_target_file',
+                        help='mktarget.py output file')
+    return parser.parse_args()
+
+
+def split_stage(fin_align, fin_jp, fin_ch, options, workers, chunk_size, stats, cache=None):
+    '''
+    jcsplit.py の処理を chunk_size 文ずつ行う
+    ワーカーの計測結果は stats にまとめる
+    cache (splitcache.SplitCache) にある文は分割し直さない
+    :return: チャンクごとに [(sentence_no, jp_line, ch_line, result), ...]
+             result は jcsplit.format_sentence() の返り値
+    '''
+    pending = collections.deque()
+
+    def reading():
+        for sentence_no, chunk in jcsplit.read_chunks(fin_align, fin_jp, fin_ch, chunk_size):
+            pending.append(chunk)
+            yield sentence_no, chunk
+
+    chunks = reading()
+    if cache:
+        chunks = cache.filter_chunks(chunks)
+    pool = None
+    if workers > 1:
+        pool = multiprocessing.Pool(workers, initializer=jcsplit.init_worker,
+                                    initargs=options)
+        results = pool.imap(jcsplit.process_chunk, chunks)
+    else:
+        jcsplit.init_worker(*options)
+        results = map(jcsplit.process_chunk, chunks)
+    if cache:
+        results = cache.merge_results(results)
+
+    for sentence_no, chunk_results, chunk_stats in results:
+        stats.merge(chunk_stats)
+        chunk = pending.popleft()
+        yield [(sentence_no + i, jp_line, ch_line, result)
+               for i, ((_, jp_line, ch_line), result) in enumerate(zip(chunk, chunk_results))]
+
+    if pool:
+        pool.close()
+        pool.join()
+
+
+def back_translate_stage(chunks, translator, reverse, translate_all, stats):
+    '''
+    分割された文のショートセンテンスをチャンクごとにまとめて翻訳する
+    チャンクの中の同じ文は1回だけ翻訳する
+    :param translate_all: 複雑な対応の文のショートセンテンスも翻訳する
+    :return: チャンクごとに [(sentence_no, jp_line, ch_line, result, complicated,
+             sentence_pairs), ...]
+             sentence_pairs は (元の文, 翻訳文) のリスト (分割されない文は None)
+    '''
+    for chunk in chunks:
+        records = []
+        to_translate = []
+        for sentence_no, jp_line, ch_line, result in chunk:
+            split, _, _, jp_text, ch_text, segment_pairs = result
+            if not split:
+                records.append((sentence_no, jp_line, ch_line, result, False, None))
+                continue
+            jp_shorts = jp_text.split('\n')[:-1]
+            ch_shorts = ch_text.split('\n')[:-1]
+            if reverse:
+                # chinese to japanese
+                sources, targets = ch_shorts, jp_shorts
+                mappings = [(right, left) for left, right in segment_pairs]
+            else:
+                # japanese to chinese
+                sources, targets = jp_shorts, ch_shorts
+                mappings = [(left, right) for left, right in segment_pairs]
+            complicated = segmap.is_complicated(mappings)
+            first = None
+            if translate_all or not complicated:
+                first = len(to_translate)
+                to_translate += targets
+            records.append((sentence_no, jp_line, ch_line, result, complicated,
+                            (sources, first)))
+
+        with stats.timer('back_translate'):
+            # 重複を除き，長さの順に並べて翻訳する
+            translated = btplan.translate_unique(translator, to_translate)
+        stats.count('translated_sentences', len(to_translate))
+        if len(translated) != len(to_translate):
+            raise ValueError('translator returned {0} sentences for {1}'.format(
+                len(translated), len(to_translate)))
+        translated = [t.strip() for t in translated]
+
+        for i, record in enumerate(records):
+            if record[5] is None:
+                continue
+            sources, first = record[5]
+            sentence_pairs = None
+            if first is not None:
+                sentence_pairs = list(zip(sources, translated[first:first + len(sources)]))
+            records[i] = record[:5] + (sentence_pairs,)
+        yield records
+
+
+def strip_newline(line):
+    if line.endswith('\n'):
+        return line[:-1]
+    return line
+
+
+def open_optional(path):
+    if path:
+        return corpusio.open_file(path, 'w')
+    return None
+
+
+def main():
+    args = get_arguments()
+    if args.mapping_file and corpusio.compression(args.mapping_file):
+        sys.exit('augment.py: the mapping file (-M) cannot be compressed: {0}'.format(
+            args.mapping_file))
+    minimum_rate = jcsplit.DEFAULT_MINIMUM_RATE
+    if args.minimum_rate:
+        minimum_rate = float(args.minimum_rate)
+    do_simplify = args.simplify or jcsplit.DO_SIMPLIFY
+    translator = translators.load_translator(args.translator)
+    if do_simplify:
+        jcsplit.load_hankan_map()
+
+    if args.reverse:
+        source_file, target_file = args.input_chinese_file, args.input_japanese_file
+    else:
+        source_file, target_file = args.input_japanese_file, args.input_chinese_file
+
+    # 手順 6: 元の対訳コーパスのあとに生成した文を追加する
+    stats = runstats.Stats(enabled=args.stats is not None)
+    progress = runstats.Progress('augment.py', runstats.input_size(args.alignment),
+                                 enabled=stats.enabled)
+    fout_src = corpusio.open_file(args.output_source_file, 'wb')
+    fout_tgt = corpusio.open_file(args.output_target_file, 'wb')
+    with stats.timer('copy_original'):
+        for path, fout in ((source_file, fout_src), (target_file, fout_tgt)):
+            with corpusio.open_file(path, 'rb') as fin:
+                shutil.copyfileobj(fin, fout)
+
+    flog = open_optional(args.log_file)
+    fmap = segmap.MappingWriter(args.mapping_file) if args.mapping_file else None
+    fshort_jp = open_optional(args.short_japanese_file)
+    fshort_ch = open_optional(args.short_chinese_file)
+    ftrn = open_optional(args.translated_file)
+    fnum = open_optional(args.number)
+    fmix_src = open_optional(args.mixed_source_file)
+    fmix_tgt = open_optional(args.mixed_target_file)
+
+    n_split = 0
+    n_not_split = 0
+    n_short_sentence = 0
+    comp_count = 0
+
+    with corpusio.open_file(args.alignment) as fin_align, \
+        corpusio.open_file(args.input_japanese_file) as fin_jp, \
+        corpusio.open_file(args.input_chinese_file) as fin_ch:
+
+        options = (minimum_rate, do_simplify, False, flog is not None, stats.enabled)
+        cache = None
+        if args.cache:
+            cache = splitcache.SplitCache(args.cache, options[:4], args.cache_size << 20,
+                                          stats)
+        chunks = split_stage(fin_align, fin_jp, fin_ch, options,
+                             args.workers, args.chunk_size, stats, cache)
+        chunks = back_translate_stage(chunks, translator, args.reverse,
+                                      ftrn is not None, stats)
+
+        for records in chunks:
+            mixed_src = []
+            mixed_tgt = []
+            with stats.timer('write_intermediate'):
+                for sentence_no, jp_line, ch_line, result, _, sentence_pairs in records:
+                    split, _, log_text, jp_text, ch_text, segment_pairs = result
+                    if not split:
+                        continue
+                    if flog:
+                        flog.write(log_text)
+                    if fmap:
+                        fmap.write(sentence_no, segment_pairs)
+                    if fshort_jp:
+                        fshort_jp.write(jp_text)
+                    if fshort_ch:
+                        fshort_ch.write(ch_text)
+                    if ftrn:
+                        ftrn.write(''.join(t + '\n' for _, t in sentence_pairs))
+
+            with stats.timer('mix'):
+                for sentence_no, jp_line, ch_line, result, complicated, sentence_pairs \
+                        in records:
+                    split, n_short = result[:2]
+                    if not split:
+                        n_not_split += 1
+                        continue
+                    n_split += 1
+                    n_short_sentence += n_short
+                    if complicated:
+                        # skip if segment alignment is complicated
+                        comp_count += 1
+                        continue
+                    mixed_src += mix_segments.mixed_sentences(sentence_pairs, args.debug)
+                    target = strip_newline(ch_line if not args.reverse else jp_line)
+                    mixed_tgt.append((target + '\n') * len(sentence_pairs))
+                    if fnum:
+                        print('{0} {1}'.format(sentence_no, len(sentence_pairs)), file=fnum)
+                    stats.count('mixed_sentences', len(sentence_pairs))
+
+            with stats.timer('write_output'):
+                mixed_src = ''.join(mixed_src)
+                mixed_tgt = ''.join(mixed_tgt)
+                fout_src.write(mixed_src.encode('utf-8'))
+                fout_tgt.write(mixed_tgt.encode('utf-8'))
+                if fmix_src:
+                    fmix_src.write(mixed_src)
+                if fmix_tgt:
+                    fmix_tgt.write(mixed_tgt)
+            progress.update(n_split + n_not_split, stats.counters.get('alignment_bytes'))
+
+        if cache:
+            cache.close()
+
+    summary = '\n{0} of {1} sentences were split into {2} short sentences.'.format(
+        n_split, n_split+n_not_split, n_short_sentence)
+    if flog:
+        print(summary, file=flog)
+    print(summary)
+    print('Number of removed sentences:', comp_count)
+
+    for f in (fout_src, fout_tgt, flog, fmap, fshort_jp, fshort_ch, ftrn, fnum,
+              fmix_src, fmix_tgt):
+        if f:
+            f.close()
+
+    if stats.enabled:
+        stats.write(args.stats, 'augment.py', progress.elapsed(),
+                    bytes_read=runstats.file_sizes(args.alignment, args.input_japanese_file,
+                                                   args.input_chinese_file),
+                    bytes_written=runstats.file_sizes(
+                        args.output_source_file, args.output_target_file, args.log_file,
+                        args.mapping_file, args.short_japanese_file, args.short_chinese_file,
+                        args.translated_file, args.number, args.mixed_source_file,
+                        args.mixed_target_file))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,292 @@
+'''
+benchmark.py: 合成した日中対訳コーパスで処理速度を測る
+    1. 単語分割済みの日本語・中国語ファイルと fast_align 形式 (i-j) のアラインメントを生成する
+    2. split_sentence, calc_segment_dist, get_segment_pairs をプロセス内で計測する
+    3. jcsplit.py, mix-segments.py, mktarget.py を別プロセスで実行し，
+       文/秒と最大メモリ使用量 (peak RSS) を計測する
+    結果は JSON ファイルに保存し，--compare で前回の結果と比べられる
+使い方:
+    $ python benchmark.py --sizes 10k,1m -o bench.json [--compare old-bench.json]
+'''
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+import jcsplit
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+SIZE_UNITS = {'k': 1000, 'm': 1000 * 1000}
+# split_sentences() に一度に渡す文数 (jcsplit.py の --chunk_size の既定値)
+BATCH_SIZE = 1000
+
+JA_DELIMS = ['、', '，', '：', '；']
+ZH_DELIMS = ['，', '、', '：', '；']
+
+
+def get_arguments():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', default='10k',
+                        help='comma separated corpus sizes (e.g. 10k,1m,10m)')
+    parser.add_argument('-o', '--output', default='benchmark.json',
+                        help='output JSON file')
+    parser.add_argument('--compare',
+                        help='previous JSON file to compare with')
+    parser.add_argument('--work_dir',
+                        help='directory for the generated corpora (reused if present)')
+    parser.add_argument('--function_lines', type=int, default=10000,
+                        help='number of sentences for the in-process measurements')
+    parser.add_argument('--delimiter_rate', type=float, default=0.08,
+                        help='rate of delimiter tokens')
+    parser.add_argument('--wide_space_rate', type=float, default=0.02,
+                        help='rate of full-width space tokens (Japanese)')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('-m', '--minimum_rate', default='0.5',
+                        help='minimum rate for jcsplit.py')
+    parser.add_argument('-s', '--simplify', action='store_true',
+                        help='run jcsplit.py with -s')
+    parser.add_argument('-w', '--workers', type=int, default=1,
+                        help='number of jcsplit.py worker processes')
+    return parser.parse_args()
+
+
+def parse_size(text):
+    text = text.strip().lower()
+    if text[-1] in SIZE_UNITS:
+        return int(float(text[:-1]) * SIZE_UNITS[text[-1]])
+    return int(text)
+
+
+def load_characters():
+    kanji = []
+    hanzi = []
+    with open(os.path.join(SCRIPT_DIR, jcsplit.MAPFILE), 'r', encoding='utf-8') as f:
+        for line in f:
+            k, h = line.strip().split(',')
+            kanji.append(k)
+            hanzi.append(h)
+    return kanji, hanzi
+
+
+class CorpusGenerator:
+    '''
+    文字種の分布と区切り記号・全角スペースの密度だけを真似た合成コーパス
+    '''
+    def __init__(self, seed, delimiter_rate, wide_space_rate):
+        self.random = random.Random(seed)
+        self.delimiter_rate = delimiter_rate
+        self.wide_space_rate = wide_space_rate
+        kanji, hanzi = load_characters()
+        # 日本語は日本の漢字と一部の簡体字，中国語は簡体字と一部の日本の漢字
+        self.ja_chars = kanji + hanzi[:len(hanzi) // 8]
+        self.zh_chars = hanzi + kanji[:len(kanji) // 16]
+        self.kana = [chr(c) for c in range(0x3041, 0x3094)]
+        self.alpha = [chr(c) for c in range(0xff21, 0xff3b)]
+
+    def word(self, chars, kana):
+        r = self.random.random()
+        if r < 0.05:
+            return ''.join(self.random.choice(self.alpha) for _ in range(self.random.randint(1, 5)))
+        if kana and r < 0.45:
+            return ''.join(self.random.choice(self.kana) for _ in range(self.random.randint(1, 3)))
+        return ''.join(self.random.choice(chars) for _ in range(self.random.randint(1, 3)))
+
+    def sentence(self, n_tokens, chars, delims, kana, wide_space_rate):
+        tokens = []
+        for i in range(n_tokens - 1):
+            r = self.random.random()
+            if 0 < i and r < self.delimiter_rate:
+                tokens.append(self.random.choice(delims))
+            elif 0 < i and r < self.delimiter_rate + wide_space_rate:
+                tokens.append(jcsplit.WIDE_SPACE)
+            else:
+                tokens.append(self.word(chars, kana))
+        tokens.append('。')
+        return tokens
+
+    def alignment(self, n_ja, n_zh):
+        # 対角線付近への対応 + 一部の一対多
+        pairs = []
+        for j in range(n_ja):
+            if self.random.random() < 0.1:
+                continue
+            c = int(j * n_zh / n_ja + self.random.gauss(0, 1.0))
+            c = min(max(c, 0), n_zh - 1)
+            pairs.append('{0}-{1}'.format(j, c))
+            if self.random.random() < 0.1 and c + 1 < n_zh:
+                pairs.append('{0}-{1}'.format(j, c + 1))
+        return ' '.join(pairs)
+
+    def write(self, n_lines, ja_file, zh_file, align_file):
+        with open(ja_file, 'w', encoding='utf-8') as fja, \
+             open(zh_file, 'w', encoding='utf-8') as fzh, \
+             open(align_file, 'w', encoding='utf-8') as falign:
+            for _ in range(n_lines):
+                # 特許文のような長い文も混ぜる
+                n_ja = max(2, int(self.random.lognormvariate(3.3, 0.6)))
+                n_zh = max(2, int(n_ja * self.random.uniform(0.8, 1.2)))
+                ja = self.sentence(n_ja, self.ja_chars, JA_DELIMS, True, self.wide_space_rate)
+                zh = self.sentence(n_zh, self.zh_chars, ZH_DELIMS, False, 0)
+                print(' '.join(ja), file=fja)
+                print(' '.join(zh), file=fzh)
+                print(self.alignment(len(ja), len(zh)), file=falign)
+
+
+def time_functions(ja_file, zh_file, align_file, n_lines, minimum_rate, do_simplify):
+    ''' split_sentence とその各段階をプロセス内で計測する '''
+    lines = []
+    with open(ja_file, 'r', encoding='utf-8') as fja, \
+         open(zh_file, 'r', encoding='utf-8') as fzh, \
+         open(align_file, 'r', encoding='utf-8') as falign:
+        for _, ja, zh, align in zip(range(n_lines), fja, fzh, falign):
+            lines.append((ja, zh, align))
+
+    results = {}
+    start = time.perf_counter()
+    for ja, zh, align in lines:
+        jcsplit.split_sentence(ja, zh, align, minimum_rate, do_simplify)
+    results['split_sentence'] = time.perf_counter() - start
+
+    sentences = []
+    for ja, zh, align in lines:
+        j2c_align, c2j_align = jcsplit.make_alignment_dicts(align)
+        sentences.append((jcsplit.Sentence(ja, jcsplit.DELIMS, j2c_align),
+                          jcsplit.Sentence(zh, jcsplit.DELIMS, c2j_align)))
+    start = time.perf_counter()
+    for ja_sentence, zh_sentence in sentences:
+        ja_sentence.calc_segment_dist(zh_sentence, minimum_rate, do_simplify)
+        zh_sentence.calc_segment_dist(ja_sentence, minimum_rate, do_simplify)
+    results['calc_segment_dist'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for ja_sentence, zh_sentence in sentences:
+        jcsplit.Sentence.get_segment_pairs(ja_sentence, zh_sentence)
+    results['get_segment_pairs'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for i in range(0, len(lines), BATCH_SIZE):
+        jcsplit.split_sentences(lines[i:i + BATCH_SIZE], minimum_rate, do_simplify)
+    results['split_sentences (batch)'] = time.perf_counter() - start
+
+    return [{'stage': stage, 'lines': len(lines), 'seconds': seconds,
+             'sentences_per_sec': len(lines) / seconds if seconds else None}
+            for stage, seconds in results.items()]
+
+
+def run_command(stage, command, n_lines, stdout=subprocess.DEVNULL):
+    ''' 別プロセスで実行し，経過時間とそのプロセスの peak RSS を測る '''
+    start = time.perf_counter()
+    process = subprocess.Popen(command, stdout=stdout)
+    _, status, rusage = os.wait4(process.pid, 0)
+    seconds = time.perf_counter() - start
+    process.returncode = os.waitstatus_to_exitcode(status)
+    if process.returncode != 0:
+        raise subprocess.CalledProcessError(process.returncode, command)
+    # Linux では KB 単位, macOS ではバイト単位
+    peak_rss_kb = rusage.ru_maxrss if sys.platform != 'darwin' else rusage.ru_maxrss // 1024
+    return {'stage': stage, 'lines': n_lines, 'seconds': seconds,
+            'sentences_per_sec': n_lines / seconds if seconds else None,
+            'peak_rss_kb': peak_rss_kb}
+
+
+def run_scripts(work_dir, name, n_lines, args):
+    ja_file, zh_file, align_file = corpus_files(work_dir, name)
+    out = os.path.join(work_dir, name + '.out')
+    python = sys.executable
+    jcsplit_command = [python, os.path.join(SCRIPT_DIR, 'jcsplit.py'),
+                       '-m', args.minimum_rate, '-l', out + '.log', '-M', out + '.map',
+                       '-w', str(args.workers),
+                       align_file, ja_file, zh_file, out + '.ja', out + '.zh']
+    if args.simplify:
+        jcsplit_command.append('-s')
+    results = [run_command('jcsplit.py', jcsplit_command, n_lines)]
+    # 逆翻訳の代わりに中国語のショートセンテンスをそのまま使う
+    results.append(run_command('mix-segments.py', [
+        python, os.path.join(SCRIPT_DIR, 'mix-segments.py'), '-l', out + '.log',
+        '-s', out + '.ja', '-t', out + '.zh', '-o', out + '.mix', '-n', out + '.num'],
+        n_lines))
+    with open(out + '.target', 'wb') as fout:
+        results.append(run_command('mktarget.py', [
+            python, os.path.join(SCRIPT_DIR, 'mktarget.py'), zh_file, out + '.num'],
+            n_lines, stdout=fout))
+    return results
+
+
+def corpus_files(work_dir, name):
+    return [os.path.join(work_dir, name + suffix) for suffix in ('.ja', '.zh', '.align')]
+
+
+def compare(results, previous_file):
+    with open(previous_file, 'r', encoding='utf-8') as f:
+        previous = json.load(f)
+    old = {(r['stage'], r['lines']): r for r in previous['results']}
+    print('{0:28} {1:>10} {2:>12} {3:>12} {4:>8}'.format(
+        'stage', 'lines', 'old sent/s', 'new sent/s', 'ratio'))
+    for r in results:
+        o = old.get((r['stage'], r['lines']))
+        if not o or not o['sentences_per_sec'] or not r['sentences_per_sec']:
+            continue
+        print('{0:28} {1:>10} {2:>12.1f} {3:>12.1f} {4:>8.2f}'.format(
+            r['stage'], r['lines'], o['sentences_per_sec'], r['sentences_per_sec'],
+            r['sentences_per_sec'] / o['sentences_per_sec']))
+
+
+def main():
+    args = get_arguments()
+    jcsplit.load_hankan_map()
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix='jcsplit-bench-')
+    os.makedirs(work_dir, exist_ok=True)
+    minimum_rate = float(args.minimum_rate)
+
+    corpora = []
+    for size in args.sizes.split(','):
+        n_lines = parse_size(size)
+        name = 'synth-{0}-{1}'.format(n_lines, args.seed)
+        ja_file, zh_file, align_file = corpus_files(work_dir, name)
+        if not all(os.path.exists(path) for path in (ja_file, zh_file, align_file)):
+            print('generating {0} lines in {1}'.format(n_lines, work_dir), file=sys.stderr)
+            generator = CorpusGenerator(args.seed, args.delimiter_rate, args.wide_space_rate)
+            generator.write(n_lines, ja_file, zh_file, align_file)
+        corpora.append((name, n_lines))
+
+    # 子プロセスの peak RSS には fork 時のこのプロセスの大きさも含まれるため，
+    # コーパスを読み込む前にすべてのスクリプトを実行する
+    results = []
+    for name, n_lines in corpora:
+        results += run_scripts(work_dir, name, n_lines, args)
+    for name, n_lines in corpora:
+        ja_file, zh_file, align_file = corpus_files(work_dir, name)
+        results += time_functions(ja_file, zh_file, align_file,
+                                  min(n_lines, args.function_lines),
+                                  minimum_rate, args.simplify)
+
+    for r in results:
+        print('{0:28} {1:>10} {2:>10.2f}s {3:>12.1f} sent/s {4}'.format(
+            r['stage'], r['lines'], r['seconds'], r['sentences_per_sec'] or 0,
+            '{0} KB'.format(r['peak_rss_kb']) if 'peak_rss_kb' in r else ''),
+            file=sys.stderr)
+
+    report = {
+        'date': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'options': {'minimum_rate': minimum_rate, 'simplify': args.simplify,
+                    'workers': args.workers, 'seed': args.seed,
+                    'delimiter_rate': args.delimiter_rate,
+                    'wide_space_rate': args.wide_space_rate},
+        'results': results,
+    }
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,372 @@
+'''
+btclient.py: 手順 3 の逆翻訳を HTTP の翻訳サーバーに並行して依頼する
+    translate  ショートセンテンスのファイルを batch_size 文ずつ POST し，翻訳文を元の順に書く
+               出力は mix-segments.py の --translated に --source と行をそろえて渡せる
+               同時に送るリクエストは --concurrency 個まで，接続は keep-alive で使い回す
+               失敗したバッチは間隔を延ばしながら --retries 回まで送り直す
+    serve      translators.py の翻訳関数で翻訳するテスト用のサーバー
+使い方:
+    $ python btclient.py serve -t identity --port 8000 &
+    $ python btclient.py translate --url http://localhost:8000/translate output-zh train-zh2ja
+
+Protocol:
+    リクエスト  POST {"sentences": ["...", ...]}
+    レスポンス  {"translations": ["...", ...]} (同じ順序・同じ長さ)
+'''
+import argparse
+import asyncio
+import collections
+import http.server
+import json
+import random
+import sys
+import urllib.parse
+
+import corpusio
+import runstats
+import translators
+
+DEFAULT_CONCURRENCY = 8
+DEFAULT_BATCH_SIZE = 64
+DEFAULT_RETRIES = 5
+DEFAULT_TIMEOUT = 300.0  # seconds
+RETRY_DELAY = 1.0  # seconds, 失敗するたびに2倍にする
+DEFAULT_PORT = 8000
+OUTPUT_BUFFER_SIZE = 1 << 20
+# 送り直すステータス (それ以外のエラーはすぐに止める)
+RETRY_STATUS = {408, 429, 500, 502, 503, 504}
+
+
+def get_arguments():
+    parser = argparse.ArgumentParser()
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    translate = commands.add_parser('translate', help='translate a file with a server')
+    translate.add_argument('input_file', help='short sentence file (jcsplit.py output)')
+    translate.add_argument('output_file', help='output translated file')
+    translate.add_argument('--url', required=True,
+                           help='translation server URL (http:// or https://)')
+    translate.add_argument('-c', '--concurrency', type=int, default=DEFAULT_CONCURRENCY,
+                           help='number of requests in flight (and connections) '
+                           '(default: %(default)s)')
+    translate.add_argument('--batch_size', type=int, default=DEFAULT_BATCH_SIZE,
+                           help='number of sentences in a request (default: %(default)s)')
+    translate.add_argument('--retries', type=int, default=DEFAULT_RETRIES,
+                           help='number of retries of a failed request (default: %(default)s)')
+    translate.add_argument('--timeout', type=float, default=DEFAULT_TIMEOUT,
+                           help='timeout of a request in seconds (default: %(default)s)')
+    translate.add_argument('--stats',
+                           help='write per-stage times and counters to this file (JSON)')
+
+    serve = commands.add_parser('serve', help='run a stub translation server')
+    serve.add_argument('-t', '--translator', default='identity',
+                       help="'identity', 'dict:FILE' or 'module:function' (default: identity)")
+    serve.add_argument('--host', default='127.0.0.1',
+                       help='address to listen on (default: %(default)s)')
+    serve.add_argument('--port', type=int, default=DEFAULT_PORT,
+                       help='port to listen on (default: %(default)s)')
+    serve.add_argument('--fail_rate', type=float, default=0.0,
+                       help='answer this fraction of requests with 503 (to test retries)')
+    return parser.parse_args()
+
+
+class HTTPError(Exception):
+    def __init__(self, status, reason):
+        super().__init__('HTTP {0} {1}'.format(status, reason))
+        self.status = status
+
+
+class Connection:
+    ''' keep-alive で使い回す HTTP/1.1 の接続 '''
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.reusable = True
+
+    async def post(self, host, path, body):
+        self.writer.write(
+            'POST {0} HTTP/1.1\r\nHost: {1}\r\nContent-Type: application/json\r\n'
+            'Content-Length: {2}\r\nConnection: keep-alive\r\n\r\n'.format(
+                path, host, len(body)).encode('latin-1') + body)
+        await self.writer.drain()
+        status_line = await self.reader.readline()
+        if not status_line:
+            # 使っていない間にサーバーが閉じた
+            raise ConnectionError('connection closed by the server')
+        _, status, reason = (status_line.decode('latin-1').rstrip('\r\n').split(' ', 2) + [''])[:3]
+        headers = {}
+        while True:
+            line = await self.reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, value = line.decode('latin-1').split(':', 1)
+            headers[name.strip().lower()] = value.strip()
+        if headers.get('transfer-encoding', '').lower() == 'chunked':
+            content = await self.read_chunked()
+        elif 'content-length' in headers:
+            content = await self.reader.readexactly(int(headers['content-length']))
+        else:
+            content = await self.reader.read()
+            self.reusable = False
+        if headers.get('connection', '').lower() == 'close':
+            self.reusable = False
+        if int(status) != 200:
+            raise HTTPError(int(status), reason)
+        return content
+
+    async def read_chunked(self):
+        chunks = []
+        while True:
+            size = int((await self.reader.readline()).split(b';')[0], 16)
+            if size == 0:
+                # trailer
+                while (await self.reader.readline()) not in (b'\r\n', b'\n', b''):
+                    pass
+                return b''.join(chunks)
+            chunks.append(await self.reader.readexactly(size))
+            await self.reader.readline()
+
+    def close(self):
+        self.writer.close()
+
+
+class ConnectionPool:
+    ''' 同じサーバーへの接続を size 個まで作り，使い終わったものを次のリクエストに使う '''
+    def __init__(self, url, size):
+        parsed = urllib.parse.urlsplit(url)
+        self.ssl = parsed.scheme == 'https'
+        self.hostname = parsed.hostname
+        self.port = parsed.port or (443 if self.ssl else 80)
+        self.host = parsed.netloc
+        self.path = parsed.path or '/'
+        if parsed.query:
+            self.path += '?' + parsed.query
+        self.size = size
+        self.idle = []
+        self.n_open = 0
+        self.available = asyncio.Condition()
+        self.n_connected = 0
+
+    async def acquire(self):
+        async with self.available:
+            while not self.idle and self.n_open >= self.size:
+                await self.available.wait()
+            if self.idle:
+                return self.idle.pop()
+            self.n_open += 1
+        try:
+            reader, writer = await asyncio.open_connection(self.hostname, self.port,
+                                                           ssl=self.ssl or None)
+        except BaseException:
+            await self.release(None)
+            raise
+        self.n_connected += 1
+        return Connection(reader, writer)
+
+    async def release(self, connection):
+        ''' :param connection: 使い回せない (エラーになった) 接続は None '''
+        async with self.available:
+            if connection is not None and connection.reusable:
+                self.idle.append(connection)
+            else:
+                if connection is not None:
+                    connection.close()
+                self.n_open -= 1
+            self.available.notify()
+
+    async def post(self, body, timeout):
+        connection = await self.acquire()
+        try:
+            content = await asyncio.wait_for(
+                connection.post(self.host, self.path, body), timeout)
+        except HTTPError:
+            # エラーのレスポンスを読み終えているので，接続は使い回せる
+            await self.release(connection)
+            raise
+        except BaseException:
+            connection.reusable = False
+            await self.release(connection)
+            raise
+        await self.release(connection)
+        return content
+
+    def close(self):
+        for connection in self.idle:
+            connection.close()
+        self.idle = []
+
+
+class Client:
+    def __init__(self, url, concurrency=DEFAULT_CONCURRENCY, retries=DEFAULT_RETRIES,
+                 timeout=DEFAULT_TIMEOUT, stats=None):
+        self.pool = ConnectionPool(url, concurrency)
+        self.retries = retries
+        self.timeout = timeout
+        self.stats = stats or runstats.Stats(enabled=False)
+
+    async def translate(self, sentences):
+        ''' 1つのリクエストで翻訳する．失敗したら送り直す '''
+        body = json.dumps({'sentences': sentences}, ensure_ascii=False).encode('utf-8')
+        delay = RETRY_DELAY
+        for attempt in range(self.retries + 1):
+            try:
+                self.stats.count('requests')
+                content = await self.pool.post(body, self.timeout)
+                translations = json.loads(content.decode('utf-8'))['translations']
+                if len(translations) != len(sentences):
+                    raise ValueError('server returned {0} sentences for {1}'.format(
+                        len(translations), len(sentences)))
+                return translations
+            except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError,
+                    HTTPError, ValueError, KeyError) as e:
+                if isinstance(e, HTTPError) and e.status not in RETRY_STATUS:
+                    raise
+                if attempt == self.retries:
+                    raise
+                self.stats.count('retries')
+                print('btclient.py: {0}, retrying in {1:.0f}s'.format(e, delay),
+                      file=sys.stderr)
+                await asyncio.sleep(delay)
+                delay *= 2
+
+    def close(self):
+        self.pool.close()
+
+
+def read_batches(f, batch_size):
+    while True:
+        batch = [line.strip() for _, line in zip(range(batch_size), f)]
+        if not batch:
+            return
+        yield batch
+
+
+async def translate_file(client, fin, fout, batch_size, concurrency, progress=None):
+    '''
+    バッチを並行して翻訳し，元の順に書き出す
+    書き出していないバッチは concurrency の2倍までにして，メモリを抑える
+    '''
+    pending = collections.deque()
+    n_sentence = 0
+
+    async def write_first():
+        nonlocal n_sentence
+        translations = await pending.popleft()
+        fout.write(''.join(t.strip() + '\n' for t in translations))
+        n_sentence += len(translations)
+        if progress:
+            progress.update(n_sentence)
+
+    try:
+        for batch in read_batches(fin, batch_size):
+            pending.append(asyncio.ensure_future(client.translate(batch)))
+            if len(pending) >= concurrency * 2:
+                await write_first()
+        while pending:
+            await write_first()
+    finally:
+        for task in pending:
+            task.cancel()
+    return n_sentence
+
+
+def translate(args):
+    stats = runstats.Stats(enabled=args.stats is not None)
+
+    async def run():
+        client = Client(args.url, args.concurrency, args.retries, args.timeout, stats)
+        try:
+            with corpusio.open_file(args.input_file) as fin, \
+                 corpusio.open_file(args.output_file, 'w',
+                                    buffering=OUTPUT_BUFFER_SIZE) as fout:
+                progress = runstats.Progress('btclient.py',
+                                             runstats.input_size(args.input_file),
+                                             runstats.file_position(fin),
+                                             enabled=stats.enabled)
+                with stats.timer('back_translate'):
+                    n_sentence = await translate_file(client, fin, fout, args.batch_size,
+                                                      args.concurrency, progress)
+        finally:
+            client.close()
+        return n_sentence, client.pool.n_connected, progress
+
+    n_sentence, n_connected, progress = asyncio.run(run())
+    if stats.enabled:
+        stats.count('sentences', n_sentence)
+        stats.count('connections', n_connected)
+        stats.write(args.stats, 'btclient.py', progress.elapsed(),
+                    bytes_read=runstats.file_sizes(args.input_file),
+                    bytes_written=runstats.file_sizes(args.output_file))
+
+
+class HTTPTranslator:
+    '''
+    translators.py の翻訳関数として使う (augment.py -t http://...)
+    文のリストを batch_size 文ずつ並行して翻訳する
+    '''
+    def __init__(self, url, concurrency=DEFAULT_CONCURRENCY, batch_size=DEFAULT_BATCH_SIZE):
+        self.url = url
+        self.concurrency = concurrency
+        self.batch_size = batch_size
+
+    def __call__(self, sentences):
+        async def run():
+            client = Client(self.url, self.concurrency)
+            try:
+                batches = [sentences[i:i + self.batch_size]
+                           for i in range(0, len(sentences), self.batch_size)]
+                results = await asyncio.gather(*(client.translate(b) for b in batches))
+            finally:
+                client.close()
+            return [t for translations in results for t in translations]
+        return asyncio.run(run())
+
+
+class StubHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    translator = None
+    fail_rate = 0.0
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        if random.random() < self.fail_rate:
+            self.reply(503, b'{"error": "unavailable"}')
+            return
+        sentences = json.loads(body.decode('utf-8'))['sentences']
+        translations = self.translator(sentences)
+        self.reply(200, json.dumps({'translations': translations},
+                                   ensure_ascii=False).encode('utf-8'))
+
+    def reply(self, status, content):
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(args):
+    StubHandler.translator = staticmethod(translators.load_translator(args.translator))
+    StubHandler.fail_rate = args.fail_rate
+    server = http.server.ThreadingHTTPServer((args.host, args.port), StubHandler)
+    print('btclient.py: serving on {0}:{1}'.format(*server.server_address), file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    server.server_close()
+
+
+def main():
+    args = get_arguments()
+    if args.command == 'serve':
+        serve(args)
+    else:
+        translate(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,184 @@
+'''
+btplan.py: 手順 3 の逆翻訳の前後処理
+    plan     ショートセンテンスのファイルの重複を除き，長さ (トークン数) の順に並べた
+             ファイルと，元の各行が何番目の文かを記録した plan ファイルを書く
+             長さの近い文が続くので，バッチ翻訳のパディングが少なくなる
+    translate  並べたファイルを translators.py の翻訳関数でバッチごとに翻訳する
+             (NMT を使わずに試す時や，翻訳関数を Python で呼べる時)
+    scatter  翻訳したファイルを plan ファイルで元の行の順に戻す
+             出力は mix-segments.py の --translated に --source と行をそろえて渡せる
+使い方:
+    $ python btplan.py plan output-zh unique-zh output-zh.plan
+    $ (unique-zh を NMT で翻訳して unique-zh2ja を作る)
+    $ python btplan.py scatter output-zh.plan unique-zh2ja train-zh2ja
+
+Plan file:
+    ヘッダ (MAGIC, 元の行数, 重複を除いた文の数) のあとに
+    元の各行の，並べたファイルでの行番号 (0始まり) を uint32 で並べる
+'''
+import argparse
+import array
+import struct
+import sys
+
+import corpusio
+import lineindex
+import runstats
+import translators
+
+MAGIC = b'BTPLAN01'
+HEADER = struct.Struct('<8sQQ')
+DEFAULT_BATCH_SIZE = 64
+DEFAULT_BUCKET_WIDTH = 1
+# scatter で一度に読む plan の要素数
+READ_ITEMS = 1 << 16
+OUTPUT_BUFFER_SIZE = 1 << 20
+
+
+def get_arguments():
+    parser = argparse.ArgumentParser()
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    plan = commands.add_parser('plan', help='deduplicate and sort short sentences by length')
+    plan.add_argument('input_file', help='short sentence file (jcsplit.py output)')
+    plan.add_argument('unique_file', help='output file of the unique sentences')
+    plan.add_argument('plan_file', help='output plan file')
+    plan.add_argument('--bucket_width', type=int, default=DEFAULT_BUCKET_WIDTH,
+                      help='sentences whose lengths differ by less than this are kept in '
+                      'their original order (default: %(default)s)')
+
+    translate = commands.add_parser('translate',
+                                    help='translate the unique sentences with translators.py')
+    translate.add_argument('-t', '--translator', required=True,
+                           help="'identity', 'dict:FILE' or 'module:function'")
+    translate.add_argument('unique_file', help='unique sentence file')
+    translate.add_argument('translated_file', help='output translated file')
+    translate.add_argument('--batch_size', type=int, default=DEFAULT_BATCH_SIZE,
+                           help='number of sentences translated at once (default: %(default)s)')
+
+    scatter = commands.add_parser('scatter',
+                                  help='restore the original line order of the translations')
+    scatter.add_argument('plan_file', help='plan file')
+    scatter.add_argument('translated_file', help='translated unique sentence file')
+    scatter.add_argument('output_file', help='output translated short sentence file')
+
+    for command in (plan, translate, scatter):
+        command.add_argument('--stats',
+                             help='write per-stage times and counters to this file (JSON)')
+    return parser.parse_args()
+
+
+def sort_unique(sentences, bucket_width=DEFAULT_BUCKET_WIDTH):
+    '''
+    重複を除いて長さの順に並べる (同じバケットの中では最初に現れた順)
+    :return: (並べた文のリスト, 元の各文の並べたリストでの位置)
+    '''
+    first = {}
+    ids = array.array('I')
+    for sentence in sentences:
+        i = first.get(sentence)
+        if i is None:
+            i = first[sentence] = len(first)
+        ids.append(i)
+    unique = list(first)
+    order = sorted(range(len(unique)), key=lambda i: len(unique[i].split()) // bucket_width)
+    position = array.array('I', bytes(4 * len(order)))
+    for new, old in enumerate(order):
+        position[old] = new
+    return [unique[i] for i in order], array.array('I', (position[i] for i in ids))
+
+
+def translate_unique(translator, sentences):
+    '''
+    重複を除いて長さの順に並べた文を翻訳し，元の順序の翻訳文のリストを返す
+    '''
+    unique, positions = sort_unique(sentences)
+    translated = translator(unique) if unique else []
+    if len(translated) != len(unique):
+        raise ValueError('translator returned {0} sentences for {1}'.format(
+            len(translated), len(unique)))
+    return [translated[i] for i in positions]
+
+
+def plan(args, stats):
+    with stats.timer('plan'):
+        with corpusio.open_file(args.input_file, 'rb') as f:
+            unique, positions = sort_unique((line.strip() for line in f), args.bucket_width)
+    with stats.timer('write_output'):
+        with corpusio.open_file(args.unique_file, 'wb', buffering=OUTPUT_BUFFER_SIZE) as f:
+            f.write(b''.join(sentence + b'\n' for sentence in unique))
+        with open(args.plan_file, 'wb') as f:
+            f.write(HEADER.pack(MAGIC, len(positions), len(unique)))
+            positions.tofile(f)
+    print('{0} sentences, {1} unique'.format(len(positions), len(unique)))
+    stats.count('sentences', len(positions))
+    stats.count('unique_sentences', len(unique))
+
+
+def translate(args, stats):
+    translator = translators.load_translator(args.translator)
+    n_sentence = 0
+    with corpusio.open_file(args.unique_file) as fin, \
+         corpusio.open_file(args.translated_file, 'w', buffering=OUTPUT_BUFFER_SIZE) as fout:
+        while True:
+            with stats.timer('read'):
+                batch = [line.strip() for _, line in zip(range(args.batch_size), fin)]
+            if not batch:
+                break
+            with stats.timer('back_translate'):
+                translated = translator(batch)
+            if len(translated) != len(batch):
+                raise ValueError('translator returned {0} sentences for {1}'.format(
+                    len(translated), len(batch)))
+            with stats.timer('write_output'):
+                fout.write(''.join(t.strip() + '\n' for t in translated))
+            n_sentence += len(batch)
+    stats.count('sentences', n_sentence)
+
+
+def read_plan_header(f):
+    magic, n_lines, n_unique = HEADER.unpack(f.read(HEADER.size))
+    if magic != MAGIC:
+        sys.exit('btplan.py: {0} is not a plan file'.format(f.name))
+    return n_lines, n_unique
+
+
+def scatter(args, stats):
+    with stats.timer('read'):
+        if corpusio.compression(args.translated_file):
+            # 圧縮ファイルは順にしか読めないので，メモリに読み込む
+            with corpusio.open_file(args.translated_file, 'rb') as f:
+                translated = [line.rstrip(b'\r\n') for line in f]
+        else:
+            translated = lineindex.LineIndex(args.translated_file)
+    with open(args.plan_file, 'rb') as fplan, \
+         corpusio.open_file(args.output_file, 'wb', buffering=OUTPUT_BUFFER_SIZE) as fout:
+        n_lines, n_unique = read_plan_header(fplan)
+        if len(translated) != n_unique:
+            sys.exit('btplan.py: {0} has {1} lines but the plan has {2} sentences'.format(
+                args.translated_file, len(translated), n_unique))
+        remaining = n_lines
+        while remaining:
+            positions = array.array('I')
+            positions.fromfile(fplan, min(READ_ITEMS, remaining))
+            remaining -= len(positions)
+            with stats.timer('write_output'):
+                fout.write(b''.join(translated[i] + b'\n' for i in positions))
+    if isinstance(translated, lineindex.LineIndex):
+        translated.close()
+    stats.count('sentences', n_lines)
+    stats.count('unique_sentences', n_unique)
+
+
+def main():
+    args = get_arguments()
+    stats = runstats.Stats(enabled=args.stats is not None)
+    progress = runstats.Progress('btplan.py', enabled=stats.enabled)
+    {'plan': plan, 'translate': translate, 'scatter': scatter}[args.command](args, stats)
+
+    if stats.enabled:
+        stats.write(args.stats, 'btplan.py ' + args.command, progress.elapsed())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,213 @@
+'''
+corpusio.py: 拡張子 (.gz, .xz, .bz2) に応じて圧縮ファイルを読み書きする
+    伸長と圧縮はバックグラウンドのスレッドで行い，処理のループと並行させる
+    (zlib, lzma, bz2 は処理中に GIL を解放する)
+    圧縮しないファイルは普通に open() する
+
+    書き込み中の圧縮ファイルは sync() でストリームを閉じ，次のストリームを始める
+    連結したストリームもそのまま伸長できるので，sync() の返す位置まで切り詰めて
+    追記すれば，途中から書き直すことができる (jcsplit.py の --resume)
+'''
+import bz2
+import gzip
+import io
+import lzma
+import os
+import queue
+import threading
+import zlib
+
+BLOCK_SIZE = 1 << 20
+# スレッドとの間に置いておくブロックの数
+QUEUE_SIZE = 8
+
+OPENERS = {
+    '.gz': gzip.open,
+    '.bz2': bz2.open,
+    '.xz': lzma.open,
+}
+COMPRESSORS = {
+    # wbits=31: gzip 形式 (ヘッダの時刻は 0 なので同じ内容なら同じファイルになる)
+    '.gz': lambda: zlib.compressobj(6, zlib.DEFLATED, 31),
+    '.bz2': lambda: bz2.BZ2Compressor(9),
+    '.xz': lambda: lzma.LZMACompressor(lzma.FORMAT_XZ),
+}
+
+
+def compression(path):
+    ''' 圧縮形式の拡張子 ('.gz' など)，圧縮しないファイルなら None '''
+    ext = os.path.splitext(path)[1]
+    return ext if ext in OPENERS else None
+
+
+def split_compression(path):
+    '''
+    (圧縮の拡張子を除いたパス, 圧縮の拡張子) に分ける
+    例: 'output-ja.gz' -> ('output-ja', '.gz'), 'output-ja' -> ('output-ja', '')
+    '''
+    ext = compression(path)
+    if ext is None:
+        return path, ''
+    return path[:-len(ext)], ext
+
+
+class DecompressReader(io.RawIOBase):
+    ''' バックグラウンドのスレッドで伸長したブロックを読む '''
+    def __init__(self, path):
+        self.queue = queue.Queue(QUEUE_SIZE)
+        self.pending = memoryview(b'')
+        self.eof = False
+        self.stopping = False
+        self.error = None
+        self.thread = threading.Thread(target=self.decompress, args=(path,), daemon=True)
+        self.thread.start()
+
+    def decompress(self, path):
+        try:
+            with OPENERS[compression(path)](path, 'rb') as f:
+                while not self.stopping:
+                    block = f.read(BLOCK_SIZE)
+                    if not block:
+                        break
+                    self.queue.put(block)
+        except Exception as e:
+            self.error = e
+        self.queue.put(None)
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        while not self.pending:
+            if self.eof:
+                return 0
+            block = self.queue.get()
+            if block is None:
+                self.eof = True
+                if self.error:
+                    raise self.error
+                return 0
+            self.pending = memoryview(block)
+        n = min(len(b), len(self.pending))
+        b[:n] = self.pending[:n]
+        self.pending = self.pending[n:]
+        return n
+
+    def close(self):
+        if self.closed:
+            return
+        # 途中で閉じる時はスレッドを止め，残りのブロックを捨てる
+        self.stopping = True
+        while not self.eof:
+            self.eof = self.queue.get() is None
+        self.thread.join()
+        super().close()
+
+
+class CompressWriter(io.RawIOBase):
+    ''' 書いたブロックをバックグラウンドのスレッドで圧縮してファイルに書く '''
+    def __init__(self, path, append=False):
+        self.new_compressor = COMPRESSORS[compression(path)]
+        self.file = open(path, 'ab' if append else 'wb')
+        self.offset = self.file.tell()
+        self.queue = queue.Queue(QUEUE_SIZE)
+        self.error = None
+        self.thread = threading.Thread(target=self.compress, daemon=True)
+        self.thread.start()
+
+    def compress(self):
+        compressor = self.new_compressor()
+        while True:
+            item = self.queue.get()
+            if self.error is None:
+                try:
+                    if isinstance(item, bytes):
+                        self.file.write(compressor.compress(item))
+                    else:
+                        # ストリームを閉じる (sync() の時は次のストリームを始める)
+                        self.file.write(compressor.flush())
+                        self.file.flush()
+                        compressor = self.new_compressor()
+                        if item is not None:
+                            os.fsync(self.file.fileno())
+                            self.offset = self.file.tell()
+                except Exception as e:
+                    self.error = e
+            if item is None:
+                self.file.close()
+                return
+            if not isinstance(item, bytes):
+                item.set()
+
+    def check(self):
+        if self.error:
+            raise self.error
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        self.check()
+        self.queue.put(bytes(b))
+        return len(b)
+
+    def sync(self):
+        '''
+        それまでに書いたものを圧縮してディスクに書き出す
+        :return: 圧縮ファイルのこの位置まで切り詰めれば，ここから追記して書き直せる
+        '''
+        done = threading.Event()
+        self.queue.put(done)
+        done.wait()
+        self.check()
+        return self.offset
+
+    def close(self):
+        if self.closed:
+            return
+        self.queue.put(None)
+        self.thread.join()
+        super().close()
+        self.check()
+
+
+def open_file(path, mode='r', encoding='utf-8', buffering=-1):
+    '''
+    open() と同じように開く．圧縮ファイルは 'r', 'w', 'a' (と 'b') のみ
+    'a' は新しいストリームとして追記する
+    :param buffering: 圧縮しないファイルのバッファの大きさ (圧縮ファイルは BLOCK_SIZE)
+    '''
+    if compression(path) is None:
+        if 'b' in mode:
+            return open(path, mode, buffering)
+        return open(path, mode, buffering, encoding=encoding)
+    kind = mode.replace('b', '').replace('t', '')
+    if kind == 'r':
+        f = io.BufferedReader(DecompressReader(path), BLOCK_SIZE)
+    elif kind in ('w', 'a'):
+        f = io.BufferedWriter(CompressWriter(path, kind == 'a'), BLOCK_SIZE)
+    else:
+        raise ValueError('unsupported mode for a compressed file: {0}'.format(mode))
+    if 'b' in mode:
+        return f
+    return io.TextIOWrapper(f, encoding=encoding)
+
+
+def open_truncated(path, offset, encoding='utf-8'):
+    ''' sync() の返した位置までファイルを切り詰めて，続きを書くために開く '''
+    os.truncate(path, offset)
+    return open_file(path, 'a', encoding=encoding)
+
+
+def sync(f):
+    '''
+    書き込み中のファイルの内容をディスクに書き出す
+    :return: open_truncated() に渡して再開できる位置
+    '''
+    f.flush()
+    raw = getattr(f, 'buffer', f)
+    raw = getattr(raw, 'raw', raw)
+    if isinstance(raw, CompressWriter):
+        return raw.sync()
+    os.fsync(f.fileno())
+    return f.tell()
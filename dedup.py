@@ -0,0 +1,137 @@
+'''
+dedup.py: 生成した文の重複除去 (mix-segments.py の --dedup)
+    使用メモリに上限を設けて，一度出力した文かどうかを判定する
+    BloomFilter: 容量が足りなくなったら2倍の大きさのフィルタを追加する (Scalable Bloom Filter)
+        偽陽性 (出力していない文を重複とみなす) の確率は error_rate 以下
+        上限に達したら最後のフィルタに追加し続けるので，偽陽性の確率が上がる
+    HashSet: 文のハッシュ (64 bit) の集合．上限に達したら新しい文は覚えない
+        覚えていない文の重複は残る
+'''
+import hashlib
+import math
+import sys
+
+DEFAULT_MEMORY = 1024  # MB
+DEFAULT_ERROR_RATE = 1e-6
+INITIAL_CAPACITY = 1 << 20
+# 追加するフィルタの偽陽性の確率を前のフィルタの何倍にするか
+TIGHTENING_RATIO = 0.5
+# set の1要素あたりのおよそのバイト数 (int オブジェクトとハッシュ表)
+SET_ENTRY_BYTES = 64
+
+
+def hash_pair(text):
+    ''' 文の 64 bit ハッシュを2つ '''
+    digest = hashlib.blake2b(text.encode('utf-8'), digest_size=16).digest()
+    return int.from_bytes(digest[:8], 'little'), int.from_bytes(digest[8:], 'little')
+
+
+class Filter:
+    ''' 容量 capacity，偽陽性の確率 error_rate の Bloom filter 1つ '''
+    __slots__ = ('capacity', 'n_bits', 'n_hashes', 'bits', 'count')
+
+    def __init__(self, capacity, error_rate):
+        self.capacity = capacity
+        self.n_bits = math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)
+        self.n_hashes = max(1, round(self.n_bits / capacity * math.log(2)))
+        self.bits = bytearray((self.n_bits + 7) // 8)
+        self.count = 0
+
+    def positions(self, h1, h2):
+        return [(h1 + i * h2) % self.n_bits for i in range(self.n_hashes)]
+
+    def __contains__(self, hashes):
+        # 半分ほどのビットが 0 なので，含まれない文はたいてい最初の数個で分かる
+        h1, h2 = hashes
+        bits = self.bits
+        n_bits = self.n_bits
+        for i in range(self.n_hashes):
+            p = (h1 + i * h2) % n_bits
+            if not bits[p >> 3] & (1 << (p & 7)):
+                return False
+        return True
+
+    def add(self, hashes):
+        bits = self.bits
+        for p in self.positions(*hashes):
+            bits[p >> 3] |= 1 << (p & 7)
+        self.count += 1
+
+
+class BloomFilter:
+    '''
+    :param max_bytes: ビット列の合計の上限
+    :param error_rate: 全体の偽陽性の確率
+    '''
+    def __init__(self, max_bytes=DEFAULT_MEMORY << 20, error_rate=DEFAULT_ERROR_RATE,
+                 initial_capacity=INITIAL_CAPACITY):
+        self.max_bytes = max_bytes
+        # 各フィルタの確率の和 (等比級数) が error_rate になるようにする
+        self.error_rate = error_rate * (1 - TIGHTENING_RATIO)
+        self.filters = []
+        self.full = False
+        # 上限が小さければ最初のフィルタを小さくする
+        while not self.grow(initial_capacity) and initial_capacity > 1:
+            initial_capacity //= 2
+        if not self.filters:
+            raise ValueError('memory limit too small for a Bloom filter: {0} bytes'.format(max_bytes))
+
+    def memory(self):
+        return sum(len(f.bits) for f in self.filters)
+
+    def grow(self, capacity):
+        error_rate = self.error_rate * TIGHTENING_RATIO ** len(self.filters)
+        new_filter = Filter(capacity, error_rate)
+        if self.memory() + len(new_filter.bits) > self.max_bytes:
+            return False
+        self.filters.append(new_filter)
+        return True
+
+    def add(self, text):
+        '''
+        文を追加する
+        :return: すでに追加されていた (と判定された) 文なら True
+        '''
+        hashes = hash_pair(text)
+        if any(hashes in f for f in self.filters):
+            return True
+        last = self.filters[-1]
+        if last.count >= last.capacity and not self.full:
+            if not self.grow(last.capacity * 2):
+                self.full = True
+                print('dedup: Bloom filter reached the memory limit, '
+                      'the false positive rate will increase', file=sys.stderr)
+        self.filters[-1].add(hashes)
+        return False
+
+
+class HashSet:
+    ''' 文のハッシュの集合 (max_bytes は SET_ENTRY_BYTES で見積もる) '''
+    def __init__(self, max_bytes=DEFAULT_MEMORY << 20):
+        self.max_entries = max_bytes // SET_ENTRY_BYTES
+        self.hashes = set()
+        self.full = False
+
+    def memory(self):
+        return len(self.hashes) * SET_ENTRY_BYTES
+
+    def add(self, text):
+        ''' :return: すでに追加されていた文なら True '''
+        h = hash_pair(text)[0]
+        if h in self.hashes:
+            return True
+        if len(self.hashes) < self.max_entries:
+            self.hashes.add(h)
+        elif not self.full:
+            self.full = True
+            print('dedup: hash set reached the memory limit, '
+                  'new sentences are no longer remembered', file=sys.stderr)
+        return False
+
+
+def new_deduplicator(kind, max_bytes, error_rate=DEFAULT_ERROR_RATE):
+    if kind == 'bloom':
+        return BloomFilter(max_bytes, error_rate)
+    if kind == 'set':
+        return HashSet(max_bytes)
+    raise ValueError('unknown dedup method: {0}'.format(kind))
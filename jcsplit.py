@@ -3,9 +3,24 @@ jc-split.py:
     日本語ファイルと中国語ファイルの文を単語アラインメントを利用して
     短い文（部分文）に分割する
 使い方:
-    $ python jc-split.py [ -l ログファイル ] アラインメントデータ 入力日本語ファイル 入力中国語ファイル 出力日本語ファイル 出力中国語ファイル
+    $ python jc-split.py [ -l ログファイル ] [ -M マッピングファイル ] アラインメントデータ 入力日本語ファイル 入力中国語ファイル 出力日本語ファイル 出力中国語ファイル
 #                                logfile     alignment-file  input-language-A-file input-language-B-file output-language-A-file output-language-B-file 
 History:
+2026/10/17 - 複数のマシンで分担するオプションを追加 add the option --shard I/N (global sentence numbers, merged by shards.py)
+2026/10/17 - 単語分割済みの入力をトークン ID の配列に変換して mmap するオプションを追加 add the option --token_cache (memory-mapped token id arrays)
+2026/10/17 - アラインメントを CSR 形式の配列に変換して mmap するオプションを追加 add the option --alignment_cache (memory-mapped alignment arrays)
+2026/10/17 - 文字の判定と簡体字化を正規表現と str.translate で文字列ごとに行う，対応表は -s の時だけ読む classify characters with compiled regexes and str.translate, load simple.map lazily
+2026/10/17 - .gz, .xz, .bz2 のファイルをそのまま読み書きする read and write compressed files
+2026/10/17 - 複数の閾値で一度に分割するオプションを追加 add the option --sweep (several minimum rates in one pass)
+2026/10/17 - 分割結果をキャッシュして変わらない文は分割し直さないオプションを追加 add the option --cache (result cache)
+2026/10/17 - 定期的にチェックポイントを保存し，--resume で途中から再開する add checkpoints and the option --resume
+2026/10/17 - 段階ごとの処理時間とカウンタを記録するオプションを追加 add the option --stats (stats file)
+2026/10/17 - セグメント対応を機械可読な Mapping ファイルに出力するオプションを追加，ログは任意に add the option -M (mapping file), the log file is optional
+2026/10/17 - セグメント対応のグループ化を union-find で行う group segment pairs with union-find
+2026/10/17 - セグメントごとの漢字の出現数を一度だけ求めて共有漢字率に使う count hanzi once per segment for the common character rate
+2026/10/17 - Token クラスを廃止し，セグメントはトークン列の範囲として持つ (漢字の簡体字化は必要な時のみ) drop the Token class, segments are views on the token list
+2026/10/17 - セグメント間のアラインメント分布を NumPy で複数文まとめて計算する calculate segment distributions in batches with NumPy
+2026/10/17 - 複数プロセスで並列に分割するオプションを追加 add the option -w (worker processes)
 2018/12/30 - fullオプション使用時の短文出力処理の修正 fix the option -f 
 2018/11/25 - 全角スペースの両側が漢字か仮名なら分割点として使用する fix bugs with the Japanese Full-width Space 
 xx2018/11/18 - 片方が部分文に分割されない場合もログに残すように変更 (jcsplit.py) fix bugs of one-to-one corresponding sentences 
@@ -15,8 +30,28 @@ xx2018/11/18 - 片方が部分文に分割されない場合もログに残す
 2018/05/07 - 最初のバージョン (jc-split.py)  the first version
 '''
 import argparse
+import bisect
+import collections
+import io
+import itertools
+import json
+import multiprocessing
 import sys
 import os
+import re
+
+import aligncache
+import corpusio
+import runstats
+import segmap
+import shards
+import splitcache
+import tokcache
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
 
 # delimiters
 DELIMS = ',，;:、；：'  #（）／'
@@ -30,17 +65,45 @@ DO_SIMPLIFY = False
 # Japanese Kanji -> Simplified Chaninese Character mapping file
 MAPFILE = 'simple.map'
 COMMON_CHAR_WEIGHT = 0.5 #1.0
+# NumPy でまとめて計算する最小の文数
+NUMPY_MIN_BATCH = 32
+# --stats を指定しない時の (何も記録しない) Stats
+NO_STATS = runstats.Stats(enabled=False)
+# チェックポイントを保存する間隔 (文数)
+CHECKPOINT_INTERVAL = 100000
+CHECKPOINT_SUFFIX = '.ckpt'
+
+# 漢字 (is_kanji と同じ範囲)
+KANJI_RE = re.compile('[\u4e00-\u9fea]')
+NON_KANJI_RE = re.compile('[^\u4e00-\u9fea]+')
 
 global kanhan_map
 kanhan_map = {}
+# kanhan_map の str.translate 用の表 (load_hankan_map() で作る)
+kanhan_table = None
 
 def load_hankan_map():
-    global kanhan_map
+    global kanhan_map, kanhan_table
     path = os.path.dirname(os.path.abspath(__file__)) + "/" + MAPFILE
     with open(path, 'r') as f:
         for line in f:
             kanji, hanzi = line.strip().split(',')
             kanhan_map[kanji] = hanzi
+    # 1文字ずつ引くので，2文字以上のキーは使われない
+    kanhan_table = str.maketrans({kanji: hanzi for kanji, hanzi in kanhan_map.items()
+                                  if len(kanji) == 1})
+
+
+def delimiter_tokens(delims):
+    '''
+    `token in delims` (部分文字列の判定) が真になるトークンの集合
+    delims の全ての部分文字列 (空文字列を含む)
+    '''
+    return frozenset(delims[i:j] for i in range(len(delims) + 1)
+                     for j in range(i, len(delims) + 1))
+
+
+DELIM_TOKENS = delimiter_tokens(DELIMS)
 
 
 def is_kanji(c):
@@ -55,24 +118,37 @@ def is_alpha(c):
         (c >= 'A' and c <= 'z')
 
 def simplify(str):
-    global kanhan_map
-    kanjis = [ c for c in str.strip() if is_kanji(c) ]
-    chars = [ kanhan_map[c] if c in kanhan_map else c for c in kanjis ]
-    return ''.join(chars).strip()
+    ''' 漢字だけを取り出して簡体字にする (対応表は最初の呼び出し時に読む) '''
+    if kanhan_table is None:
+        load_hankan_map()
+    return NON_KANJI_RE.sub('', str.strip()).translate(kanhan_table).strip()
 
 
-def common_char_rate(str_zh, str_ja):
-    hanzi_zh = [ c for c in str_zh if is_kanji(c) ]
-    hanzi_ja = [ c for c in str_ja if is_kanji(c) ]
-    denom = len(hanzi_zh) + len(hanzi_ja)
+def count_hanzi(str):
+    ''' 漢字の出現数 (Counter) と漢字の総数を返す '''
+    counts = collections.Counter(KANJI_RE.findall(str))
+    return counts, sum(counts.values())
+
+
+def common_count_rate(hanzi_zh, hanzi_ja):
+    '''
+    count_hanzi() の結果同士で共有漢字率を求める
+    hanzi_zh の漢字のうち hanzi_ja にも現れるものの数 * 2 / 両者の漢字の総数
+    '''
+    counts_zh, n_zh = hanzi_zh
+    counts_ja, n_ja = hanzi_ja
+    denom = n_zh + n_ja
     if denom == 0:
-        rate = 0
+        return 0
+    if len(counts_zh) > len(counts_ja):
+        shared = sum(counts_zh[c] for c in counts_ja if c in counts_zh)
     else:
-        shared_hanzi = [ c for c in hanzi_zh if c in hanzi_ja ]
-        num = len(shared_hanzi) * 2
-        rate = num / denom
+        shared = sum(n for c, n in counts_zh.items() if c in counts_ja)
+    return shared * 2 / denom
+
 
-    return rate
+def common_char_rate(str_zh, str_ja):
+    return common_count_rate(count_hanzi(str_zh), count_hanzi(str_ja))
     
 def get_arguments():
     parser = argparse.ArgumentParser()
@@ -86,14 +162,45 @@ def get_arguments():
                         help='output Japanese file')
     parser.add_argument('output_chinese_file',
                         help='output Chinese file')
-    parser.add_argument('-l', '--log_file', required=True,
+    parser.add_argument('-l', '--log_file',
                         help='log file')
+    parser.add_argument('-M', '--mapping_file',
+                        help='segment mapping file (for mix-segments.py)')
     parser.add_argument('-m', '--minimum_rate',
                         help='minimum rate')
     parser.add_argument('-s', '--simplify', action='store_true',
                         help='simplify Japanese kanjis')
     parser.add_argument('-f', '--full', action='store_true',
                         help='log all sentences')
+    parser.add_argument('-w', '--workers', type=int, default=1,
+                        help='number of worker processes')
+    parser.add_argument('--chunk_size', type=int, default=1000,
+                        help='number of sentences sent to a worker at once')
+    parser.add_argument('--stats',
+                        help='write per-stage times and counters to this file (JSON)')
+    parser.add_argument('--checkpoint',
+                        help='checkpoint file (default: output_japanese_file + "{0}")'.format(
+                            CHECKPOINT_SUFFIX))
+    parser.add_argument('--checkpoint_interval', type=int, default=CHECKPOINT_INTERVAL,
+                        help='number of sentences between checkpoints (0: no checkpoints)')
+    parser.add_argument('--resume', action='store_true',
+                        help='resume from the checkpoint')
+    parser.add_argument('--sweep',
+                        help='comma-separated minimum rates (e.g. 0.3,0.4,0.5): split once and '
+                             'write the outputs of each rate to the output files + ".RATE"')
+    parser.add_argument('--cache',
+                        help='result cache file (SQLite), reused across runs')
+    parser.add_argument('--cache_size', type=int, default=splitcache.DEFAULT_CACHE_SIZE,
+                        help='maximum size of the result cache in MB')
+    parser.add_argument('--alignment_cache',
+                        help='directory of the parsed alignment arrays (built on first use, '
+                        'memory-mapped by all workers)')
+    parser.add_argument('--shard', type=shards.parse_shard,
+                        help='process only the I-th of N equal line ranges of the inputs, '
+                        'e.g. 2/4 (sentence numbers stay global; merge with shards.py)')
+    parser.add_argument('--token_cache',
+                        help='directory of the tokenized input arrays (built on first use, '
+                        'memory-mapped by all workers)')
     
     return parser.parse_args()
 
@@ -106,99 +213,153 @@ def get_arguments():
 #LOG_FILE = 'log'
 
 
-class Token:
-    def __init__(self, id, text, a_tokens=[], a_segment=None):
-        self.id = id
-        self.text = text
-        self.hanzi = simplify(text)
-        self.a_tokens = a_tokens    # alignment (counter part tokens)
-        self.a_segment = a_segment  # counter part segment
-
-
 class Segment:
-    def __init__(self, id, tokens):
+    '''
+    文のトークン列の [start, end) の範囲を指す部分文
+    '''
+    __slots__ = ('id', 'token_texts', 'start', 'end',
+                 'segment_align_dist', 'segment_alignments', '_hanzi_counts')
+
+    def __init__(self, id, token_texts, start, end):
         self.id = id
-        self.tokens = tokens
+        self.token_texts = token_texts  # tokens of the whole sentence (shared)
+        self.start = start
+        self.end = end
         self.segment_align_dist = {}  # counter part segments (dict)
         self.segment_alignments = []
-    
+        self._hanzi_counts = None
+
     def text(self):
-        token_texts = [t.text for t in self.tokens]
-        return ' '.join(token_texts)
+        return ' '.join(self.token_texts[self.start:self.end])
 
     def hanzi(self):
-        hanzi_texts = [ t.hanzi for t in self.tokens ]
-        return ''.join(hanzi_texts)
+        return simplify(''.join(self.token_texts[self.start:self.end]))
+
+    def hanzi_counts(self):
+        ''' 簡体字化した漢字の count_hanzi() (最初の呼び出し時に計算して保持する) '''
+        if self._hanzi_counts is None:
+            self._hanzi_counts = count_hanzi(self.hanzi())
+        return self._hanzi_counts
 
 
 class Sentence:
+    __slots__ = ('token_texts', 'n_tokens', 'alignment', 'segments', 'segment_ends')
+
     def __init__(self, text, delims, alignment):
-        self.segments = []
-        tokens = []
-        segment_id = 0
         token_text_list = text.strip().split(' ')
         n_tokens = len(token_text_list)
+        self.token_texts = token_text_list
+        self.n_tokens = n_tokens
+        self.alignment = alignment  # token id -> counter part token ids
+        self.segments = []
+        self.segment_ends = []      # last token id of each segment
+        start = 0
+
+        # 区切りのトークンの位置をまとめて求める (最後のトークンも区切り)
+        delim_tokens = DELIM_TOKENS if delims == DELIMS else delimiter_tokens(delims)
+        ends = list(itertools.compress(range(n_tokens),
+                                       map(delim_tokens.__contains__, token_text_list)))
+        if ends[-1:] != [n_tokens - 1]:
+            ends.append(n_tokens - 1)
+
+        for i in ends:
+            # end of segment
+            if token_text_list[i] == WIDE_SPACE:
+                if i == 0 or i == n_tokens - 1:
+                    continue
+                prev_char = token_text_list[i-1][-1]
+                if is_alpha(prev_char) and is_alpha(prev_char):
+                    continue
+            segment = Segment(id=len(self.segments), token_texts=token_text_list,
+                              start=start, end=i + 1)
+            self.segments.append(segment)
+            self.segment_ends.append(i)
+            start = i + 1
+
+    @classmethod
+    def from_tokens(cls, tokens, token_ids, ends, alignment):
+        '''
+        tokcache.TokenCache.lines() の結果から Sentence(text, DELIMS, alignment) と同じ文を作る
+        トークンの文字列は部分文のテキストが必要になった時に語彙表から引く
+        :param tokens: tokcache.TokenCache
+        :param ends: 区切りのトークンの位置のリスト
+        '''
+        self = cls.__new__(cls)
+        n_tokens = len(token_ids)
+        token_texts = tokcache.TokenTexts(token_ids, tokens.vocab)
+        self.token_texts = token_texts
+        self.n_tokens = n_tokens
+        self.alignment = alignment
+        self.segments = []
+        self.segment_ends = []
+        start = 0
+
+        flags = tokens.flag_list
+        if ends[-1:] != [n_tokens - 1]:
+            ends.append(n_tokens - 1)
+
+        for i in ends:
+            if flags[token_ids[i]] & tokcache.WIDE_SPACE:
+                if i == 0 or i == n_tokens - 1:
+                    continue
+                prev_flags = flags[token_ids[i-1]]
+                if prev_flags & tokcache.EMPTY:
+                    # Sentence() と同じく空のトークンの最後の文字は IndexError
+                    raise IndexError('string index out of range')
+                if prev_flags & tokcache.ALPHA_END:
+                    continue
+            segment = Segment(id=len(self.segments), token_texts=token_texts,
+                              start=start, end=i + 1)
+            self.segments.append(segment)
+            self.segment_ends.append(i)
+            start = i + 1
+        return self
 
-        for i in range(n_tokens):
-            token_text = token_text_list[i]
-            # token alignment
-            a_tokens = []
-            if i in alignment:
-                a_tokens = alignment[i]
-            token = Token(id=i, text=token_text, a_tokens=a_tokens)
-
-            tokens.append(token)
-
-            if token_text in delims or (i + 1 == n_tokens):
-                # end of segment
-                if token_text == WIDE_SPACE:
-                    if i == 0 or i == n_tokens - 1:
-                        continue
-                    prev_char = token_text_list[i-1][-1]
-                    next_char = token_text_list[i+1][0]
-                    # print(prev_char, is_alpha(prev_char), next_char, is_alpha(next_char))
-                    if is_alpha(prev_char) and is_alpha(prev_char):
-                        continue
-                segment = Segment(id=segment_id, tokens=tokens)
-                self.segments.append(segment)
-                segment_id += 1
-                tokens = []
-    
     def segment_from_token(self, token_id):
-        seg_id = None
-        for seg in self.segments:
-            if token_id <= seg.tokens[-1].id:
-                seg_id = seg.id
-                break
+        seg_id = bisect.bisect_left(self.segment_ends, token_id)
+        if seg_id == len(self.segment_ends):
+            return None
         return seg_id
 
+    def alignment_links(self):
+        '''
+        セグメント内のトークンのアラインメントを (自分側トークン, 相手側トークン) の
+        リストとしてトークン順に返す
+        '''
+        src_tokens = []
+        tgt_tokens = []
+        if not self.segment_ends:
+            return src_tokens, tgt_tokens
+        last_token = self.segment_ends[-1]
+        for i in sorted(self.alignment):
+            if i > last_token:
+                break
+            a_tokens = self.alignment[i]
+            src_tokens += [i] * len(a_tokens)
+            tgt_tokens += a_tokens
+        return src_tokens, tgt_tokens
+
     def calc_segment_dist(self, other_sentence, minimum_rate, do_simplify):
-        for i, seg in enumerate(self.segments):
-            n_tokens = 0
-            for t in seg.tokens:
-                if t.a_tokens:
-                    # counter part exists
-                    for a_token in t.a_tokens:
-                        n_tokens += 1
-                        other_seg = other_sentence.segment_from_token(a_token)
-                        if other_seg in self.segments[i].segment_align_dist:
-                            self.segments[i].segment_align_dist[other_seg] += 1
-                        else:
-                            self.segments[i].segment_align_dist[other_seg] = 1
+        calc_segment_dists([(self, other_sentence)], minimum_rate, do_simplify)
+
+    def set_segment_dist(self, link_counts, other_sentence, minimum_rate, do_simplify):
+        '''
+        セグメントごとのアラインメント数から segment_align_dist と segment_alignments を求める
+        :param link_counts: セグメントごとの {相手側セグメントID: アラインメント数}
+        '''
+        for i, counts in enumerate(link_counts):
             # convert 'occurence count' to 'rate'
-            #n_tokens = len(seg.tokens)
+            n_tokens = sum(counts.values())
+            for key in counts:
+                self.segments[i].segment_align_dist[key] = round(counts[key] / n_tokens, 2)
 
-            for key in self.segments[i].segment_align_dist:
-                freq = self.segments[i].segment_align_dist[key]
-                self.segments[i].segment_align_dist[key] = round(freq / n_tokens, 2)
-            
             # add common character rate
             if do_simplify:
-                hanzi1 = self.segments[i].hanzi()
+                hanzi1 = self.segments[i].hanzi_counts()
                 for key in self.segments[i].segment_align_dist:
                     # DEBUG
                     try:
-                        hanzi2 = other_sentence.segments[key].hanzi()
+                        hanzi2 = other_sentence.segments[key].hanzi_counts()
                     except TypeError:
                         print('type(key):', type(key), file=sys.stderr)
                         print('hanzi1 =', hanzi1, file=sys.stderr)
@@ -206,10 +367,10 @@ class Sentence:
                         print('i =', i, file=sys.stderr)
                         print('segments[i].segment_align_dist:', self.segments[i].segment_align_dist, file=sys.stderr)
                         exit()
-                    ccr = common_char_rate(hanzi1, hanzi2)
+                    ccr = common_count_rate(hanzi1, hanzi2)
                     if ccr > 0.5:
                         self.segments[i].segment_align_dist[key] += ccr * COMMON_CHAR_WEIGHT
-                
+
             # sort
             sorted_dist = sorted(self.segments[i].segment_align_dist.items(), \
                                     key=lambda x:x[1], reverse=True)
@@ -218,12 +379,21 @@ class Sentence:
             # 最大値のみ記録
             #if len(sorted_dist) > 0 and sorted_dist[0][1] > minimum_rate:
             #    self.segments[i].segment_alignment = sorted_dist[0][0]
-            
+
             # minimum_rate以上の全てを記録
             for j in range(len(sorted_dist)):
                 if sorted_dist[j][1] >= minimum_rate:
                     self.segments[i].segment_alignments.append(sorted_dist[j][0])
 
+    def set_segment_alignments(self, minimum_rate):
+        '''
+        求めてある segment_align_dist から，minimum_rate 以上の相手側セグメントを
+        segment_alignments にし直す (閾値だけを変えて分割し直す時に使う)
+        '''
+        for segment in self.segments:
+            segment.segment_alignments = [key for key, rate in segment.segment_align_dist
+                                          if rate >= minimum_rate]
+
     def text(self):
         text = ''
         for seg in self.segments:
@@ -240,40 +410,34 @@ class Sentence:
             for a in seg2.segment_alignments:
                 pairs.add((a, seg2.id))
 
-        ordered_pairs = sorted(pairs, key=lambda x:x[0])
-
-        segment_pairs = []
-        for pair in ordered_pairs:
-            used = []
-            for i, seg_pair in enumerate(segment_pairs):
-                if pair[0] in seg_pair[0]:
-                    segment_pairs[i][1].append(pair[1])
-                    used.append(i)
-                elif pair[1] in seg_pair[1]:
-                    segment_pairs[i][0].append(pair[0])
-                    used.append(i)
-            if not used:
-                segment_pairs.append([[pair[0]], [pair[1]]])
-            elif len(used) > 1:
-                # len(used) should be 2
-                assert len(used) == 2, 'len(used)={0}'.format(len(used))
-                # merge pairs
-                idx0 = used[0]
-                idx1 = used[1]
-                # segment_pairs[idx0][0] += segment_pairs[idx1][0]
-                for i in segment_pairs[idx1][0]:
-                    if i not in segment_pairs[idx0][0]:
-                        segment_pairs[idx0][0].append(i)
-                #segment_pairs[idx0][1] += segment_pairs[idx1][1]
-                for i in segment_pairs[idx1][1]:
-                    if i not in segment_pairs[idx0][1]:
-                        segment_pairs[idx0][1].append(i)
-                del segment_pairs[idx1]
-
-        # sort
-        for i in range(len(segment_pairs)):
-            for j in [0, 1]:
-                segment_pairs[i][j] = sorted(segment_pairs[i][j])
+        # union-find: 日本語セグメント (0, id) と中国語セグメント (1, id) を
+        # セグメント対応で結ばれたグループにまとめる
+        parent = {}
+
+        def find(node):
+            root = node
+            while parent[root] != root:
+                root = parent[root]
+            while parent[node] != root:
+                parent[node], node = root, parent[node]
+            return root
+
+        for j, c in pairs:
+            parent.setdefault((0, j), (0, j))
+            parent.setdefault((1, c), (1, c))
+            root_j = find((0, j))
+            root_c = find((1, c))
+            if root_j != root_c:
+                parent[root_c] = root_j
+
+        groups = {}
+        for node in parent:
+            group = groups.setdefault(find(node), [[], []])
+            group[node[0]].append(node[1])
+
+        # 各グループの日本語セグメントIDの最小値の順
+        segment_pairs = [[sorted(group[0]), sorted(group[1])] for group in groups.values()]
+        segment_pairs.sort(key=lambda x:x[0][0])
 
         return segment_pairs
 
@@ -304,6 +468,192 @@ def make_alignment_dicts(alignment_text):
     return j2c_align, c2j_align
 
 
+def parse_alignments(alignment_texts):
+    '''
+    複数行のアラインメントをまとめて配列に変換する
+    :return: (日本語トークン, 中国語トークン, 行番号) の配列 (行内は元の順序)
+             形式が正しくない行があれば None
+    '''
+    # aligncache と同じ規則で解析する ("3-3-4" などがあれば make_alignment_dicts() を使う)
+    parsed = aligncache.parse_strict([text.strip() for text in alignment_texts])
+    if parsed is None:
+        return None
+    j_tokens, c_tokens, n_links = parsed
+    lines = np.repeat(np.arange(len(n_links), dtype=np.int64), n_links)
+    return j_tokens, c_tokens, lines
+
+
+def sentence_links(sentence_pairs):
+    ''' Sentence.alignment から count_links_numpy() の links を作る '''
+    src_tokens = []
+    tgt_tokens = []
+    n_links = []
+    for sentence, _ in sentence_pairs:
+        src, tgt = sentence.alignment_links()
+        src_tokens += src
+        tgt_tokens += tgt
+        n_links.append(len(src))
+    return np.array(src_tokens, dtype=np.int64), np.array(tgt_tokens, dtype=np.int64), \
+        np.repeat(np.arange(len(sentence_pairs), dtype=np.int64), n_links)
+
+
+def concat_segment_ends(sentences):
+    '''
+    全文のセグメント末尾トークンを，文ごとのトークン位置をずらして1つの配列にする
+    :return: (segment_ends, 文ごとのトークンのオフセット, 文ごとのセグメント数,
+              文ごとの最後のセグメントの末尾 (セグメントがなければ -1))
+    '''
+    n_tokens = np.array([s.n_tokens for s in sentences], dtype=np.int64)
+    n_segs = np.array([len(s.segment_ends) for s in sentences], dtype=np.int64)
+    last = np.array([s.segment_ends[-1] if s.segment_ends else -1 for s in sentences],
+                    dtype=np.int64)
+    token_offset = np.cumsum(n_tokens) - n_tokens
+    ends = np.fromiter(itertools.chain.from_iterable(s.segment_ends for s in sentences),
+                       dtype=np.int64, count=int(n_segs.sum()))
+    ends += np.repeat(token_offset, n_segs)
+    return ends, token_offset, n_segs, last
+
+
+def count_links_numpy(sentence_pairs, links=None, links_sorted=False):
+    '''
+    トークン→セグメントの対応を searchsorted で，セグメント間のアラインメント数を
+    np.unique でまとめて求める
+    :param links: (自分側トークン, 相手側トークン, 文対の番号) の配列．
+                  None なら各 Sentence の alignment から作る
+    :param links_sorted: links がすでに文対・自分側トークンの順 (同じトークンは元の順) なら True
+    :return: 文対ごとに，セグメントごとの {相手側セグメントID: アラインメント数} (初出順)
+    '''
+    link_counts = [[{} for _ in sentence.segments] for sentence, _ in sentence_pairs]
+    if links is None:
+        links = sentence_links(sentence_pairs)
+    src_tokens, tgt_tokens, link_pair = links
+
+    src_ends, src_token_offset, n_src_segs, src_last = \
+        concat_segment_ends([sentence for sentence, _ in sentence_pairs])
+    tgt_ends, tgt_token_offset, n_tgt_segs, tgt_last = \
+        concat_segment_ends([other_sentence for _, other_sentence in sentence_pairs])
+
+    # セグメントに入っているトークンのアラインメントだけを，文対・トークン順に並べる
+    # (同じトークンのアラインメントは元の順序のまま)
+    inside = src_tokens <= src_last[link_pair]
+    src_tokens = src_tokens[inside]
+    tgt_tokens = tgt_tokens[inside]
+    link_pair = link_pair[inside]
+    if len(src_tokens) == 0:
+        return link_counts
+    if not links_sorted:
+        order = np.lexsort((src_tokens, link_pair))
+        src_tokens = src_tokens[order]
+        tgt_tokens = tgt_tokens[order]
+        link_pair = link_pair[order]
+
+    # token -> segment
+    src_seg_offset = np.cumsum(n_src_segs) - n_src_segs
+    tgt_seg_offset = np.cumsum(n_tgt_segs) - n_tgt_segs
+    src_segs = np.searchsorted(src_ends, src_tokens + src_token_offset[link_pair])
+    tgt_segs = np.searchsorted(tgt_ends, tgt_tokens + tgt_token_offset[link_pair])
+    tgt_segs -= tgt_seg_offset[link_pair]
+    # セグメント外のトークンは None (= n_tgt_segs) とする
+    outside = tgt_tokens > tgt_last[link_pair]
+    tgt_segs[outside] = n_tgt_segs[link_pair][outside]
+
+    # (自分側セグメント, 相手側セグメント) ごとの出現数と初出位置
+    stride = int(n_tgt_segs.max()) + 1
+    keys = src_segs * stride + tgt_segs
+    uniq_keys, first, counts = np.unique(keys, return_index=True, return_counts=True)
+    order = np.lexsort((first, uniq_keys // stride))
+    key_src_segs = (uniq_keys // stride)[order]
+    key_pairs = link_pair[first[order]]
+    key_src_segs -= src_seg_offset[key_pairs]
+    key_tgt_segs = (uniq_keys % stride)[order]
+    key_n_tgt_segs = n_tgt_segs[key_pairs]
+
+    for k, i, j, n, count in zip(key_pairs.tolist(), key_src_segs.tolist(),
+                                 key_tgt_segs.tolist(), key_n_tgt_segs.tolist(),
+                                 counts[order].tolist()):
+        link_counts[k][i][j if j < n else None] = count
+    return link_counts
+
+
+def count_links_python(sentence_pairs):
+    link_counts = []
+    for sentence, other_sentence in sentence_pairs:
+        counts = [{} for _ in sentence.segments]
+        for src, tgt in zip(*sentence.alignment_links()):
+            seg_counts = counts[sentence.segment_from_token(src)]
+            other_seg = other_sentence.segment_from_token(tgt)
+            seg_counts[other_seg] = seg_counts.get(other_seg, 0) + 1
+        link_counts.append(counts)
+    return link_counts
+
+
+def calc_segment_dists(sentence_pairs, minimum_rate, do_simplify, links=None,
+                       links_sorted=False):
+    '''
+    複数の文対について，各セグメントの相手側セグメントへの分布をまとめて計算する
+    :param sentence_pairs: (sentence, other_sentence) のリスト
+    :param links: count_links_numpy() の links (省略時は Sentence.alignment を使う)
+    '''
+    if np is not None and (links is not None or len(sentence_pairs) >= NUMPY_MIN_BATCH):
+        link_counts = count_links_numpy(sentence_pairs, links, links_sorted)
+    else:
+        link_counts = count_links_python(sentence_pairs)
+    for (sentence, other_sentence), counts in zip(sentence_pairs, link_counts):
+        sentence.set_segment_dist(counts, other_sentence, minimum_rate, do_simplify)
+
+
+def split_sentences(lines, minimum_rate, do_simplify, stats=NO_STATS, links=None,
+                    tokens=None):
+    '''
+    複数の文を部分文に分割する
+    :param lines: (jp_line, ch_line, alignment_text) のリスト
+    :param stats: 段階ごとの時間を記録する runstats.Stats
+    :param links: aligncache.AlignmentCache.links() の配列．指定すると alignment_text は使わない
+    :param tokens: 文ごとの (日本語, 中国語) の Sentence.from_tokens() の引数 (alignment 以外)
+                   指定すると jp_line と ch_line は使わない
+    :return: (segment_pairs, jp_sentence, ch_sentence) のリスト
+    '''
+    alignments = None
+    with stats.timer('parse_alignment'):
+        if links is None and np is not None and len(lines) >= NUMPY_MIN_BATCH:
+            # アラインメントは辞書にせず配列のまま使う
+            alignments = parse_alignments([alignment_text for _, _, alignment_text in lines])
+        if links is None and alignments is None:
+            alignment_dicts = [make_alignment_dicts(alignment_text)
+                               for _, _, alignment_text in lines]
+        else:
+            alignment_dicts = itertools.repeat((None, None))
+
+    sentences = []
+    with stats.timer('sentence'):
+        if tokens is None:
+            for (jp_line, ch_line, _), (j2c_align, c2j_align) in zip(lines, alignment_dicts):
+                jp_sentence = Sentence(text=jp_line, delims=DELIMS, alignment=j2c_align)
+                ch_sentence = Sentence(text=ch_line, delims=DELIMS, alignment=c2j_align)
+                sentences.append((jp_sentence, ch_sentence))
+        else:
+            for (jp_tokens, ch_tokens), (j2c_align, c2j_align) in zip(tokens, alignment_dicts):
+                jp_sentence = Sentence.from_tokens(*jp_tokens, alignment=j2c_align)
+                ch_sentence = Sentence.from_tokens(*ch_tokens, alignment=c2j_align)
+                sentences.append((jp_sentence, ch_sentence))
+
+    links_sorted = links is not None
+    if alignments is not None:
+        # J -> C の文対のあとに C -> J の文対を並べる
+        j_tokens, c_tokens, line_no = alignments
+        links = (np.concatenate([j_tokens, c_tokens]),
+                 np.concatenate([c_tokens, j_tokens]),
+                 np.concatenate([line_no, line_no + len(sentences)]))
+    with stats.timer('calc_segment_dist'):
+        calc_segment_dists(sentences + [(ch, jp) for jp, ch in sentences],
+                           minimum_rate, do_simplify, links, links_sorted)
+
+    with stats.timer('get_segment_pairs'):
+        return [(Sentence.get_segment_pairs(jp_sentence, ch_sentence),
+                 jp_sentence, ch_sentence)
+                for jp_sentence, ch_sentence in sentences]
+
+
 def split_sentence(jp_line, ch_line, alignment_text, minimum_rate, do_simplify):
     '''
     Split sentence into sub-sentences, and return sub-sentence pairs to output
@@ -313,130 +663,591 @@ def split_sentence(jp_line, ch_line, alignment_text, minimum_rate, do_simplify):
     :return: sub-sentence pairs to output
     '''
 
-    j2c_align, c2j_align = make_alignment_dicts(alignment_text)
+    return split_sentences([(jp_line, ch_line, alignment_text)],
+                           minimum_rate, do_simplify)[0]
 
-    jp_sentence = Sentence(text=jp_line, delims=DELIMS, alignment=j2c_align)
-    ch_sentence = Sentence(text=ch_line, delims=DELIMS, alignment=c2j_align)
 
-    jp_sentence.calc_segment_dist(ch_sentence, minimum_rate, do_simplify)
-    ch_sentence.calc_segment_dist(jp_sentence, minimum_rate, do_simplify)
+def format_sentence(sentence_no, segment_pairs, jp_sentence, ch_sentence, full,
+                    write_log=True):
+    '''
+    分割結果からログと出力する部分文のテキストを作る
+    :return: (split, n_short_sentence, log_text, jp_text, ch_text, mapping)
+             mapping はログに記録する文なら segment_pairs, それ以外は None
+    '''
+    split = len(segment_pairs) > 1
+    if not split and not full:
+        return split, 0, '', '', '', None
 
+    flog = io.StringIO()
+    if write_log:
+        print('#{0}'.format(sentence_no), file=flog)
+        print('Japanese:', jp_sentence.text(), file=flog)
+        print('Chinese: ', ch_sentence.text(), file=flog)
+        print('--', file=flog)
+        print('J -> C', file=flog)
+        jp_sentence.print_segment_dist(flog)
+        print('C -> J', file=flog)
+        ch_sentence.print_segment_dist(flog)
 
-    segment_pairs = Sentence.get_segment_pairs(jp_sentence, ch_sentence)
+        print('Mapping:', segment_pairs, file=flog)
+        print('----', file=flog)
 
-    return segment_pairs, jp_sentence, ch_sentence
+    if not split:
+        return split, 0, flog.getvalue(), '', '', segment_pairs
 
+    jp_texts = []
+    ch_texts = []
+    for pair in segment_pairs:
+        jp_segs = pair[0]
+        jp_seg_text = ''
+        for seg_id in jp_segs:
+            seg = jp_sentence.segments[seg_id]
+            jp_seg_text += ' ' + seg.text()
+            if write_log:
+                print('J{0}: {1}'.format(seg_id, seg.text()), file=flog)
+        jp_texts.append(jp_seg_text.strip() + '\n')
 
-if __name__ == '__main__':
-    load_hankan_map()
+        ch_segs = pair[1]
+        ch_seg_text = ''
+        for seg_id in ch_segs:
+            seg = ch_sentence.segments[seg_id]
+            ch_seg_text += ' ' + seg.text()
+            if write_log:
+                print('C{0}: {1}'.format(seg_id, seg.text()), file=flog)
+        ch_texts.append(ch_seg_text.strip() + '\n')
+
+        if write_log:
+            print('--', file=flog)
+
+    return split, len(segment_pairs), flog.getvalue(), \
+        ''.join(jp_texts), ''.join(ch_texts), segment_pairs
+
+
+def read_chunks(fin_align, fin_jp, fin_ch, chunk_size, sentence_no=1, positions=None,
+                end=None):
+    '''
+    (アラインメント, 日本語, 中国語) の行を chunk_size 文ずつまとめて返す
+    :param sentence_no: 最初の文の番号 (途中から再開する時)
+    :param end: 指定するとこの番号の文の手前で止める (--shard)
+    :param positions: 指定するとチャンクを読むごとに3つのファイルの読み込み位置
+                      (tell() の値, 圧縮ファイルは None) を追加する
+    '''
+    files = (fin_align, fin_jp, fin_ch)
+    seekable = [f.seekable() for f in files]
+    while True:
+        chunk = []
+        for _ in range(chunk_size if end is None else min(chunk_size, end - sentence_no)):
+            alignment = fin_align.readline()
+            if not alignment:
+                break
+            chunk.append((alignment, fin_jp.readline(), fin_ch.readline()))
+        if not chunk:
+            break
+        if positions is not None:
+            positions.append(tuple(f.tell() if can_seek else None
+                                   for f, can_seek in zip(files, seekable)))
+        yield sentence_no, chunk
+        sentence_no += len(chunk)
+
+
+def skip_lines(files, n_lines):
+    ''' 3つのファイルを n_lines 行ずつ読み飛ばす '''
+    for f in files:
+        for _ in range(n_lines):
+            f.readline()
+
+
+def shard_sentences(args):
+    '''
+    --shard I/N: アラインメントファイルの行を N 等分した I 番目の (最初の文の番号, 最後の文の番号 + 1)
+    指定されていなければ (1, None)
+    '''
+    if not args.shard:
+        return 1, None
+    return shards.shard_range(1, shards.count_lines(args.alignment) + 1, args.shard)
+
+
+def shard_input_size(args, first_sentence_no, end_sentence_no):
+    '''
+    進捗率の計算に使うアラインメントファイルの大きさ
+    --shard ではシャードの行のバイト数 (alignment_bytes はシャードの行だけを数える)
+    '''
+    total_bytes = runstats.input_size(args.alignment)
+    if not args.shard or total_bytes is None:
+        return total_bytes
+    start, end = shards.line_offsets(args.alignment,
+                                     [first_sentence_no - 1, end_sentence_no - 1])
+    return end - start
+
+
+def drop_texts(chunks):
+    '''
+    --token_cache: ワーカーは配列から文を作るので，日本語と中国語の行はワーカーに送らない
+    (チェックポイントの読み込み位置と --cache のキーのために行は読んでおく)
+    '''
+    for sentence_no, chunk in chunks:
+        yield sentence_no, [None if line is None else (line[0], None, None) for line in chunk]
+
+
+def init_worker(minimum_rate, do_simplify, full, write_log, with_stats=False,
+                alignment_cache=None, token_cache=None):
+    '''
+    :param alignment_cache: aligncache のディレクトリ (各プロセスで mmap する)
+    :param token_cache: 日本語と中国語の tokcache のディレクトリ (各プロセスで mmap する)
+    '''
+    global worker_options, worker_alignments, worker_tokens
+    worker_options = (minimum_rate, do_simplify, full, write_log, with_stats)
+    worker_alignments = None
+    if alignment_cache:
+        worker_alignments = aligncache.AlignmentCache(alignment_cache)
+    worker_tokens = None
+    if token_cache:
+        worker_tokens = [tokcache.TokenCache(directory) for directory in token_cache]
+
+
+def chunk_links(sentence_no, indexes):
+    ''' --alignment_cache の配列から，チャンクの indexes 番目の文のリンクを取り出す '''
+    if worker_alignments is None:
+        return None
+    return worker_alignments.links([sentence_no - 1 + i for i in indexes])
+
+
+def chunk_tokens(sentence_no, indexes):
+    ''' --token_cache の配列から，チャンクの indexes 番目の文の split_sentences() の tokens を作る '''
+    if worker_tokens is None:
+        return None
+    rows = [sentence_no - 1 + i for i in indexes]
+    jp_cache, ch_cache = worker_tokens
+    return [((jp_cache,) + jp_line, (ch_cache,) + ch_line)
+            for jp_line, ch_line in zip(jp_cache.lines(rows), ch_cache.lines(rows))]
+
+
+def count_chunk(stats, chunk, split_results, results):
+    ''' チャンクの文, セグメント, 複雑な対応などの数を stats に加える '''
+    stats.count('sentences', len(chunk))
+    # アラインメントは ASCII なので文字数 = バイト数 (進捗の計算に使う)
+    stats.count('alignment_bytes', sum(len(alignment) for alignment, _, _ in chunk))
+    for (segment_pairs, jp_sentence, ch_sentence), result in zip(split_results, results):
+        stats.count('ja_segments', len(jp_sentence.segments))
+        stats.count('zh_segments', len(ch_sentence.segments))
+        if result[0]:
+            stats.count('split_sentences')
+            stats.count('short_sentences', result[1])
+            if segmap.is_complicated(segment_pairs):
+                stats.count('complicated_mappings')
+
+
+def process_chunk(numbered_chunk):
+    '''
+    :param numbered_chunk: (sentence_no, chunk) chunk の None の文 (キャッシュにある文) は
+                           処理せず，結果も None にする
+    :return: (sentence_no, results, stats) stats は --stats を指定しない時 None
+    '''
+    sentence_no, chunk = numbered_chunk
+    minimum_rate, do_simplify, full, write_log, with_stats = worker_options
+    stats = runstats.Stats() if with_stats else NO_STATS
+    indexes = [i for i, line in enumerate(chunk) if line is not None]
+    lines = [(chunk[i][1], chunk[i][2], chunk[i][0]) for i in indexes]
+    with stats.timer('parse_alignment'):
+        links = chunk_links(sentence_no, indexes)
+    with stats.timer('sentence'):
+        tokens = chunk_tokens(sentence_no, indexes)
+    split_results = split_sentences(lines, minimum_rate, do_simplify, stats, links, tokens)
+    results = [None] * len(chunk)
+    with stats.timer('format'):
+        for i, (segment_pairs, jp_sentence, ch_sentence) in zip(indexes, split_results):
+            results[i] = format_sentence(sentence_no + i, segment_pairs,
+                                         jp_sentence, ch_sentence, full, write_log)
+    if not with_stats:
+        return sentence_no, results, None
+    count_chunk(stats, [chunk[i] for i in indexes], split_results,
+                [results[i] for i in indexes])
+    return sentence_no, results, stats.to_dict()
+
+
+def init_sweep_worker(minimum_rates, do_simplify, full, write_log, alignment_cache=None,
+                      token_cache=None):
+    global sweep_rates
+    init_worker(minimum_rates[0], do_simplify, full, write_log,
+                alignment_cache=alignment_cache, token_cache=token_cache)
+    sweep_rates = minimum_rates
+
+
+def process_sweep_chunk(numbered_chunk):
+    '''
+    セグメントの分布は一度だけ計算し，閾値ごとに部分文対を求め直す
+    :return: (sentence_no, results) results は文ごとの閾値ごとの format_sentence() の結果
+    '''
+    sentence_no, chunk = numbered_chunk
+    _, do_simplify, full, write_log, _ = worker_options
+    lines = [(jp_line, ch_line, alignment) for alignment, jp_line, ch_line in chunk]
+    links = chunk_links(sentence_no, range(len(chunk)))
+    tokens = chunk_tokens(sentence_no, range(len(chunk)))
+    results = []
+    for i, (_, jp_sentence, ch_sentence) in \
+            enumerate(split_sentences(lines, sweep_rates[0], do_simplify, links=links,
+                                      tokens=tokens)):
+        sentence_results = []
+        # 閾値が変わってもセグメントの対応が同じなら結果も同じ
+        known_results = {}
+        for minimum_rate in sweep_rates:
+            jp_sentence.set_segment_alignments(minimum_rate)
+            ch_sentence.set_segment_alignments(minimum_rate)
+            key = tuple(tuple(seg.segment_alignments)
+                        for seg in jp_sentence.segments + ch_sentence.segments)
+            if key not in known_results:
+                segment_pairs = Sentence.get_segment_pairs(jp_sentence, ch_sentence)
+                known_results[key] = format_sentence(sentence_no + i, segment_pairs,
+                                                     jp_sentence, ch_sentence, full, write_log)
+            sentence_results.append(known_results[key])
+        results.append(sentence_results)
+    return sentence_no, results
+
+
+def sweep_path(path, minimum_rate):
+    ''' --sweep の閾値ごとの出力ファイル名 (例: output-ja.0.4, output-ja.0.4.gz) '''
+    base, ext = corpusio.split_compression(path)
+    return '{0}.{1:g}{2}'.format(base, minimum_rate, ext)
+
+
+def sweep(args, minimum_rates, do_simplify):
+    '''
+    --sweep: 閾値ごとに -m を指定して実行したのと同じファイルを一度に出力し，
+    閾値ごとの分割数，部分文数，複雑な対応の割合を標準出力に表示する
+    '''
+    fouts_jp = [corpusio.open_file(sweep_path(args.output_japanese_file, minimum_rate), 'w')
+                for minimum_rate in minimum_rates]
+    fouts_ch = [corpusio.open_file(sweep_path(args.output_chinese_file, minimum_rate), 'w')
+                for minimum_rate in minimum_rates]
+    flogs = [None] * len(minimum_rates)
+    if args.log_file:
+        flogs = [corpusio.open_file(sweep_path(args.log_file, minimum_rate), 'w')
+                 for minimum_rate in minimum_rates]
+    fmaps = [None] * len(minimum_rates)
+    if args.mapping_file:
+        fmaps = [segmap.MappingWriter(sweep_path(args.mapping_file, minimum_rate))
+                 for minimum_rate in minimum_rates]
+    # 閾値ごとの [分割した文, 分割しなかった文, 部分文, 複雑な対応の文] の数
+    counts = [[0, 0, 0, 0] for _ in minimum_rates]
+
+    with corpusio.open_file(args.alignment) as fin_align, \
+        corpusio.open_file(args.input_japanese_file) as fin_jp, \
+        corpusio.open_file(args.input_chinese_file) as fin_ch:
+
+        first_sentence_no, end_sentence_no = shard_sentences(args)
+        skip_lines((fin_align, fin_jp, fin_ch), first_sentence_no - 1)
+        chunks = read_chunks(fin_align, fin_jp, fin_ch, args.chunk_size, first_sentence_no,
+                             end=end_sentence_no)
+        options = (minimum_rates, do_simplify, args.full, args.log_file is not None,
+                   prepare_alignment_cache(args), prepare_token_cache(args))
+        if options[5]:
+            chunks = drop_texts(chunks)
+        pool = None
+        if args.workers > 1:
+            pool = multiprocessing.Pool(args.workers, initializer=init_sweep_worker,
+                                        initargs=options)
+            results = pool.imap(process_sweep_chunk, chunks)
+        else:
+            init_sweep_worker(*options)
+            results = map(process_sweep_chunk, chunks)
+
+        for sentence_no, chunk_results in results:
+            for k in range(len(minimum_rates)):
+                rate_results = [sentence_results[k] for sentence_results in chunk_results]
+                for split, n_short, _, _, _, mapping in rate_results:
+                    if split:
+                        counts[k][0] += 1
+                        counts[k][2] += n_short
+                        if segmap.is_complicated(mapping):
+                            counts[k][3] += 1
+                    else:
+                        counts[k][1] += 1
+                if flogs[k]:
+                    flogs[k].write(''.join(result[2] for result in rate_results))
+                if fmaps[k]:
+                    for i, result in enumerate(rate_results):
+                        if result[5] is not None:
+                            fmaps[k].write(sentence_no + i, result[5])
+                fouts_jp[k].write(''.join(result[3] for result in rate_results))
+                fouts_ch[k].write(''.join(result[4] for result in rate_results))
+
+        if pool:
+            pool.close()
+            pool.join()
+
+    print('minimum_rate', 'split', 'sentences', 'short_sentences', 'complicated',
+          'complicated_rate', sep='\t')
+    for minimum_rate, (n_split, n_not_split, n_short_sentence, n_complicated), flog in \
+            zip(minimum_rates, counts, flogs):
+        if flog:
+            print('\n{0} of {1} sentences were split into {2} short sentences.'.format(
+                n_split, n_split+n_not_split, n_short_sentence), file=flog)
+        print('{0:g}'.format(minimum_rate), n_split, n_split + n_not_split, n_short_sentence,
+              n_complicated, '{0:.4f}'.format(n_complicated / n_split if n_split else 0),
+              sep='\t')
+
+    for f in fouts_jp + fouts_ch + flogs + fmaps:
+        if f:
+            f.close()
+
+
+def prepare_alignment_cache(args):
+    '''
+    --alignment_cache のディレクトリに配列がなければ (古ければ) 作る
+    :return: ディレクトリ (指定されていなければ None)
+    '''
+    if not args.alignment_cache:
+        return None
+    if np is None:
+        sys.exit('jcsplit.py: --alignment_cache needs NumPy')
+    if not aligncache.is_current(args.alignment_cache, args.alignment):
+        print('jcsplit.py: building the alignment cache in {0}'.format(args.alignment_cache),
+              file=sys.stderr)
+        aligncache.build(args.alignment_cache, args.alignment)
+    return args.alignment_cache
+
+
+def prepare_token_cache(args):
+    '''
+    --token_cache のディレクトリの ja と zh に日本語と中国語の配列がなければ (古ければ) 作る
+    :return: (日本語のディレクトリ, 中国語のディレクトリ) (指定されていなければ None)
+    '''
+    if not args.token_cache:
+        return None
+    if np is None:
+        sys.exit('jcsplit.py: --token_cache needs NumPy')
+    directories = []
+    for name, path in (('ja', args.input_japanese_file), ('zh', args.input_chinese_file)):
+        directory = os.path.join(args.token_cache, name)
+        if not tokcache.is_current(directory, path, DELIMS):
+            print('jcsplit.py: building the token cache in {0}'.format(directory),
+                  file=sys.stderr)
+            tokcache.build(directory, path, DELIMS, DELIM_TOKENS, WIDE_SPACE, is_alpha)
+        directories.append(directory)
+    return tuple(directories)
+
+
+def checkpoint_options(args, minimum_rate, do_simplify):
+    ''' 再開する時にチェックポイントを作った時と一致している必要がある引数 '''
+    options = {
+        'alignment': args.alignment,
+        'input_japanese_file': args.input_japanese_file,
+        'input_chinese_file': args.input_chinese_file,
+        'output_japanese_file': args.output_japanese_file,
+        'output_chinese_file': args.output_chinese_file,
+        'log_file': args.log_file,
+        'mapping_file': args.mapping_file,
+        'minimum_rate': minimum_rate,
+        'simplify': do_simplify,
+        'full': args.full,
+    }
+    if args.shard:
+        # JSON に保存すると list になる
+        options['shard'] = list(args.shard)
+    return options
+
+
+def read_checkpoint(checkpoint_file):
+    with open(checkpoint_file, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def write_checkpoint(checkpoint_file, checkpoint):
+    ''' 書きかけのチェックポイントが残らないように，一時ファイルに書いてから置き換える '''
+    tmp_file = checkpoint_file + '.tmp'
+    with open(tmp_file, 'w', encoding='utf-8') as f:
+        json.dump(checkpoint, f)
+        corpusio.sync(f)
+    os.replace(tmp_file, checkpoint_file)
+
+
+def open_output(path, offset=None):
+    '''
+    出力ファイルを開く
+    :param offset: 指定するとファイルをその位置まで切り詰めて続きを書く
+    '''
+    if offset is None:
+        return corpusio.open_file(path, 'w')
+    return corpusio.open_truncated(path, offset)
+
+
+def main():
     # TEST
     #jp_line = 'Ｙｕｋｏｎ や 北西 領域 ， Ｈｕｄｓｏｎ や Ｊａｍｅｓ 湾 ， 北部 ケベック ， ラブラドール ， グリーンランド の 汚染 物質 に関する 情報 を ， 文献 ， 組織 ， 研究 者 から 広範囲 に 収集 し た 。 '
     #ch_line = '有关 Ｙｕｋｏｎ 和 西北 领域 、 Ｈｕｄｓｏｎ 和 Ｊａｍｅｓ 湾 、 北部 魁北克 、 拉布拉多 、 Ｇｒｅｅｎｌａｎｄ 的 污染 物质 的 信息 从 文献 、 组织 、 研究者 方面 进行 了 大 范围 的 收集 。'
     #alignment_text = '0-1 1-2 2-3 3-4 4-5 5-6 6-7 7-8 8-9 9-10 10-11 11-12 12-13 13-14 13-15 14-15 15-16 16-17 17-18 18-19 19-0 20-21 21-20 22-24 23-23 24-24 25-25 26-26 27-27 27-28 28-27 29-22 30-31 30-32 32-34 33-29 33-30 34-30 35-35'
 
     args = get_arguments()
+    if args.mapping_file and corpusio.compression(args.mapping_file):
+        sys.exit('jcsplit.py: the mapping file (-M) cannot be compressed: {0}'.format(
+            args.mapping_file))
     minimum_rate = DEFAULT_MINIMUM_RATE
     if args.minimum_rate:
         minimum_rate = float(args.minimum_rate)
     do_simplify = False
     if args.simplify or DO_SIMPLIFY:
         do_simplify = True
-    with open(args.alignment) as fin_align, \
-        open(args.input_japanese_file, 'r', encoding='utf-8') as fin_jp, \
-        open(args.input_chinese_file, 'r', encoding='utf-8') as fin_ch, \
-        open(args.output_japanese_file, 'w', encoding='utf-8') as fout_jp, \
-        open(args.output_chinese_file, 'w', encoding='utf-8') as fout_ch:
+        # ワーカーを作る前に読んでおく (読んでいなければ simplify() が読む)
+        load_hankan_map()
+
+    if args.sweep:
+        if args.resume or args.cache:
+            sys.exit('jcsplit.py: --sweep cannot be used with --resume or --cache')
+        sweep(args, [float(rate) for rate in args.sweep.split(',')], do_simplify)
+        return
+
+    checkpoint_file = args.checkpoint or args.output_japanese_file + CHECKPOINT_SUFFIX
+    run_options = checkpoint_options(args, minimum_rate, do_simplify)
+    checkpoint = None
+    if args.resume:
+        if os.path.exists(checkpoint_file):
+            checkpoint = read_checkpoint(checkpoint_file)
+            if checkpoint['options'] != run_options:
+                sys.exit('jcsplit.py: {0} was made with different arguments'.format(
+                    checkpoint_file))
+        else:
+            print('jcsplit.py: {0} not found, starting from the beginning'.format(
+                checkpoint_file), file=sys.stderr)
+    output_offsets = checkpoint['outputs'] if checkpoint else {}
 
-        flog = sys.stdout
+    with corpusio.open_file(args.alignment) as fin_align, \
+        corpusio.open_file(args.input_japanese_file) as fin_jp, \
+        corpusio.open_file(args.input_chinese_file) as fin_ch, \
+        open_output(args.output_japanese_file, output_offsets.get('japanese')) as fout_jp, \
+        open_output(args.output_chinese_file, output_offsets.get('chinese')) as fout_ch:
+
+        flog = None
         if args.log_file:
-            flog = open(args.log_file, 'w', encoding='utf-8')
+            flog = open_output(args.log_file, output_offsets.get('log'))
+        fmap = None
+        if args.mapping_file:
+            fmap = segmap.MappingWriter(args.mapping_file, output_offsets.get('mapping'))
 
-        sentence_no = 0
         n_split = 0
         n_not_split = 0
         n_short_sentence = 0
 
-        while True:
-            sentence_no += 1
-            # DEBUG
-            if sentence_no == 9: #849:
-                dummy = 'same'
-
-            alignment = fin_align.readline()
-            if not alignment:
-                break
-            jp_line = fin_jp.readline()
-            ch_line = fin_ch.readline()
+        with_stats = args.stats is not None
+        stats = runstats.Stats(enabled=with_stats)
+        next_sentence_no, end_sentence_no = shard_sentences(args)
+        progress = runstats.Progress('jcsplit.py',
+                                     shard_input_size(args, next_sentence_no, end_sentence_no),
+                                     enabled=with_stats)
 
-            segment_pairs, jp_sentence, ch_sentence = \
-                split_sentence(jp_line, ch_line, alignment, minimum_rate, do_simplify)
+        if checkpoint:
+            # チェックポイントの位置から読み直す (圧縮ファイルは先頭から読み飛ばす)
+            for f, position in zip((fin_align, fin_jp, fin_ch), checkpoint['inputs']):
+                if position is None:
+                    skip_lines((f,), checkpoint['sentence_no'] - 1)
+                else:
+                    f.seek(position)
+            n_split, n_not_split, n_short_sentence = checkpoint['counters']
+            next_sentence_no = checkpoint['sentence_no']
+            stats.merge(checkpoint['stats'])
+        else:
+            # --shard: シャードの最初の文まで読み飛ばす
+            skip_lines((fin_align, fin_jp, fin_ch), next_sentence_no - 1)
+        last_checkpoint = next_sentence_no
 
-            if len(segment_pairs) <= 1:
-                # sentence not split
-                n_not_split += 1
-                if not args.full:
-                    continue
-            else:
-                n_split += 1
-                n_short_sentence += len(segment_pairs)
+        input_positions = collections.deque()
+        chunks = read_chunks(fin_align, fin_jp, fin_ch, args.chunk_size,
+                             next_sentence_no, input_positions, end_sentence_no)
+        with stats.timer('alignment_cache'):
+            alignment_cache = prepare_alignment_cache(args)
+        with stats.timer('token_cache'):
+            token_cache = prepare_token_cache(args)
+        options = (minimum_rate, do_simplify, args.full, flog is not None, with_stats,
+                   alignment_cache, token_cache)
+        cache = None
+        if args.cache:
+            # キャッシュにある文はワーカーに送らない
+            cache = splitcache.SplitCache(args.cache, options[:4], args.cache_size << 20,
+                                          stats)
+            chunks = cache.filter_chunks(chunks)
+        if token_cache:
+            chunks = drop_texts(chunks)
+        pool = None
+        if args.workers > 1:
+            # チャンク単位で並列処理し，結果は入力順に受け取る
+            pool = multiprocessing.Pool(args.workers, initializer=init_worker,
+                                        initargs=options)
+            results = pool.imap(process_chunk, chunks)
+        else:
+            init_worker(*options)
+            results = map(process_chunk, chunks)
+        if cache:
+            results = cache.merge_results(results)
 
-            # DEBUG
+        for sentence_no, chunk_results, chunk_stats in results:
+            for split, n_short, _, _, _, _ in chunk_results:
+                if split:
+                    n_split += 1
+                    n_short_sentence += n_short
+                else:
+                    n_not_split += 1
             if flog:
-                print('#{0}'.format(sentence_no), file=flog)
-                print('Japanese:', jp_sentence.text(), file=flog)
-                print('Chinese: ', ch_sentence.text(), file=flog)
-                print('--', file=flog)
-                print('J -> C', file=flog)
-                jp_sentence.print_segment_dist(flog)
-                print('C -> J', file=flog)
-                ch_sentence.print_segment_dist(flog)
-
-                print('Mapping:', segment_pairs, file=flog)
-                print('----', file=flog)
-
-            if len(segment_pairs) <= 1:
-                continue
-
-            segment_text_pairs = []
-            for pair in segment_pairs:
-                jp_segs = pair[0]
-                jp_seg_text = ''
-                for seg_id in jp_segs:
-                    seg = jp_sentence.segments[seg_id]
-                    jp_seg_text += ' ' + seg.text()
-                    if flog:
-                        print('J{0}: {1}'.format(seg_id, seg.text()), file=flog)
-                jp_seg_text = jp_seg_text.strip()
-
-                ch_segs = pair[1]
-                ch_seg_text = ''
-                for seg_id in ch_segs:
-                    seg = ch_sentence.segments[seg_id]
-                    ch_seg_text += ' ' + seg.text()
-                    if flog:
-                        print('C{0}: {1}'.format(seg_id, seg.text()), file=flog)
-                ch_seg_text = ch_seg_text.strip()
-
-                print('--', file=flog)
-
-                segment_text_pairs.append((jp_seg_text, ch_seg_text))
-
-            for pair in segment_text_pairs:
-                print(pair[0], file=fout_jp)
-                print(pair[1], file=fout_ch)
-                # if flog:
-                #     print('J:', pair[0], file=flog)
-                #     print('C:', pair[1], file=flog)
-                #     print('===========', file=flog)
-
-            #if args.log_file:
-            #    print(seg_align_jp, file=flog)
-            #    if len(untranslated) > 0:
-            #        print('* Untranslated segment(s):', file=flog)
-            #        for s in untranslated:
-            #            print(s, file=flog)
-            #    print('=======', file=flog)
+                with stats.timer('write_log'):
+                    flog.write(''.join(result[2] for result in chunk_results))
+            if fmap:
+                with stats.timer('write_mapping'):
+                    for i, result in enumerate(chunk_results):
+                        if result[5] is not None:
+                            fmap.write(sentence_no + i, result[5])
+            with stats.timer('write_output'):
+                fout_jp.write(''.join(result[3] for result in chunk_results))
+                fout_ch.write(''.join(result[4] for result in chunk_results))
+            stats.merge(chunk_stats)
+            progress.update(n_split + n_not_split, stats.counters.get('alignment_bytes'))
+
+            # チャンクの終わりの入力位置 (出力はここまで書いてある)
+            positions = input_positions.popleft()
+            next_sentence_no = sentence_no + len(chunk_results)
+            if args.checkpoint_interval and \
+                    next_sentence_no - last_checkpoint >= args.checkpoint_interval:
+                with stats.timer('checkpoint'):
+                    if fmap:
+                        fmap.flush()
+                    write_checkpoint(checkpoint_file, {
+                        'options': run_options,
+                        'sentence_no': next_sentence_no,
+                        'inputs': positions,
+                        'outputs': {
+                            'japanese': corpusio.sync(fout_jp),
+                            'chinese': corpusio.sync(fout_ch),
+                            'log': corpusio.sync(flog) if flog else None,
+                            'mapping': fmap.tell() if fmap else None,
+                        },
+                        'counters': [n_split, n_not_split, n_short_sentence],
+                        'stats': stats.to_dict(),
+                    })
+                last_checkpoint = next_sentence_no
+
+        if pool:
+            pool.close()
+            pool.join()
+        if cache:
+            with stats.timer('cache_evict'):
+                cache.close()
+
         print('\n{0} of {1} sentences were split into {2} short sentences.'.format(
-            n_split, n_split+n_not_split, n_short_sentence), file=flog)
-        if args.log_file:
+            n_split, n_split+n_not_split, n_short_sentence), file=flog or sys.stdout)
+        if flog:
             flog.close()
+        if fmap:
+            fmap.close()
+
+    # 最後まで処理したのでチェックポイントは不要
+    if os.path.exists(checkpoint_file):
+        os.remove(checkpoint_file)
+
+    if with_stats:
+        stats.write(args.stats, 'jcsplit.py', progress.elapsed(),
+                    bytes_read=runstats.file_sizes(args.alignment, args.input_japanese_file,
+                                                   args.input_chinese_file),
+                    bytes_written=runstats.file_sizes(args.output_japanese_file,
+                                                      args.output_chinese_file,
+                                                      args.log_file, args.mapping_file))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,176 @@
+'''
+lineindex.py: テキストファイルの各行の先頭バイトオフセットの索引
+    索引は対象ファイル名 + '.lidx' に保存し，対象ファイルの大きさと更新時刻が
+    変わっていなければ次回から再利用する
+    行は mmap したファイルから直接読み出す
+    圧縮ファイル (.gz, .xz, .bz2) は mmap できないので，SequentialLines で先頭から順に読む
+
+Index file:
+    ヘッダ (MAGIC, 対象ファイルの大きさ, 更新時刻 ns) のあとに
+    各行の先頭オフセットと最後にファイルの大きさを uint64 で並べる
+'''
+import array
+import mmap
+import os
+import struct
+
+import corpusio
+
+INDEX_SUFFIX = '.lidx'
+MAGIC = b'LINEIDX1'
+HEADER = struct.Struct('<8sQQ')
+READ_SIZE = 1 << 24
+
+
+def index_path(path):
+    return path + INDEX_SUFFIX
+
+
+def scan_line_offsets(path):
+    '''
+    ファイルを先頭から読んで各行の先頭オフセットを求める
+    :return: 各行の先頭オフセットとファイルの大きさ (len = 行数 + 1)
+    '''
+    offsets = array.array('Q', [0])
+    size = 0
+    with open(path, 'rb') as f:
+        while True:
+            block = f.read(READ_SIZE)
+            if not block:
+                break
+            pos = block.find(b'\n')
+            while pos >= 0:
+                offsets.append(size + pos + 1)
+                pos = block.find(b'\n', pos + 1)
+            size += len(block)
+    if offsets[-1] != size:
+        # 最後の行が改行で終わっていない
+        offsets.append(size)
+    return offsets
+
+
+def write_index(path, offsets):
+    stat = os.stat(path)
+    with open(index_path(path), 'wb') as f:
+        f.write(HEADER.pack(MAGIC, stat.st_size, stat.st_mtime_ns))
+        offsets.tofile(f)
+
+
+def open_index(path):
+    '''
+    保存済みの索引が対象ファイルと一致すれば mmap して返す．なければ None
+    '''
+    stat = os.stat(path)
+    try:
+        with open(index_path(path), 'rb') as f:
+            header = f.read(HEADER.size)
+            if len(header) < HEADER.size:
+                return None
+            magic, size, mtime = HEADER.unpack(header)
+            if magic != MAGIC or size != stat.st_size or mtime != stat.st_mtime_ns:
+                return None
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except OSError:
+        return None
+
+
+class LineIndex:
+    '''
+    index[i] で i 行目 (0始まり) を改行なしの bytes で返す
+    '''
+    def __init__(self, path):
+        self.index_map = open_index(path)
+        if self.index_map is None:
+            self.offsets = scan_line_offsets(path)
+            try:
+                write_index(path, self.offsets)
+            except OSError:
+                # 保存できなくても索引はそのまま使う
+                pass
+        else:
+            self.offsets = memoryview(self.index_map)[HEADER.size:].cast('Q')
+        self.f = open(path, 'rb')
+        if self.offsets[-1] > 0:
+            self.data = mmap.mmap(self.f.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            self.data = b''
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError('line index out of range')
+        line = self.data[self.offsets[i]:self.offsets[i + 1]]
+        if line.endswith(b'\n'):
+            line = line[:-1]
+            if line.endswith(b'\r'):
+                line = line[:-1]
+        return line
+
+    def text(self, i, encoding='utf-8'):
+        return self[i].decode(encoding)
+
+    def close(self):
+        if isinstance(self.offsets, memoryview):
+            self.offsets.release()
+        if self.index_map is not None:
+            self.index_map.close()
+        if isinstance(self.data, mmap.mmap):
+            self.data.close()
+        self.f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class SequentialLines:
+    '''
+    ファイルを先頭から順に読んで i 番目の行を返す (LineIndex と同じく改行は除く)
+    i は前回以上でなければならない
+    '''
+    def __init__(self, path):
+        self.path = path
+        self.f = corpusio.open_file(path, 'rb')
+        self.index = -1
+        self.line = b''
+
+    def __getitem__(self, i):
+        if i < self.index:
+            raise IndexError('lines of {0} must be read in ascending order'.format(self.path))
+        while self.index < i:
+            line = self.f.readline()
+            if not line:
+                raise IndexError('line index out of range')
+            self.line = line
+            self.index += 1
+        line = self.line
+        if line.endswith(b'\n'):
+            line = line[:-1]
+            if line.endswith(b'\r'):
+                line = line[:-1]
+        return line
+
+    def text(self, i, encoding='utf-8'):
+        return self[i].decode(encoding)
+
+    def close(self):
+        self.f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def open_lines(path):
+    ''' 圧縮ファイルなら SequentialLines, それ以外は LineIndex '''
+    if corpusio.compression(path):
+        return SequentialLines(path)
+    return LineIndex(path)
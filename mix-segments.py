@@ -1,18 +1,29 @@
 import argparse
+import multiprocessing
 import sys
 
+import corpusio
+import dedup
+import runstats
+import segmap
+import segstore
+import shards
+
 LOG_FILE = 'train/log50'
 SRC_SHORT_SENTENCE_FILE = 'train/train-zh-short50.char'
 TRANSLATED_TGT_SHORT_SENTENCE_FILE = 'train/train-ja2zh-short50.char'
-
-global translated_segments
-translated_segments = []
+OUTPUT_BUFFER_SIZE = 1 << 20
+# 並列処理で1つのワーカーに一度に渡す文の数
+CHUNK_SIZE = 1000
 
 
 def get_arguments():
     parser = argparse.ArgumentParser()
-    parser.add_argument('-l', '--log_file', required=True,
-                        help='Input log file')
+    mapping_source = parser.add_mutually_exclusive_group(required=True)
+    mapping_source.add_argument('-l', '--log_file',
+                                help='Input log file')
+    mapping_source.add_argument('-M', '--mapping_file',
+                                help='Input mapping file (jcsplit.py -M)')
     parser.add_argument('-s', '--source', required=True,
                         help='Source short sentence file')
     parser.add_argument('-t', '--translated', required=True,
@@ -25,6 +36,25 @@ def get_arguments():
                         help='Debug mode')
     parser.add_argument('-r', '--reverse', action='store_true',
                         help='from Chinese to Japanese')
+    parser.add_argument('--dedup', choices=['bloom', 'set'],
+                        help='drop mixed sentences already written '
+                        '(bloom: scalable Bloom filter, set: set of hashes)')
+    parser.add_argument('--dedup_memory', type=int, default=dedup.DEFAULT_MEMORY,
+                        help='memory limit of --dedup in MB (default: %(default)s)')
+    parser.add_argument('--dedup_error_rate', type=float, default=dedup.DEFAULT_ERROR_RATE,
+                        help='false positive rate of --dedup bloom (default: %(default)s)')
+    parser.add_argument('--store',
+                        help='segment store file (default: mapping or log file + "%s"), '
+                        'built if missing or out of date' % segstore.STORE_SUFFIX)
+    parser.add_argument('--ids',
+                        help='process only sentence IDs in this range, e.g. 1001-2000 (uses the store)')
+    parser.add_argument('--shard', type=shards.parse_shard,
+                        help='process only the I-th of N equal parts of the sentences, e.g. 2/4 '
+                        '(uses the store; merge the outputs with shards.py)')
+    parser.add_argument('-w', '--workers', type=int, default=1,
+                        help='number of worker processes (uses the store)')
+    parser.add_argument('--stats',
+                        help='write per-stage times and counters to this file (JSON)')
     return parser.parse_args()
 
 
@@ -36,37 +66,6 @@ def split_numbers(s):
         return [ int(s) ]
 
 
-def check_continuous_ascending_order(l):
-    # リストの要素が昇順かつ連続か確認する
-    dummy = list(range(l[-1]+1))
-    result = (l == dummy)
-    return  result
-    # result = True
-    # prev = -1
-    # for num in l:
-    #     if num <= prev:
-    #         result = False
-    #         break
-    #     prev = num
-    # return result
-
-
-def is_complicated(mapping_list):
-    '''
-    不連続か，順序が入れ替わるようなマッピングならTrueを返す
-    '''
-    complicated = False
-    left = []
-    right = []
-    for pair in mapping_list:
-        left += pair[0]
-        right += pair[1]
-    if not check_continuous_ascending_order(left) or \
-            not check_continuous_ascending_order(right):
-        complicated = True
-    return complicated
-
-
 def parse_mapping_text(mapping_text, reverse):
     '''
     "[[[0], [0]], [[1], [1,2]], [[2,3], [3]]]" のような文字列をリストに変換する
@@ -94,9 +93,8 @@ def parse_mapping_text(mapping_text, reverse):
 
 
 def get_mappings_from_log(log_file, reverse):
-    # セグメントの対応をlogファイルから取得する
-    mappings_list = []
-    with open(log_file, 'r', encoding='utf-8') as flog:
+    # セグメントの対応をlogファイルから1文ずつ取得する
+    with corpusio.open_file(log_file) as flog:
         for line in flog:
             line = line.strip()
             if line.startswith('#'):
@@ -105,43 +103,141 @@ def get_mappings_from_log(log_file, reverse):
             if line.startswith('Mapping:'):
                 mapping_text = line[10:-1].strip()
                 mappings = parse_mapping_text(mapping_text, reverse)
-                mappings_list.append((sentence_id, mappings))
-    return mappings_list
+                yield sentence_id, mappings
+
+
+def get_mappings_from_mapping_file(mapping_file, reverse):
+    # セグメントの対応を jcsplit.py の Mapping ファイルから順に取得する
+    for sentence_id, mappings in segmap.read_mappings(mapping_file, reverse):
+        yield sentence_id, mappings
 
 
-def read_translated_segments(trans_seg_file):
-    global translated_segments
-    with open(trans_seg_file, 'r', encoding='utf-8') as f:
-        translated_segments = f.read().strip().split('\n')
+def read_short_sentences(mappings_list, f_src, f_trn):
+    '''
+    文ごとに，対応するショートセンテンスの (元の文, 翻訳文) を読み出す
+    :return: (sentence_id, mappings, sentence_pairs) を1文ずつ返す
+    '''
+    for sentence_id, mappings in mappings_list:
+        sentence_pairs = []
+        for _ in range(len(mappings)):
+            src_short_sentence = f_src.readline()
+            trn_short_sentence = f_trn.readline()
+            if not src_short_sentence or not trn_short_sentence:
+                # 行が足りなければ，以降の文がずれるので止める
+                raise segstore.MisalignmentError(
+                    'short sentence files end before sentence {0}'.format(sentence_id))
+            sentence_pairs.append((src_short_sentence.strip(), trn_short_sentence.strip()))
+        yield sentence_id, mappings, sentence_pairs
+    if f_src.readline() or f_trn.readline():
+        raise segstore.MisalignmentError(
+            'short sentence files have more lines than the mappings')
+
+
+def mixed_sentences(sentence_pairs, debug_mode):
+    '''
+    j番目のショートセンテンスだけを機械翻訳結果と入れ替えた文を順に返す
+    前後の元の文は連結済みの prefix / suffix を使う
+    '''
+    sources = [src + ' ' for src, _ in sentence_pairs]
+    suffixes = [''] * (len(sources) + 1)
+    for j in range(len(sources) - 1, -1, -1):
+        suffixes[j] = sources[j] + suffixes[j + 1]
+    prefix = ''
+    for j, (_, translated) in enumerate(sentence_pairs):
+        # 対応する中国語文の日本語訳
+        if debug_mode:
+            translated = '【' + translated + ' 】 '
+        else:
+            translated = translated + ' '
+        yield prefix + translated + suffixes[j + 1] + '\n'
+        prefix += sources[j]
 
 
 def mix_sentences(sentence_pairs, fout, debug_mode):
     ''' 一部を機械翻訳結果と入れ替える '''
-    for i in range(len(sentence_pairs)):
-        for j in range(len(sentence_pairs)):
-            # j番目のショートセンテンスを入れ替える
-            if i == j:
-                # 対応する中国語文の日本語訳
-                if debug_mode:
-                    print('【', end='', file=fout)
-                print(sentence_pairs[j][1], end=' ', file=fout)
-                if debug_mode:
-                    print('】', end=' ', file=fout)
-            else:
-                # 元の日本語文
-                print(sentence_pairs[j][0], end=' ', file=fout)
-        print(file=fout)
+    fout.write(''.join(mixed_sentences(sentence_pairs, debug_mode)))
 
 
-def main():
-    global translated_segments
+def parse_id_range(text):
+    '''
+    "1001-2000" を (1001, 2000) に変換する．"1001-" や "-2000" は片側を None にする
+    '''
+    first, _, last = text.partition('-')
+    return int(first) if first else None, int(last) if last else None
 
-    args = get_arguments()
-    if args.log_file:
-        log_file = args.log_file
+
+def sequential_mix(mappings_list, f_src, f_trn, debug_mode, stats):
+    '''
+    対応とショートセンテンスのファイルを先頭から順に読んで混ぜる
+    :return: (sentence_id, 混ぜた文のリスト) を1文ずつ返す．複雑な対応の文は None
+    '''
+    for sentence_id, mappings, sentence_pairs in runstats.timed(
+            stats, 'read', read_short_sentences(mappings_list, f_src, f_trn)):
+        if segmap.is_complicated(mappings):
+            yield sentence_id, None
+            continue
+        with stats.timer('mix'):
+            mixed = list(mixed_sentences(sentence_pairs, debug_mode))
+        yield sentence_id, mixed
+
+
+store = None
+reader = None
+debug = False
+
+
+def init_worker(store_file, source_file, translated_file, debug_mode):
+    global store, reader, debug
+    store = segstore.SegmentStore(store_file)
+    reader = segstore.SegmentReader(store, source_file, translated_file)
+    debug = debug_mode
+
+
+def mix_chunk(bounds):
+    ''' Store file の start 番目から end 番目の手前までの文を混ぜる '''
+    start, end = bounds
+    results = []
+    for i in range(start, end):
+        sentence_id, first_line, n_segments, complicated = store.record(i)
+        if complicated:
+            results.append((sentence_id, None))
+            continue
+        sentence_pairs = reader.sentence_pairs(first_line, n_segments)
+        results.append((sentence_id, list(mixed_sentences(sentence_pairs, debug))))
+    return results
+
+
+def stored_mix(store_file, source_file, translated_file, debug_mode, id_range, workers, stats,
+               shard=None):
+    '''
+    Store file で文を引いて混ぜる．id_range の文だけを CHUNK_SIZE 文ずつ並列に処理する
+    :param shard: (I, N) を指定すると id_range の文を N 等分した I 番目だけを処理する
+    :return: sequential_mix() と同じ
+    '''
+    init_worker(store_file, source_file, translated_file, debug_mode)
+    start, end = store.id_range(*id_range)
+    if shard:
+        start, end = shards.shard_range(start, end, shard)
+    chunks = [(i, min(i + CHUNK_SIZE, end)) for i in range(start, end, CHUNK_SIZE)]
+    if workers > 1:
+        with multiprocessing.Pool(workers, initializer=init_worker,
+                                  initargs=(store_file, source_file, translated_file,
+                                            debug_mode)) as pool:
+            for results in runstats.timed(stats, 'mix', pool.imap(mix_chunk, chunks)):
+                yield from results
     else:
-        log_file = LOG_FILE
-    
+        for results in runstats.timed(stats, 'mix', map(mix_chunk, chunks)):
+            yield from results
+    reader.close()
+    store.close()
+
+
+def main():
+    args = get_arguments()
+    if args.dedup and args.shard:
+        # 他のシャードで書いた文はわからないので，1台で実行した結果と同じにならない
+        sys.exit('mix-segments.py: --dedup cannot be used with --shard')
+
     if args.source:
         source_short_file = args.source
     else:
@@ -153,44 +249,90 @@ def main():
         trans_short_file = TRANSLATED_TGT_SHORT_SENTENCE_FILE
 
     if args.output:
-        fout = open(args.output, 'w')
+        fout = corpusio.open_file(args.output, 'w', buffering=OUTPUT_BUFFER_SIZE)
     else:
         fout = sys.stdout
 
     if args.number:
-        fnum = open(args.number, 'w')
+        fnum = corpusio.open_file(args.number, 'w')
     else:
         fnum = sys.stderr
         
-    mappings_list = get_mappings_from_log(log_file, args.reverse)
+    if args.mapping_file:
+        mappings_list = get_mappings_from_mapping_file(args.mapping_file, args.reverse)
+    else:
+        mappings_list = get_mappings_from_log(args.log_file, args.reverse)
     
-    id_nshort_pairs = []
-
-    with open(source_short_file, 'r', encoding='utf-8') as f_src, \
-         open(trans_short_file, 'r', encoding='utf-8') as f_trn:
-        comp_count = 0
-        for (sentence_id, mappings) in mappings_list:
-            n_short_sentences = len(mappings)
-            complicated = is_complicated(mappings)
-            if complicated:
-                # skip if segment alignment is complicated
-                for _ in range(n_short_sentences):
-                    src_short_sentence = f_src.readline().strip()
-                    trn_short_sentence = f_trn.readline().strip()
-                comp_count += 1
-            else:
-                id_nshort_pairs.append((sentence_id, n_short_sentences))
-                sentence_pairs = []
-                for _ in range(n_short_sentences):
-                    src_short_sentence = f_src.readline().strip()
-                    trn_short_sentence = f_trn.readline().strip()
-                    sentence_pairs.append((src_short_sentence, trn_short_sentence))               
-                mix_sentences(sentence_pairs, fout, args.debug)
+    stats = runstats.Stats(enabled=args.stats is not None)
+    seen = None
+    if args.dedup:
+        seen = dedup.new_deduplicator(args.dedup, args.dedup_memory << 20, args.dedup_error_rate)
+
+    # sentence_id で文を引く時は Store file を使う
+    use_store = args.store or args.ids or args.shard or args.workers > 1
+    f_src = f_trn = None
+    if use_store:
+        mapping_source = args.mapping_file or args.log_file
+        store_file = args.store or segstore.store_path(mapping_source)
+        with stats.timer('store'):
+            segstore.open_store(store_file, mapping_source, lambda: mappings_list).close()
+        progress = runstats.Progress('mix-segments.py', enabled=stats.enabled)
+        sentences = stored_mix(store_file, source_short_file, trans_short_file, args.debug,
+                               parse_id_range(args.ids or '-'), args.workers, stats,
+                               args.shard)
+    else:
+        f_src = corpusio.open_file(source_short_file)
+        f_trn = corpusio.open_file(trans_short_file)
+        progress = runstats.Progress('mix-segments.py', runstats.input_size(source_short_file),
+                                     runstats.file_position(f_src), enabled=stats.enabled)
+        sentences = sequential_mix(mappings_list, f_src, f_trn, args.debug, stats)
+
+    comp_count = 0
+    dup_count = 0
+    n_sentence = 0
+    for sentence_id, mixed in sentences:
+        n_sentence += 1
+        if mixed is None:
+            # skip if segment alignment is complicated
+            comp_count += 1
+            continue
+        if seen is not None:
+            with stats.timer('dedup'):
+                n_mixed = len(mixed)
+                mixed = [line for line in mixed if not seen.add(line)]
+            dup_count += n_mixed - len(mixed)
+            if not mixed:
+                # 目的言語の文も出力しないように，文番号ファイルにも書かない
+                continue
+        stats.count('mixed_sentences', len(mixed))
+        with stats.timer('write_output'):
+            fout.write(''.join(mixed))
+            # mktarget.py は残した数だけ目的言語の文を出力する
+            print('{0} {1}'.format(sentence_id, len(mixed)), file=fnum)
+        progress.update(n_sentence)
+    for f in (f_src, f_trn):
+        if f:
+            f.close()
     print('Number of removed sentences:', comp_count)
+    if seen is not None:
+        print('Number of removed duplicates:', dup_count)
+
+    if args.output:
+        fout.close()
+    if args.number:
+        fnum.close()
+
+    if stats.enabled:
+        stats.count('sentences', n_sentence)
+        stats.count('complicated_mappings', comp_count)
+        if seen is not None:
+            stats.count('duplicate_sentences', dup_count)
+            stats.count('dedup_memory_bytes', seen.memory())
+        stats.write(args.stats, 'mix-segments.py', progress.elapsed(),
+                    bytes_read=runstats.file_sizes(args.log_file, args.mapping_file,
+                                                   source_short_file, trans_short_file),
+                    bytes_written=runstats.file_sizes(args.output, args.number))
 
-    for sentence_id, n_short_sentences in id_nshort_pairs:
-        print('{0} {1}'.format(sentence_id, n_short_sentences), file=fnum)
-    
 
 if __name__ == '__main__':
     main()
@@ -1,27 +1,72 @@
-'''
-mktarget.py: reads mixed source and sentence number, and makes target file
-'''
-
-import argparse
-import sys
-
-def getargs():
-    parser = argparse.ArgumentParser()
-    parser.add_argument('target_file', help='target file')
-    parser.add_argument('sentence_number_file', help='sentence number file')
-    return parser.parse_args()
-
-def main():
-    args = getargs()
-    with open(args.target_file, 'r', encoding='utf-8') as f:
-        target_sentences = f.read().strip().split('\n')
-    with open(args.sentence_number_file, 'r', encoding='utf-8') as f:
-        for line in f:
-            sentence_id, count = line.strip().split()
-            sentence_index = int(sentence_id) - 1
-            count = int(count)
-            for _ in range(count):
-                print(target_sentences[sentence_index])
-
-if __name__ == '__main__':
-    main()
+'''
+mktarget.py: reads mixed source and sentence number, and makes target file
+    目的言語ファイルの行は行オフセットの索引 (target_file + '.lidx') と mmap で読み出す
+    圧縮した目的言語ファイル (.gz, .xz, .bz2) は先頭から順に読む (文番号は昇順)
+'''
+
+import argparse
+import sys
+
+import corpusio
+import lineindex
+import runstats
+
+OUTPUT_BUFFER_SIZE = 1 << 20
+
+def getargs():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('target_file', help='target file')
+    parser.add_argument('sentence_number_file', help='sentence number file')
+    parser.add_argument('-o', '--output',
+                        help='output file (default: standard output)')
+    parser.add_argument('--stats',
+                        help='write per-stage times and counters to this file (JSON)')
+    return parser.parse_args()
+
+def main():
+    args = getargs()
+    fout = sys.stdout.buffer
+    if args.output:
+        fout = corpusio.open_file(args.output, 'wb')
+    buffer = []
+    buffered = 0
+    written = 0
+    n_sentence = 0
+    stats = runstats.Stats(enabled=args.stats is not None)
+    with corpusio.open_file(args.sentence_number_file) as f:
+        progress = runstats.Progress('mktarget.py', runstats.input_size(args.sentence_number_file),
+                                     runstats.file_position(f), enabled=stats.enabled)
+        with stats.timer('index'):
+            # 索引がなければここで作る
+            target_sentences = lineindex.open_lines(args.target_file)
+        for line in f:
+            sentence_id, count = line.strip().split()
+            sentence_index = int(sentence_id) - 1
+            count = int(count)
+            lines = (target_sentences[sentence_index] + b'\n') * count
+            buffer.append(lines)
+            buffered += len(lines)
+            n_sentence += 1
+            if buffered >= OUTPUT_BUFFER_SIZE:
+                with stats.timer('write_output'):
+                    fout.write(b''.join(buffer))
+                written += buffered
+                buffer = []
+                buffered = 0
+                progress.update(n_sentence)
+        target_sentences.close()
+    with stats.timer('write_output'):
+        fout.write(b''.join(buffer))
+        fout.flush()
+    if args.output:
+        fout.close()
+    written += buffered
+
+    if stats.enabled:
+        stats.count('sentences', n_sentence)
+        stats.write(args.stats, 'mktarget.py', progress.elapsed(),
+                    bytes_read=runstats.file_sizes(args.target_file, args.sentence_number_file),
+                    bytes_written=written)
+
+if __name__ == '__main__':
+    main()
@@ -1,7 +1,12 @@
 # parallelize: 原言語と目的言語のファイルを1つの対訳TSVファイルにまとめる
-# Usage: python parallelize source target
+# Usage: python parallelize source target [-o output]
+#        .gz, .xz, .bz2 のファイルはそのまま読み書きする
 
 import argparse
+import sys
+
+import corpusio
+import runstats
 
 def get_arguments():
     parser = argparse.ArgumentParser()
@@ -9,6 +14,10 @@ def get_arguments():
     parser.add_argument('target', help='target language file')
     parser.add_argument('-d', '--delimiter', default='\t',
                         help='delimiter (default: "\t")')
+    parser.add_argument('-o', '--output',
+                        help='output file (default: standard output)')
+    parser.add_argument('--stats',
+                        help='write times and counters to this file (JSON)')
     return parser.parse_args()
 
 def main():
@@ -16,13 +25,30 @@ def main():
     delim = '\t'
     if args.delimiter:
         delim = args.delimiter
-    with open(args.source, 'r') as fsrc, \
-         open(args.target, 'r') as ftgt:
+    stats = runstats.Stats(enabled=args.stats is not None)
+    n_sentence = 0
+    fout = sys.stdout
+    if args.output:
+        fout = corpusio.open_file(args.output, 'w')
+    with corpusio.open_file(args.source) as fsrc, \
+         corpusio.open_file(args.target) as ftgt:
+        progress = runstats.Progress('parallelize.py', runstats.input_size(args.source),
+                                     runstats.file_position(fsrc), enabled=stats.enabled)
         for src_line, tgt_line in zip(fsrc, ftgt): 
             src_line = src_line.strip()
             tgt_line = tgt_line.strip()
             par_line = src_line + delim + tgt_line
-            print(par_line)
+            print(par_line, file=fout)
+            n_sentence += 1
+            progress.update(n_sentence)
+    if args.output:
+        fout.close()
+
+    if stats.enabled:
+        stats.count('sentences', n_sentence)
+        stats.write(args.stats, 'parallelize.py', progress.elapsed(),
+                    bytes_read=runstats.file_sizes(args.source, args.target),
+                    bytes_written=runstats.file_sizes(args.output))
 
 if __name__ == '__main__':
     main()
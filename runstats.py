@@ -0,0 +1,173 @@
+'''
+runstats.py: --stats オプション用の計測
+    段階 (stage) ごとの累積時間とカウンタを集め，JSON ファイルに書き出す
+    ワーカープロセスの計測結果は to_dict() で受け渡し merge() でまとめる
+    Progress は処理した文の数と入力の読み込み位置から速度と残り時間を表示する
+'''
+import contextlib
+import json
+import os
+import sys
+import time
+
+import corpusio
+
+PROGRESS_INTERVAL = 10.0  # seconds
+
+
+class Timer:
+    __slots__ = ('times', 'stage', 'start')
+
+    def __init__(self, times, stage):
+        self.times = times
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc):
+        elapsed = time.perf_counter() - self.start
+        self.times[self.stage] = self.times.get(self.stage, 0.0) + elapsed
+
+
+NULL_TIMER = contextlib.nullcontext()
+
+
+class Stats:
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.times = {}
+        self.counters = {}
+
+    def timer(self, stage):
+        ''' with stats.timer('stage'): の中の処理時間を stage に加える '''
+        if not self.enabled:
+            return NULL_TIMER
+        return Timer(self.times, stage)
+
+    def count(self, name, n=1):
+        if self.enabled:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def to_dict(self):
+        return {'times': dict(self.times), 'counters': dict(self.counters)}
+
+    def merge(self, stats_dict):
+        if not self.enabled or not stats_dict:
+            return
+        for stage, seconds in stats_dict['times'].items():
+            self.times[stage] = self.times.get(stage, 0.0) + seconds
+        for name, n in stats_dict['counters'].items():
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def write(self, path, script, elapsed, **extra):
+        '''
+        計測結果を JSON で書き出す
+        stage の時間はワーカーの時間も合計したもの (CPU 時間に近い) で，elapsed は実時間
+        '''
+        report = {
+            'script': script,
+            'elapsed': elapsed,
+            'stages': dict(sorted(self.times.items(), key=lambda x: x[1], reverse=True)),
+            'counters': self.counters,
+        }
+        sentences = self.counters.get('sentences')
+        if sentences is not None and elapsed > 0:
+            report['sentences_per_sec'] = sentences / elapsed
+        report.update(extra)
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+            f.write('\n')
+
+
+class Progress:
+    '''
+    PROGRESS_INTERVAL 秒ごとに処理文数，速度，進捗率と残り時間を表示する
+    :param total_bytes: 入力ファイルの大きさ (進捗率と残り時間の計算に使う)
+    :param position: 表示する時に呼ぶ，処理済みのバイト数を返す関数
+    '''
+    def __init__(self, script, total_bytes=None, position=None, enabled=True,
+                 file=sys.stderr, interval=PROGRESS_INTERVAL):
+        self.script = script
+        self.total_bytes = total_bytes
+        self.position = position
+        self.enabled = enabled
+        self.file = file
+        self.interval = interval
+        self.start = time.time()
+        self.last = self.start
+
+    def elapsed(self):
+        return time.time() - self.start
+
+    def update(self, sentences, done_bytes=None):
+        if not self.enabled:
+            return
+        now = time.time()
+        if now - self.last < self.interval:
+            return
+        self.last = now
+        self.report(sentences, done_bytes)
+
+    def report(self, sentences, done_bytes=None):
+        if done_bytes is None and self.position is not None:
+            done_bytes = self.position()
+        elapsed = self.elapsed()
+        message = '{0}: {1} sentences, {2:.1f} sent/s'.format(
+            self.script, sentences, sentences / elapsed if elapsed > 0 else 0)
+        if self.total_bytes and done_bytes:
+            rate = done_bytes / self.total_bytes
+            message += ', {0:.1f}%'.format(rate * 100)
+            if 0 < rate < 1:
+                eta = elapsed * (1 - rate) / rate
+                message += ', ETA {0}'.format(format_seconds(eta))
+        print(message, file=self.file, flush=True)
+
+
+def format_seconds(seconds):
+    seconds = int(seconds)
+    return '{0}:{1:02d}:{2:02d}'.format(seconds // 3600, seconds // 60 % 60, seconds % 60)
+
+
+def input_size(path):
+    '''
+    進捗率の計算に使う入力ファイルの大きさ
+    圧縮ファイルは伸長した大きさが分からないので None
+    '''
+    if corpusio.compression(path):
+        return None
+    return os.path.getsize(path)
+
+
+def file_sizes(*paths):
+    ''' 指定されたファイル (None は除く) の大きさの合計 '''
+    return sum(os.path.getsize(path) for path in paths if path)
+
+
+_END = object()
+
+
+def timed(stats, stage, iterable):
+    ''' iterable から1つずつ取り出す時間を stage に加える '''
+    if not stats.enabled:
+        return iterable
+    return _timed(stats, stage, iter(iterable))
+
+
+def _timed(stats, stage, iterator):
+    while True:
+        with stats.timer(stage):
+            item = next(iterator, _END)
+        if item is _END:
+            return
+        yield item
+
+
+def file_position(f):
+    '''
+    開いているファイルの (先読みを含む) 読み込み位置を返す関数
+    圧縮ファイルは元のファイルの位置が分からないので None
+    '''
+    if not f.seekable():
+        return None
+    return lambda: os.lseek(f.fileno(), 0, os.SEEK_CUR)
@@ -0,0 +1,166 @@
+'''
+segmap.py: jcsplit.py が出力するセグメント対応 (Mapping) ファイルの読み書き
+    ログファイルの "Mapping:" 行の代わりに使う機械可読な形式
+
+Mapping file:
+    1行に1文, JSON の [sentence_id, [[[ja_ids], [zh_ids]], ...]]
+    例: [2,[[[0],[0]],[[1,2,3,4],[1,2]],[[6,7],[3]]]]
+Index file (Mapping file + '.idx'):
+    文ごとに (sentence_id, Mapping file 内のバイトオフセット) を
+    リトルエンディアンの uint64 2つで記録する (sentence_id の昇順)
+'''
+import bisect
+import json
+import mmap
+import os
+import struct
+
+import corpusio
+
+INDEX_SUFFIX = '.idx'
+INDEX_RECORD = struct.Struct('<QQ')
+
+
+def index_path(mapping_file):
+    return mapping_file + INDEX_SUFFIX
+
+
+class MappingWriter:
+    def __init__(self, mapping_file, resume_at=None):
+        '''
+        :param resume_at: tell() の返り値. 指定すると両方のファイルをその位置まで
+                          切り詰めて続きを書く
+        '''
+        if corpusio.compression(mapping_file):
+            # Index file は圧縮しないファイルの中の位置を記録するので，圧縮できない
+            raise ValueError('{0}: mapping files cannot be compressed'.format(mapping_file))
+        if resume_at is None:
+            self.fmap = open(mapping_file, 'wb')
+            self.findex = open(index_path(mapping_file), 'wb')
+            self.offset = 0
+        else:
+            self.offset, index_offset = resume_at
+            os.truncate(mapping_file, self.offset)
+            os.truncate(index_path(mapping_file), index_offset)
+            self.fmap = open(mapping_file, 'ab')
+            self.findex = open(index_path(mapping_file), 'ab')
+
+    def write(self, sentence_id, segment_pairs):
+        record = json.dumps([sentence_id, segment_pairs],
+                            separators=(',', ':')).encode('ascii') + b'\n'
+        self.findex.write(INDEX_RECORD.pack(sentence_id, self.offset))
+        self.fmap.write(record)
+        self.offset += len(record)
+
+    def tell(self):
+        ''' (Mapping file, Index file) の書き込み位置 '''
+        return self.offset, self.findex.tell()
+
+    def flush(self):
+        for f in (self.fmap, self.findex):
+            f.flush()
+            os.fsync(f.fileno())
+
+    def close(self):
+        self.fmap.close()
+        self.findex.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def parse_record(line, reverse=False):
+    '''
+    1行を (sentence_id, [(ja_ids, zh_ids), ...]) に変換する
+    reverse の場合は (zh_ids, ja_ids) の順にする
+    '''
+    sentence_id, segment_pairs = json.loads(line)
+    if reverse:
+        return sentence_id, [(right, left) for left, right in segment_pairs]
+    return sentence_id, [(left, right) for left, right in segment_pairs]
+
+
+def check_continuous_ascending_order(l):
+    # リストの要素が昇順かつ連続か確認する
+    dummy = list(range(l[-1]+1))
+    result = (l == dummy)
+    return  result
+    # result = True
+    # prev = -1
+    # for num in l:
+    #     if num <= prev:
+    #         result = False
+    #         break
+    #     prev = num
+    # return result
+
+
+def is_complicated(mapping_list):
+    '''
+    不連続か，順序が入れ替わるようなマッピングならTrueを返す
+    '''
+    complicated = False
+    left = []
+    right = []
+    for pair in mapping_list:
+        left += pair[0]
+        right += pair[1]
+    if not check_continuous_ascending_order(left) or \
+            not check_continuous_ascending_order(right):
+        complicated = True
+    return complicated
+
+
+def read_mappings(mapping_file, reverse=False):
+    ''' Mapping file を先頭から順に読む (圧縮した Mapping file も読める) '''
+    with corpusio.open_file(mapping_file, 'rb') as f:
+        for line in f:
+            yield parse_record(line, reverse)
+
+
+class MappingIndex:
+    '''
+    Index file を mmap して sentence_id から Mapping file 内の位置を引く
+    '''
+    def __init__(self, mapping_file):
+        self.mapping_file = mapping_file
+        with open(index_path(mapping_file), 'rb') as f:
+            if f.seek(0, 2) == 0:
+                self.index = b''
+            else:
+                self.index = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.fmap = open(mapping_file, 'rb')
+
+    def __len__(self):
+        return len(self.index) // INDEX_RECORD.size
+
+    def __getitem__(self, i):
+        ''' i 番目の記録の sentence_id (bisect 用) '''
+        return INDEX_RECORD.unpack_from(self.index, i * INDEX_RECORD.size)[0]
+
+    def offset(self, i):
+        return INDEX_RECORD.unpack_from(self.index, i * INDEX_RECORD.size)[1]
+
+    def lookup(self, sentence_id, reverse=False):
+        '''
+        sentence_id の対応を返す．記録されていなければ None
+        '''
+        i = bisect.bisect_left(self, sentence_id)
+        if i == len(self) or self[i] != sentence_id:
+            return None
+        self.fmap.seek(self.offset(i))
+        return parse_record(self.fmap.readline(), reverse)[1]
+
+    def close(self):
+        if isinstance(self.index, mmap.mmap):
+            self.index.close()
+        self.fmap.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
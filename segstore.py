@@ -0,0 +1,142 @@
+'''
+segstore.py: jcsplit.py の出力のショートセンテンスを (sentence_id, segment_index) で引く索引
+    Mapping file (またはログ) から文ごとの最初の行番号，セグメント数，複雑な対応かどうかを
+    求めて Store file に保存し，ショートセンテンスのファイルの行は lineindex.LineIndex で読む
+    文を任意の順に読めるので，mix-segments.py で sentence_id の範囲を指定したり並列に処理できる
+    ショートセンテンスのファイルの行数がセグメント数の合計と違えば，開いた時にエラーにする
+    Store file は Mapping file の大きさと更新時刻が変わっていなければ次回から再利用する
+
+Store file:
+    ヘッダ (MAGIC, Mapping file の大きさ, 更新時刻 ns, 文の数, 行の数) のあとに
+    文ごとに (sentence_id, 最初の行番号, セグメント数, 複雑な対応なら 1) を
+    リトルエンディアンの uint64 4つで記録する (sentence_id の昇順)
+'''
+import array
+import bisect
+import mmap
+import os
+import struct
+
+import corpusio
+import lineindex
+import segmap
+
+STORE_SUFFIX = '.seg'
+MAGIC = b'SEGSTOR1'
+HEADER = struct.Struct('<8sQQQQ')
+RECORD = struct.Struct('<QQQQ')
+
+
+class MisalignmentError(ValueError):
+    pass
+
+
+def store_path(mapping_file):
+    return mapping_file + STORE_SUFFIX
+
+
+def build_store(path, mapping_file, mappings):
+    '''
+    :param mappings: mapping_file から読んだ (sentence_id, mappings) のイテレータ
+    '''
+    records = array.array('Q')
+    n_lines = 0
+    prev_id = -1
+    for sentence_id, segment_pairs in mappings:
+        if sentence_id <= prev_id:
+            raise ValueError('sentence IDs of {0} are not in ascending order: {1} after {2}'.format(
+                mapping_file, sentence_id, prev_id))
+        prev_id = sentence_id
+        records.extend((sentence_id, n_lines, len(segment_pairs),
+                        int(segmap.is_complicated(segment_pairs))))
+        n_lines += len(segment_pairs)
+    stat = os.stat(mapping_file)
+    with open(path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, stat.st_size, stat.st_mtime_ns, len(records) // 4, n_lines))
+        records.tofile(f)
+
+
+def is_current(path, mapping_file):
+    ''' Store file が mapping_file から作ったもので，その後 mapping_file が変わっていなければ True '''
+    try:
+        with open(path, 'rb') as f:
+            header = f.read(HEADER.size)
+    except OSError:
+        return False
+    if len(header) < HEADER.size:
+        return False
+    magic, size, mtime, _, _ = HEADER.unpack(header)
+    stat = os.stat(mapping_file)
+    return magic == MAGIC and size == stat.st_size and mtime == stat.st_mtime_ns
+
+
+class SegmentStore:
+    '''
+    Store file を mmap して，i 番目の文の記録や sentence_id の範囲を引く
+    '''
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        _, _, _, self.n_sentences, self.n_lines = HEADER.unpack_from(self.data)
+
+    def __len__(self):
+        return self.n_sentences
+
+    def __getitem__(self, i):
+        ''' i 番目の文の sentence_id (bisect 用) '''
+        return RECORD.unpack_from(self.data, HEADER.size + i * RECORD.size)[0]
+
+    def record(self, i):
+        ''' :return: (sentence_id, 最初の行番号, セグメント数, 複雑な対応か) '''
+        sentence_id, first_line, n_segments, complicated = RECORD.unpack_from(
+            self.data, HEADER.size + i * RECORD.size)
+        return sentence_id, first_line, n_segments, bool(complicated)
+
+    def id_range(self, first_id=None, last_id=None):
+        ''' sentence_id が first_id 以上 last_id 以下の文の範囲 (start, end) '''
+        start = 0 if first_id is None else bisect.bisect_left(self, first_id)
+        end = len(self) if last_id is None else bisect.bisect_right(self, last_id)
+        return start, max(start, end)
+
+    def close(self):
+        self.data.close()
+
+
+def open_store(path, mapping_file, read_mappings):
+    '''
+    Store file が古いか無ければ read_mappings() で mapping_file を読んで作り直してから開く
+    '''
+    if not is_current(path, mapping_file):
+        build_store(path, mapping_file, read_mappings())
+    return SegmentStore(path)
+
+
+class SegmentReader:
+    '''
+    原言語と翻訳文のショートセンテンスのファイルから，文のセグメントを読み出す
+    どちらかの行数が Store file の行数と違えば MisalignmentError
+    '''
+    def __init__(self, store, source_file, translated_file):
+        self.files = []
+        for path in (source_file, translated_file):
+            if corpusio.compression(path):
+                raise ValueError('{0}: compressed files cannot be read by sentence ID'.format(path))
+            lines = lineindex.LineIndex(path)
+            self.files.append(lines)
+            n_lines = len(lines)
+            if n_lines != store.n_lines:
+                # close() で索引の memoryview を解放するので，行数は先に求めておく
+                self.close()
+                raise MisalignmentError(
+                    '{0} has {1} lines but the mappings have {2} segments'.format(
+                        path, n_lines, store.n_lines))
+        self.source, self.translated = self.files
+
+    def sentence_pairs(self, first_line, n_segments):
+        ''' (元の文, 翻訳文) のリスト '''
+        return [(self.source.text(j).strip(), self.translated.text(j).strip())
+                for j in range(first_line, first_line + n_segments)]
+
+    def close(self):
+        for lines in self.files:
+            lines.close()
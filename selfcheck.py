@@ -0,0 +1,312 @@
+'''
+selfcheck.py: 合成した日中対訳コーパスでスクリプトどうしの出力が一致するかを確かめる
+    1. benchmark.py と同じ合成コーパスを作り，アラインメントに形の崩れたトークン
+       ("1-2-3 4", タブ区切り) を混ぜる
+    2. jcsplit.py の出力が --chunk_size, -w, --alignment_cache, --token_cache, --cache,
+       --shard (shards.py でまとめたもの) で変わらないことを確かめる
+    3. augment.py -t identity の出力と中間ファイルが，jcsplit.py → mix-segments.py →
+       mktarget.py → cat を別々に実行した結果と同じことを確かめる
+       mix-segments.py は Store file (-w, --shard) を使っても同じ出力になること，
+       ショートセンテンスの行数が足りなければ 2回目の実行でも MisalignmentError になることも確かめる
+    4. btclient.py serve --fail_rate で失敗する応答を混ぜ，btclient.py translate が
+       再試行して入力と同じ行を書くことを確かめる
+    一致しないものがあれば表示して終了ステータス 1 で終わる
+使い方:
+    $ python selfcheck.py [--lines 2000] [--work_dir selfcheck]
+'''
+import argparse
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import benchmark
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+# btclient.py serve が待ち受けを始めるまで待つ時間 (秒)
+SERVER_START_TIMEOUT = 10.0
+
+
+def get_arguments():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--lines', type=int, default=2000,
+                        help='number of sentences of the generated corpus')
+    parser.add_argument('--work_dir',
+                        help='directory for the generated files (kept after the run)')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--fail_rate', type=float, default=0.3,
+                        help='fraction of requests the stub server answers with 503')
+    return parser.parse_args()
+
+
+def add_malformed_links(path, seed):
+    '''
+    アラインメントの一部の行に "i-j-k l" や "i-j\tk-l" の形のトークンを入れる
+    (jcsplit.py はどのチャンクの大きさでも同じように読み飛ばさなければならない)
+    '''
+    rand = random.Random(seed)
+    with open(path, 'r', encoding='utf-8') as f:
+        lines = f.read().split('\n')[:-1]
+    for i, line in enumerate(lines):
+        links = line.split(' ')
+        if len(links) < 4 or rand.random() >= 0.2:
+            continue
+        k = rand.randrange(len(links) - 1)
+        if rand.random() < 0.5:
+            # "3-3 4-5" を "3-3-4 5" にする ('-' と数の個数は変わらない)
+            j, c = links[k + 1].split('-')
+            links[k:k + 2] = [links[k] + '-' + j, c]
+        else:
+            links[k:k + 2] = [links[k] + '\t' + links[k + 1]]
+        lines[i] = ' '.join(links)
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(''.join(line + '\n' for line in lines))
+
+
+def script(name):
+    return os.path.join(SCRIPT_DIR, name)
+
+
+def run(name, *args, stdout=subprocess.DEVNULL):
+    return subprocess.run([sys.executable, script(name)] + list(args),
+                          stdout=stdout, stderr=subprocess.PIPE, universal_newlines=True)
+
+
+def read_bytes(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def concat(path, *paths):
+    with open(path, 'wb') as fout:
+        for p in paths:
+            with open(p, 'rb') as f:
+                shutil.copyfileobj(f, fout)
+
+
+class Checker:
+    def __init__(self):
+        self.failures = []
+
+    def check(self, name, ok, detail=''):
+        print('{0} {1}{2}'.format('ok  ' if ok else 'FAIL', name,
+                                  ': ' + detail if detail and not ok else ''))
+        if not ok:
+            self.failures.append(name)
+
+    def run(self, name, *args, **kwargs):
+        ''' スクリプトを実行し，失敗したら標準エラー出力の最後の行を表示する '''
+        result = run(name, *args, **kwargs)
+        if result.returncode != 0:
+            lines = result.stderr.strip().split('\n')
+            self.check('{0} {1}'.format(name, ' '.join(args)), False, lines[-1])
+            return False
+        return True
+
+    def same_files(self, name, pairs):
+        ''' pairs: (期待するファイル, 比べるファイル) のリスト '''
+        different = [os.path.basename(actual) for expected, actual in pairs
+                     if read_bytes(expected) != read_bytes(actual)]
+        self.check(name, not different, 'differs: ' + ', '.join(different))
+
+
+def split_files(prefix):
+    ''' jcsplit.py の出力 (ショートセンテンス，ログ，Mapping file とその Index file) '''
+    return [prefix + suffix for suffix in ('.ja', '.zh', '.log', '.map', '.map.idx')]
+
+
+def run_jcsplit(checker, prefix, corpus, *options):
+    align_file, ja_file, zh_file = corpus
+    return checker.run('jcsplit.py', '-m', '0.5', '-l', prefix + '.log', '-M', prefix + '.map',
+                       *options, align_file, ja_file, zh_file, prefix + '.ja', prefix + '.zh')
+
+
+def check_jcsplit(checker, work_dir, corpus):
+    '''
+    jcsplit.py の出力がオプションで変わらないことを確かめる
+    :return: 比べる元にした出力のファイル名の前半
+    '''
+    base = os.path.join(work_dir, 'split')
+    if not run_jcsplit(checker, base, corpus):
+        return None
+    variants = [('chunk', ['--chunk_size', '7']),
+                ('workers', ['-w', '2', '--chunk_size', '50']),
+                ('align_cache', ['--alignment_cache', os.path.join(work_dir, 'align-cache')]),
+                ('token_cache', ['--token_cache', os.path.join(work_dir, 'token-cache')]),
+                ('cache', ['--cache', os.path.join(work_dir, 'split-cache.db')])]
+    # キャッシュは 1回目に作り，2回目に使う
+    variants += [(name + '2', options) for name, options in variants[2:]]
+    for name, options in variants:
+        prefix = os.path.join(work_dir, 'split-' + name)
+        if run_jcsplit(checker, prefix, corpus, *options):
+            # 一時ディレクトリの名前は表示しない
+            label = 'jcsplit.py ' + ' '.join(
+                options[:1] + [os.path.basename(option) for option in options[1:]])
+            if name.endswith('2'):
+                label += ' (reused)'
+            checker.same_files(label,
+                               list(zip(split_files(base), split_files(prefix))))
+
+    n_shards = 3
+    prefixes = [os.path.join(work_dir, 'split-shard{0}'.format(i))
+                for i in range(1, n_shards + 1)]
+    for i, prefix in enumerate(prefixes, 1):
+        if not run_jcsplit(checker, prefix, corpus, '--shard', '{0}/{1}'.format(i, n_shards)):
+            return base
+    merged = os.path.join(work_dir, 'split-shards')
+    for command, suffix in (('cat', '.ja'), ('cat', '.zh'), ('log', '.log'), ('mapping', '.map')):
+        if not checker.run('shards.py', command, merged + suffix,
+                           *[prefix + suffix for prefix in prefixes]):
+            return base
+    checker.same_files('jcsplit.py --shard I/{0} + shards.py'.format(n_shards),
+                       list(zip(split_files(base), split_files(merged))))
+    return base
+
+
+def check_pipeline(checker, work_dir, corpus, split):
+    '''
+    augment.py -t identity と jcsplit.py → mix-segments.py → mktarget.py → cat を比べる
+    逆翻訳の代わりに中国語のショートセンテンスをそのまま使う
+    '''
+    align_file, ja_file, zh_file = corpus
+    out = os.path.join(work_dir, 'pipeline')
+    if not checker.run('mix-segments.py', '-l', split + '.log', '-s', split + '.ja',
+                       '-t', split + '.zh', '-o', out + '.mix', '-n', out + '.num'):
+        return
+    if not checker.run('mktarget.py', zh_file, out + '.num', '-o', out + '.target'):
+        return
+    concat(out + '.src', ja_file, out + '.mix')
+    concat(out + '.tgt', zh_file, out + '.target')
+
+    aug = os.path.join(work_dir, 'augment')
+    if checker.run('augment.py', '-m', '0.5', '-t', 'identity', '-l', aug + '.log',
+                   '-M', aug + '.map', '--short_japanese_file', aug + '.ja',
+                   '--short_chinese_file', aug + '.zh', '--translated_file', aug + '.trn',
+                   '-n', aug + '.num', '--mixed_source_file', aug + '.mix',
+                   '--mixed_target_file', aug + '.target',
+                   align_file, ja_file, zh_file, aug + '.src', aug + '.tgt'):
+        checker.same_files('augment.py -t identity', list(zip(
+            split_files(split) + [split + '.zh'] +
+            [out + suffix for suffix in ('.num', '.mix', '.target', '.src', '.tgt')],
+            split_files(aug) + [aug + '.trn'] +
+            [aug + suffix for suffix in ('.num', '.mix', '.target', '.src', '.tgt')])))
+
+    # Store file を使う読み方 (-M, -w, --shard) でも同じ出力になる
+    stored = os.path.join(work_dir, 'stored')
+    if checker.run('mix-segments.py', '-M', split + '.map', '-s', split + '.ja',
+                   '-t', split + '.zh', '-o', stored + '.mix', '-n', stored + '.num',
+                   '-w', '2'):
+        checker.same_files('mix-segments.py -M -w 2', [(out + '.mix', stored + '.mix'),
+                                                       (out + '.num', stored + '.num')])
+    n_shards = 2
+    prefixes = [os.path.join(work_dir, 'stored-shard{0}'.format(i))
+                for i in range(1, n_shards + 1)]
+    for i, prefix in enumerate(prefixes, 1):
+        if not checker.run('mix-segments.py', '-M', split + '.map', '-s', split + '.ja',
+                           '-t', split + '.zh', '-o', prefix + '.mix', '-n', prefix + '.num',
+                           '--shard', '{0}/{1}'.format(i, n_shards)):
+            return
+    for command, suffix in (('cat', '.mix'), ('number', '.num')):
+        if not checker.run('shards.py', command, stored + '-shards' + suffix,
+                           *[prefix + suffix for prefix in prefixes]):
+            return
+    checker.same_files('mix-segments.py --shard I/{0} + shards.py'.format(n_shards),
+                       [(out + '.mix', stored + '-shards.mix'),
+                        (out + '.num', stored + '-shards.num')])
+
+
+def check_misalignment(checker, work_dir, split):
+    '''
+    ショートセンテンスの行が足りない時は，Store file と行の索引を作った後の実行でも
+    MisalignmentError で止まる
+    '''
+    short = os.path.join(work_dir, 'short.ja')
+    with open(split + '.ja', 'rb') as fin, open(short, 'wb') as fout:
+        fout.writelines(line for _, line in zip(range(10), fin))
+    for k in range(1, 3):
+        result = run('mix-segments.py', '-M', split + '.map', '-s', short, '-t', split + '.zh',
+                     '-o', os.path.join(work_dir, 'short.mix'),
+                     '-n', os.path.join(work_dir, 'short.num'), '--ids', '1-')
+        lines = result.stderr.strip().split('\n')
+        checker.check('mix-segments.py with a short source file (run {0})'.format(k),
+                      result.returncode != 0 and 'MisalignmentError' in lines[-1],
+                      lines[-1] or 'exit status {0}'.format(result.returncode))
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def wait_for_port(port, server):
+    deadline = time.monotonic() + SERVER_START_TIMEOUT
+    while time.monotonic() < deadline and server.poll() is None:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1.0).close()
+            return True
+        except OSError:
+            time.sleep(0.1)
+    return False
+
+
+def check_btclient(checker, work_dir, split, fail_rate):
+    '''
+    失敗する応答を混ぜたスタブサーバーで逆翻訳し，再試行しても行の順と数が保たれる
+    '''
+    port = free_port()
+    server = subprocess.Popen([sys.executable, script('btclient.py'), 'serve', '-t', 'identity',
+                               '--port', str(port), '--fail_rate', str(fail_rate)],
+                              stderr=subprocess.DEVNULL)
+    try:
+        if not wait_for_port(port, server):
+            checker.check('btclient.py serve', False, 'the server did not start')
+            return
+        translated = os.path.join(work_dir, 'btclient.zh')
+        if checker.run('btclient.py', 'translate', '--url',
+                       'http://127.0.0.1:{0}/translate'.format(port),
+                       '-c', '8', '--retries', '10',
+                       split + '.zh', translated):
+            checker.same_files('btclient.py translate (--fail_rate {0})'.format(fail_rate),
+                               [(split + '.zh', translated)])
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def main():
+    args = get_arguments()
+    if args.work_dir:
+        os.makedirs(args.work_dir, exist_ok=True)
+        work_dir = args.work_dir
+    else:
+        work_dir = tempfile.mkdtemp(prefix='selfcheck-')
+
+    try:
+        ja_file, zh_file, align_file = benchmark.corpus_files(work_dir, 'corpus')
+        generator = benchmark.CorpusGenerator(args.seed, 0.08, 0.02)
+        generator.write(args.lines, ja_file, zh_file, align_file)
+        add_malformed_links(align_file, args.seed)
+        corpus = (align_file, ja_file, zh_file)
+
+        checker = Checker()
+        split = check_jcsplit(checker, work_dir, corpus)
+        if split:
+            check_pipeline(checker, work_dir, corpus, split)
+            check_misalignment(checker, work_dir, split)
+            check_btclient(checker, work_dir, split, args.fail_rate)
+    finally:
+        if not args.work_dir:
+            shutil.rmtree(work_dir)
+
+    if checker.failures:
+        sys.exit('selfcheck.py: {0} check(s) failed'.format(len(checker.failures)))
+    print('all checks passed')
+
+
+if __name__ == '__main__':
+    main()
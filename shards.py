@@ -0,0 +1,231 @@
+'''
+shards.py: 複数のマシンで分担して処理した (--shard i/N) 出力を1つにまとめる
+    jcsplit.py --shard i/N はアラインメントファイルの行を N 等分した i 番目だけを処理し，
+    mix-segments.py --shard i/N は Store file の文を N 等分した i 番目だけを処理する
+    どちらもログ，Mapping file，文番号ファイルには全体での文番号 (sentence_id) を書く
+    シャードの出力を 1/N, 2/N, ... の順に渡してまとめると，1台で実行したのと同じ内容になる
+使い方:
+    $ python shards.py cat output-ja shard1/output-ja shard2/output-ja
+    $ python shards.py log log shard1/log shard2/log
+    $ python shards.py mapping mapping shard1/mapping shard2/mapping
+    $ python shards.py number number shard1/number shard2/number
+
+    cat      ショートセンテンス，混ぜた文，目的言語の文などをそのまま連結する
+             圧縮の形式が同じなら圧縮したまま連結する (複数のストリームとして読める)
+    log      jcsplit.py のログを連結し，最後の分割数の集計を全体の数に置き換える
+    mapping  Mapping file を連結し，Index file (+ '.idx') の位置をずらして連結する
+    number   文番号ファイルを連結する
+    log, mapping, number は文番号が昇順に続いていなければエラーにする
+'''
+import argparse
+import array
+import re
+import shutil
+import sys
+
+import corpusio
+import runstats
+import segmap
+
+COPY_BUFFER_SIZE = 1 << 20
+# jcsplit.py がログの最後に書く集計 (前に空行がある)
+SUMMARY_RE = re.compile(rb'^(\d+) of (\d+) sentences were split into (\d+) short sentences\.\r?\n?$')
+
+
+def parse_shard(text):
+    '''
+    "2/4" を (2, 4) に変換する (argparse の type)
+    '''
+    index, _, n_shards = text.partition('/')
+    try:
+        index, n_shards = int(index), int(n_shards)
+    except ValueError:
+        raise argparse.ArgumentTypeError('expected I/N, e.g. 1/4: {0}'.format(text))
+    if not 1 <= index <= n_shards:
+        raise argparse.ArgumentTypeError('shard index must be 1 to N: {0}'.format(text))
+    return index, n_shards
+
+
+def shard_range(start, end, shard):
+    ''' [start, end) を N 等分した i 番目の範囲 '''
+    index, n_shards = shard
+    return (start + (end - start) * (index - 1) // n_shards,
+            start + (end - start) * index // n_shards)
+
+
+def count_lines(path):
+    ''' ファイルの行数 (最後の行に改行がなくても1行と数える) '''
+    n_lines = 0
+    last = b'\n'
+    with corpusio.open_file(path, 'rb') as f:
+        for block in iter(lambda: f.read(COPY_BUFFER_SIZE), b''):
+            n_lines += block.count(b'\n')
+            last = block[-1:]
+    return n_lines + (last != b'\n')
+
+
+def line_offsets(path, line_numbers):
+    '''
+    圧縮しないファイルの各行 (0始まり，昇順) の先頭のバイト位置
+    行数より後の行はファイルの大きさにする
+    '''
+    offsets = []
+    line_numbers = list(line_numbers)
+    block_offset = 0
+    block_line = 0  # ブロックの先頭の行番号
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(COPY_BUFFER_SIZE), b''):
+            n_lines = block.count(b'\n')
+            while line_numbers and line_numbers[0] <= block_line + n_lines:
+                pos = -1
+                for _ in range(line_numbers.pop(0) - block_line):
+                    pos = block.index(b'\n', pos + 1)
+                offsets.append(block_offset + pos + 1)
+            block_offset += len(block)
+            block_line += n_lines
+    return offsets + [block_offset] * len(line_numbers)
+
+
+def get_arguments():
+    parser = argparse.ArgumentParser()
+    commands = parser.add_subparsers(dest='command', required=True)
+    for name, help in (('cat', 'concatenate shard files'),
+                       ('log', 'concatenate jcsplit.py logs and recount the summary'),
+                       ('mapping', 'concatenate mapping files and their index files'),
+                       ('number', 'concatenate sentence number files')):
+        command = commands.add_parser(name, help=help)
+        command.add_argument('output_file', help='merged output file')
+        command.add_argument('shard_files', nargs='+', help='shard files in shard order')
+        command.add_argument('--stats',
+                             help='write per-stage times and counters to this file (JSON)')
+    return parser.parse_args()
+
+
+class IdChecker:
+    ''' シャードをまたいで文番号が昇順に続いているかを確かめる '''
+    def __init__(self):
+        self.last_id = 0
+
+    def check(self, path, sentence_id):
+        if sentence_id <= self.last_id:
+            sys.exit('shards.py: sentence ID {0} in {1} is not after {2}; '
+                     'give the shard files in shard order'.format(sentence_id, path, self.last_id))
+        self.last_id = sentence_id
+
+
+def merge_cat(args, stats):
+    ext = corpusio.compression(args.output_file)
+    if all(corpusio.compression(path) == ext for path in args.shard_files):
+        # 圧縮したまま連結する
+        with open(args.output_file, 'wb') as fout:
+            for path in args.shard_files:
+                with open(path, 'rb') as f:
+                    shutil.copyfileobj(f, fout, COPY_BUFFER_SIZE)
+        return
+    with corpusio.open_file(args.output_file, 'wb') as fout:
+        for path in args.shard_files:
+            with corpusio.open_file(path, 'rb') as f:
+                shutil.copyfileobj(f, fout, COPY_BUFFER_SIZE)
+
+
+def merge_log(args, stats):
+    '''
+    各シャードのログの最後の集計 (空行と "X of Y sentences were split into Z short sentences.")
+    を除いて連結し，合計した集計を最後に書く
+    '''
+    totals = [0, 0, 0]
+    checker = IdChecker()
+    with corpusio.open_file(args.output_file, 'wb') as fout:
+        for path in args.shard_files:
+            with corpusio.open_file(path, 'rb') as f:
+                # 最後の2行は集計なので，2行遅れで書く
+                held = []
+                for line in f:
+                    if line.startswith(b'#') and line[1:].strip().isdigit():
+                        checker.check(path, int(line[1:]))
+                    held.append(line)
+                    if len(held) > 2:
+                        fout.write(held.pop(0))
+            summary = SUMMARY_RE.match(held[-1]) if len(held) == 2 and not held[0].strip() \
+                else None
+            if summary is None:
+                sys.exit('shards.py: {0} does not end with the jcsplit.py summary'.format(path))
+            for k in range(3):
+                totals[k] += int(summary.group(k + 1))
+        fout.write('\n{0} of {1} sentences were split into {2} short sentences.\n'.format(
+            *totals).encode('ascii'))
+    print('{0} of {1} sentences were split into {2} short sentences.'.format(*totals))
+    stats.count('sentences', totals[1])
+    stats.count('split_sentences', totals[0])
+
+
+def merge_mapping(args, stats):
+    if corpusio.compression(args.output_file):
+        # Index file は圧縮しないファイルの中の位置を記録するので，圧縮できない
+        sys.exit('shards.py: the mapping file cannot be compressed: {0}'.format(args.output_file))
+    checker = IdChecker()
+    n_sentence = 0
+    offset = 0
+    with open(args.output_file, 'wb') as fmap, \
+         open(segmap.index_path(args.output_file), 'wb') as findex:
+        for path in args.shard_files:
+            records = array.array('Q')
+            with open(segmap.index_path(path), 'rb') as f:
+                records.frombytes(f.read())
+            if sys.byteorder != 'little':
+                records.byteswap()
+            if records:
+                checker.check(path, records[0])
+                checker.last_id = records[-2]
+            # Mapping file の中の位置をまとめたファイルの位置にする
+            for k in range(1, len(records), 2):
+                records[k] += offset
+            if sys.byteorder != 'little':
+                records.byteswap()
+            records.tofile(findex)
+            with open(path, 'rb') as f:
+                shutil.copyfileobj(f, fmap, COPY_BUFFER_SIZE)
+            offset = fmap.tell()
+            n_sentence += len(records) // 2
+    stats.count('sentences', n_sentence)
+
+
+def merge_number(args, stats):
+    checker = IdChecker()
+    n_sentence = 0
+    with corpusio.open_file(args.output_file, 'wb') as fout:
+        for path in args.shard_files:
+            with corpusio.open_file(path, 'rb') as f:
+                first = f.readline()
+                if not first:
+                    continue
+                checker.check(path, int(first.split()[0]))
+                fout.write(first)
+                n_sentence += 1
+                last = first
+                for line in f:
+                    fout.write(line)
+                    n_sentence += 1
+                    last = line
+                checker.last_id = int(last.split()[0])
+    stats.count('sentences', n_sentence)
+
+
+def main():
+    args = get_arguments()
+    stats = runstats.Stats(enabled=args.stats is not None)
+    progress = runstats.Progress('shards.py', enabled=stats.enabled)
+    merge = {'cat': merge_cat, 'log': merge_log,
+             'mapping': merge_mapping, 'number': merge_number}[args.command]
+    with stats.timer('merge'):
+        merge(args, stats)
+    stats.count('shards', len(args.shard_files))
+
+    if stats.enabled:
+        stats.write(args.stats, 'shards.py ' + args.command, progress.elapsed(),
+                    bytes_read=runstats.file_sizes(*args.shard_files),
+                    bytes_written=runstats.file_sizes(args.output_file))
+
+
+if __name__ == '__main__':
+    main()
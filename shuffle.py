@@ -0,0 +1,188 @@
+'''
+shuffle.py: 元の対訳コーパスと mix-segments.py / mktarget.py の出力をまとめ，
+    原言語と目的言語の行の対応を保ったままシャッフルする (README の手順 6 の cat の代わり)
+    コーパス全体をメモリに読み込まず，対訳をディスク上のバケットに無作為に振り分けてから
+    バケットごとにメモリ上でシャッフルする．--memory を超えるバケットはさらに振り分ける
+    同じ入力と --seed, --buckets, --memory なら同じ結果になる
+使い方:
+    $ python shuffle.py -i input-ja input-zh -i train-ja-mixed-source zh-mix-target train-ja train-zh
+'''
+import argparse
+import itertools
+import os
+import random
+import shutil
+import sys
+import tempfile
+
+import corpusio
+import runstats
+
+DEFAULT_SEED = 1
+DEFAULT_BUCKETS = 64
+DEFAULT_MEMORY = 256  # MB
+BUCKET_BUFFER_SIZE = 1 << 16
+OUTPUT_BUFFER_SIZE = 1 << 20
+# メモリに読み込んだ対訳1つあたりの bytes と tuple のおよそのバイト数
+PAIR_OVERHEAD = 150
+
+
+def get_arguments():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-i', '--input', nargs=2, action='append', required=True,
+                        metavar=('SOURCE', 'TARGET'),
+                        help='source and target files of a corpus (can be repeated)')
+    parser.add_argument('output_source',
+                        help='output source language file')
+    parser.add_argument('output_target',
+                        help='output target language file')
+    parser.add_argument('--seed', type=int, default=DEFAULT_SEED,
+                        help='random seed (default: %(default)s)')
+    parser.add_argument('--buckets', type=int, default=DEFAULT_BUCKETS,
+                        help='number of buckets a corpus is scattered into (default: %(default)s)')
+    parser.add_argument('--memory', type=int, default=DEFAULT_MEMORY,
+                        help='largest bucket shuffled in memory in MB (default: %(default)s)')
+    parser.add_argument('--work_dir',
+                        help='directory for the buckets (default: the directory of output_source)')
+    parser.add_argument('--stats',
+                        help='write per-stage times and counters to this file (JSON)')
+    return parser.parse_args()
+
+
+def end_line(line):
+    ''' 最後の行に改行がなければ付ける '''
+    if line.endswith(b'\n'):
+        return line
+    return line + b'\n'
+
+
+def read_pairs(inputs):
+    ''' 入力の対訳ファイルの組から (原言語の行, 目的言語の行) を順に返す '''
+    for source, target in inputs:
+        with corpusio.open_file(source, 'rb') as fsrc, \
+             corpusio.open_file(target, 'rb') as ftgt:
+            for src_line, tgt_line in itertools.zip_longest(fsrc, ftgt):
+                if src_line is None or tgt_line is None:
+                    raise ValueError('{0} and {1} have different numbers of lines'.format(
+                        source, target))
+                yield end_line(src_line), end_line(tgt_line)
+
+
+class Bucket:
+    __slots__ = ('source', 'target', 'size', 'count')
+
+    def __init__(self, directory, i):
+        self.source = os.path.join(directory, '{0}.src'.format(i))
+        self.target = os.path.join(directory, '{0}.tgt'.format(i))
+        self.size = 0
+        self.count = 0
+
+    def read(self):
+        with open(self.source, 'rb') as fsrc, open(self.target, 'rb') as ftgt:
+            yield from zip(fsrc, ftgt)
+
+    def remove(self):
+        os.remove(self.source)
+        os.remove(self.target)
+
+
+def scatter(pairs, directory, n_buckets, rng):
+    ''' 対訳をバケットのファイルに無作為に振り分ける '''
+    buckets = [Bucket(directory, i) for i in range(n_buckets)]
+    files = []
+    try:
+        for bucket in buckets:
+            files.append((open(bucket.source, 'wb', BUCKET_BUFFER_SIZE),
+                          open(bucket.target, 'wb', BUCKET_BUFFER_SIZE)))
+        for src_line, tgt_line in pairs:
+            i = rng.randrange(n_buckets)
+            fsrc, ftgt = files[i]
+            fsrc.write(src_line)
+            ftgt.write(tgt_line)
+            bucket = buckets[i]
+            bucket.size += len(src_line) + len(tgt_line) + PAIR_OVERHEAD
+            bucket.count += 1
+    finally:
+        for fsrc, ftgt in files:
+            fsrc.close()
+            ftgt.close()
+    return buckets
+
+
+class Shuffler:
+    '''
+    :param memory: メモリ上でシャッフルするバケットの大きさの上限 (バイト)
+    '''
+    def __init__(self, work_dir, n_buckets, memory, seed, stats):
+        self.work_dir = work_dir
+        self.n_buckets = n_buckets
+        self.memory = memory
+        self.rng = random.Random(seed)
+        self.stats = stats
+
+    def shuffle(self, pairs, fout_src, fout_tgt):
+        with self.stats.timer('scatter'):
+            buckets = scatter(pairs, self.work_dir, self.n_buckets, self.rng)
+        self.stats.count('buckets', len(buckets))
+        for bucket in buckets:
+            self.shuffle_bucket(bucket, fout_src, fout_tgt)
+
+    def shuffle_bucket(self, bucket, fout_src, fout_tgt):
+        if bucket.size > self.memory and bucket.count > 1:
+            # 大きすぎるバケットは，さらに振り分ける
+            self.stats.count('rescattered_buckets')
+            directory = tempfile.mkdtemp(dir=self.work_dir)
+            with self.stats.timer('scatter'):
+                buckets = scatter(bucket.read(), directory, self.n_buckets, self.rng)
+            bucket.remove()
+            self.stats.count('buckets', len(buckets))
+            for sub_bucket in buckets:
+                self.shuffle_bucket(sub_bucket, fout_src, fout_tgt)
+            os.rmdir(directory)
+            return
+        with self.stats.timer('shuffle'):
+            pairs = list(bucket.read())
+            self.rng.shuffle(pairs)
+        bucket.remove()
+        with self.stats.timer('write_output'):
+            fout_src.write(b''.join(src_line for src_line, _ in pairs))
+            fout_tgt.write(b''.join(tgt_line for _, tgt_line in pairs))
+
+
+def main():
+    args = get_arguments()
+    stats = runstats.Stats(enabled=args.stats is not None)
+    progress = runstats.Progress('shuffle.py', enabled=stats.enabled)
+    if args.buckets < 2:
+        sys.exit('shuffle.py: --buckets must be 2 or more')
+
+    work_dir = args.work_dir or os.path.dirname(os.path.abspath(args.output_source))
+    # 同じディレクトリで複数実行しても衝突しないように，一時ディレクトリを作る
+    work_dir = tempfile.mkdtemp(prefix='shuffle-', dir=work_dir)
+    n_sentence = 0
+
+    def counted(pairs):
+        nonlocal n_sentence
+        for pair in pairs:
+            n_sentence += 1
+            progress.update(n_sentence)
+            yield pair
+
+    try:
+        shuffler = Shuffler(work_dir, args.buckets, args.memory << 20, args.seed, stats)
+        with corpusio.open_file(args.output_source, 'wb', buffering=OUTPUT_BUFFER_SIZE) as fout_src, \
+             corpusio.open_file(args.output_target, 'wb', buffering=OUTPUT_BUFFER_SIZE) as fout_tgt:
+            shuffler.shuffle(counted(read_pairs(args.input)), fout_src, fout_tgt)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    print('Number of sentence pairs:', n_sentence)
+
+    if stats.enabled:
+        stats.count('sentences', n_sentence)
+        stats.write(args.stats, 'shuffle.py', progress.elapsed(),
+                    bytes_read=runstats.file_sizes(*itertools.chain(*args.input)),
+                    bytes_written=runstats.file_sizes(args.output_source, args.output_target))
+
+
+if __name__ == '__main__':
+    main()
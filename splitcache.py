@@ -0,0 +1,159 @@
+'''
+splitcache.py: jcsplit.py の分割結果のキャッシュ (SQLite)
+    (日本語文, 中国語文, アラインメント, minimum_rate, simplify, ...) のハッシュをキーに
+    jcsplit.format_sentence() の結果 (部分文対，部分文のテキスト，ログ) を保存する
+    ログの先頭の文番号 ("#N") は文の位置で変わるので除いて保存し，読み出す時に付ける
+    キャッシュの大きさが上限を超えたら，古い実行で使われたものから削除する
+
+    キャッシュにある文はワーカーに送らず (None にして送る)，結果をあとで埋める
+        chunks = cache.filter_chunks(chunks)        # 入力を読むスレッドで実行される
+        results = pool.imap(process_chunk, chunks)
+        results = cache.merge_results(results)      # 結果を受け取るスレッドで実行する
+'''
+import collections
+import hashlib
+import json
+import sqlite3
+
+import segmap
+
+# 分割処理や format_sentence() の出力を変えたら上げる
+CACHE_VERSION = 1
+DEFAULT_CACHE_SIZE = 1024  # MB
+# 1つの SQL 文で検索するキーの数
+QUERY_BATCH = 500
+
+
+class SplitCache:
+    '''
+    :param options: (minimum_rate, do_simplify, full, write_log)
+    :param max_bytes: キャッシュの大きさの上限 (キーと値のバイト数の合計)
+    '''
+    def __init__(self, cache_file, options, max_bytes=DEFAULT_CACHE_SIZE << 20, stats=None):
+        self.cache_file = cache_file
+        self.max_bytes = max_bytes
+        self.stats = stats
+        self.prefix = json.dumps([CACHE_VERSION] + list(options)).encode('utf-8')
+        self.pending = collections.deque()
+        self.db = self.connect()
+        with self.db:
+            self.db.execute('CREATE TABLE IF NOT EXISTS meta (generation INTEGER)')
+            if self.db.execute('SELECT COUNT(*) FROM meta').fetchone()[0] == 0:
+                self.db.execute('INSERT INTO meta VALUES (0)')
+            self.db.execute('UPDATE meta SET generation = generation + 1')
+            self.generation = self.db.execute('SELECT generation FROM meta').fetchone()[0]
+
+    def connect(self):
+        db = sqlite3.connect(self.cache_file)
+        # 削除した分だけファイルを小さくできるように，テーブルを作る前に設定する
+        db.execute('PRAGMA auto_vacuum = INCREMENTAL')
+        db.execute('PRAGMA journal_mode = WAL')
+        db.execute('PRAGMA synchronous = NORMAL')
+        db.execute('CREATE TABLE IF NOT EXISTS results '
+                   '(key BLOB PRIMARY KEY, value BLOB, size INTEGER, generation INTEGER)')
+        db.execute('CREATE INDEX IF NOT EXISTS results_generation ON results (generation)')
+        return db
+
+    def key(self, alignment, jp_line, ch_line):
+        h = hashlib.blake2b(self.prefix, digest_size=16)
+        for text in (jp_line, ch_line, alignment):
+            h.update(b'\0')
+            h.update(text.encode('utf-8'))
+        return h.digest()
+
+    def filter_chunks(self, chunks):
+        '''
+        read_chunks() のチャンクのうち，キャッシュにある文を None に置き換えて返す
+        読み出した結果は merge_results() に渡す
+        '''
+        # 別のスレッドで実行されるので，接続もそのスレッドで作る
+        db = self.connect()
+        try:
+            for sentence_no, chunk in chunks:
+                keys = [self.key(*line) for line in chunk]
+                hits = {}
+                for i in range(0, len(keys), QUERY_BATCH):
+                    batch = keys[i:i + QUERY_BATCH]
+                    hits.update(db.execute(
+                        'SELECT key, value FROM results WHERE key IN ({0})'.format(
+                            ','.join('?' * len(batch))), batch))
+                hit_bytes = sum(len(line[0]) for key, line in zip(keys, chunk) if key in hits)
+                self.pending.append((keys, hits, hit_bytes))
+                yield sentence_no, [None if key in hits else line
+                                    for key, line in zip(keys, chunk)]
+        finally:
+            db.close()
+
+    def merge_results(self, results):
+        '''
+        process_chunk() の結果の None をキャッシュの値で埋め，新しい結果を保存する
+        '''
+        for sentence_no, chunk_results, chunk_stats in results:
+            keys, hits, hit_bytes = self.pending.popleft()
+            new_values = []
+            for i, key in enumerate(keys):
+                if key in hits:
+                    chunk_results[i] = decode_result(sentence_no + i, hits[key])
+                else:
+                    value = encode_result(chunk_results[i])
+                    new_values.append((key, value, len(key) + len(value), self.generation))
+            with self.db:
+                self.db.executemany('INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?)',
+                                    new_values)
+                self.db.executemany('UPDATE results SET generation = ? WHERE key = ?',
+                                    [(self.generation, key) for key in hits])
+            if self.stats and self.stats.enabled:
+                self.count_hits([chunk_results[i] for i, key in enumerate(keys)
+                                 if key in hits], hit_bytes)
+                self.stats.count('cache_misses', len(new_values))
+            yield sentence_no, chunk_results, chunk_stats
+
+    def count_hits(self, results, hit_bytes):
+        ''' ワーカーが数えないキャッシュにあった文の数などを数える '''
+        self.stats.count('cache_hits', len(results))
+        self.stats.count('sentences', len(results))
+        self.stats.count('alignment_bytes', hit_bytes)
+        for split, n_short, _, _, _, mapping in results:
+            if split:
+                self.stats.count('split_sentences')
+                self.stats.count('short_sentences', n_short)
+                if segmap.is_complicated(mapping):
+                    self.stats.count('complicated_mappings')
+
+    def evict(self):
+        ''' 上限を超えた分を，使われた実行が古いものから削除する '''
+        total = self.db.execute('SELECT COALESCE(SUM(size), 0) FROM results').fetchone()[0]
+        excess = total - self.max_bytes
+        if excess <= 0:
+            return
+        victims = []
+        for key, size in self.db.execute(
+                'SELECT key, size FROM results ORDER BY generation, rowid'):
+            victims.append((key,))
+            excess -= size
+            if excess <= 0:
+                break
+        with self.db:
+            self.db.executemany('DELETE FROM results WHERE key = ?', victims)
+        # execute() では1ページしか解放されないので executescript() で最後まで実行する
+        self.db.executescript('PRAGMA incremental_vacuum;')
+
+    def close(self):
+        self.evict()
+        self.db.close()
+
+
+def encode_result(result):
+    split, n_short, log_text, jp_text, ch_text, mapping = result
+    if log_text:
+        # 文番号の行を除く
+        log_text = log_text[log_text.index('\n') + 1:]
+    return json.dumps([split, n_short, log_text, jp_text, ch_text, mapping],
+                      ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def decode_result(sentence_no, value):
+    split, n_short, log_text, jp_text, ch_text, mapping = json.loads(value)
+    if log_text:
+        log_text = '#{0}\n'.format(sentence_no) + log_text
+    return split, n_short, log_text, jp_text, ch_text, mapping
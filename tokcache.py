@@ -0,0 +1,176 @@
+'''
+tokcache.py: 単語分割済みのコーパスを語彙表とトークン ID の配列に変換して保存する
+    jcsplit.py --token_cache DIR は配列を mmap して Sentence を作り，行を split() しない
+    トークンの文字列は語彙表で一度だけ作り，出力する部分文のテキストだけを join する
+    区切り (DELIMS) と全角スペースの判定は語彙ごとにフラグとして求めておく
+    元のファイルの大きさか更新時刻，DELIMS が変わったら作り直す
+
+Cache directory (コーパスのファイルごと):
+    meta.json    (CACHE_VERSION, 元のファイルの大きさ, 更新時刻 ns, DELIMS, 行数, トークン数, 語彙数)
+    vocab.txt    語彙 (ID の順に1行に1つ)
+    flags.npy    語彙ごとのフラグ (uint8, DELIM | WIDE_SPACE | ALPHA_END | EMPTY)
+    offsets.npy  行ごとのトークンの開始位置 (int64, 行数 + 1)
+    tokens.npy   トークン ID (int32)
+    トークンは jcsplit.Sentence と同じく line.strip().split(' ') で分ける
+'''
+import array
+import json
+import os
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+import corpusio
+
+CACHE_VERSION = 1
+META_FILE = 'meta.json'
+VOCAB_FILE = 'vocab.txt'
+# 変換する時に一度に書き出す行数
+BUILD_BLOCK = 100000
+
+# flags
+DELIM = 1       # 区切りのトークン (DELIMS の部分文字列)
+WIDE_SPACE = 2  # 全角スペース
+ALPHA_END = 4   # 最後の文字が英字 (jcsplit.is_alpha)
+EMPTY = 8       # 空のトークン (連続した空白)
+
+
+def token_flags(token, delim_tokens, wide_space, is_alpha):
+    flags = 0
+    if token in delim_tokens:
+        flags |= DELIM
+    if token == wide_space:
+        flags |= WIDE_SPACE
+    if not token:
+        flags |= EMPTY
+    elif is_alpha(token[-1]):
+        flags |= ALPHA_END
+    return flags
+
+
+def read_meta(directory):
+    try:
+        with open(os.path.join(directory, META_FILE), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def is_current(directory, path, delims):
+    meta = read_meta(directory)
+    stat = os.stat(path)
+    return meta is not None and meta['version'] == CACHE_VERSION and \
+        meta['size'] == stat.st_size and meta['mtime_ns'] == stat.st_mtime_ns and \
+        meta['delims'] == delims
+
+
+def build(directory, path, delims, delim_tokens, wide_space, is_alpha):
+    '''
+    path を変換して directory に保存する
+    トークン ID は一時ファイルに書き，最後に .npy にする (メモリに持つのは語彙と行の位置だけ)
+    '''
+    os.makedirs(directory, exist_ok=True)
+    if os.path.exists(os.path.join(directory, META_FILE)):
+        os.remove(os.path.join(directory, META_FILE))
+    stat = os.stat(path)
+    vocab = {}
+    offsets = array.array('q', [0])
+    tmp_path = os.path.join(directory, 'tokens.tmp')
+    with corpusio.open_file(path) as fin, open(tmp_path, 'wb') as ftmp:
+        while True:
+            texts = [line for _, line in zip(range(BUILD_BLOCK), fin)]
+            if not texts:
+                break
+            ids = array.array('i')
+            for text in texts:
+                for token in text.strip().split(' '):
+                    i = vocab.get(token)
+                    if i is None:
+                        i = vocab[token] = len(vocab)
+                    ids.append(i)
+                offsets.append(len(ids))
+            # ブロックの中の位置をファイル全体の位置にする
+            base = offsets[-len(texts) - 1]
+            for k in range(len(offsets) - len(texts), len(offsets)):
+                offsets[k] += base
+            ids.tofile(ftmp)
+    n_tokens = offsets[-1]
+    if n_tokens:
+        tokens = np.memmap(tmp_path, dtype=np.int32, mode='r', shape=(n_tokens,))
+    else:
+        tokens = np.zeros(0, dtype=np.int32)
+    np.save(os.path.join(directory, 'tokens.npy'), tokens)
+    del tokens
+    os.remove(tmp_path)
+    np.save(os.path.join(directory, 'offsets.npy'), np.frombuffer(offsets, dtype=np.int64))
+    np.save(os.path.join(directory, 'flags.npy'),
+            np.array([token_flags(token, delim_tokens, wide_space, is_alpha) for token in vocab],
+                     dtype=np.uint8))
+    with open(os.path.join(directory, VOCAB_FILE), 'w', encoding='utf-8', newline='') as f:
+        f.write('\n'.join(vocab))
+    # meta.json は最後に書く (途中で止まったキャッシュは使わない)
+    with open(os.path.join(directory, META_FILE), 'w', encoding='utf-8') as f:
+        json.dump({'version': CACHE_VERSION, 'size': stat.st_size,
+                   'mtime_ns': stat.st_mtime_ns, 'delims': delims,
+                   'lines': len(offsets) - 1, 'tokens': n_tokens, 'vocab': len(vocab)},
+                  f, ensure_ascii=False)
+
+
+class TokenTexts:
+    '''
+    1文のトークン ID の列を，トークンの文字列のリストのように引く
+    最初に引いた時に文全体を語彙表から文字列のリストにする (Segment.text() などで使う)
+    テキストを使わない文 (分割せず，ログにも書かない文) は文字列のリストを作らない
+    '''
+    __slots__ = ('ids', 'vocab', 'texts')
+
+    def __init__(self, ids, vocab):
+        self.ids = ids
+        self.vocab = vocab
+        self.texts = None
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __getitem__(self, i):
+        if self.texts is None:
+            self.texts = [self.vocab[token] for token in self.ids]
+        return self.texts[i]
+
+
+class TokenCache:
+    def __init__(self, directory):
+        load = lambda name: np.load(os.path.join(directory, name + '.npy'), mmap_mode='r')
+        self.offsets = load('offsets')
+        self.tokens = load('tokens')
+        self.flags = np.load(os.path.join(directory, 'flags.npy'))
+        # 語彙ごとのフラグを Python の int で引く (全角スペースの判定に使う)
+        self.flag_list = self.flags.tolist()
+        with open(os.path.join(directory, VOCAB_FILE), 'r', encoding='utf-8', newline='') as f:
+            self.vocab = f.read().split('\n')
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def lines(self, rows):
+        '''
+        rows 番目 (0始まり) の行のトークン ID と区切りのトークンの位置
+        区切りの判定はチャンクの全てのトークンについてまとめて行う
+        :return: (トークン ID のリスト, 区切りのトークンの位置のリスト) のリスト
+        '''
+        rows = np.asarray(rows, dtype=np.int64)
+        starts = self.offsets[rows]
+        n_tokens = self.offsets[rows + 1] - starts
+        line_starts = np.cumsum(n_tokens) - n_tokens
+        total = int(n_tokens.sum())
+        index = np.repeat(starts - line_starts, n_tokens) + np.arange(total, dtype=np.int64)
+        ids = self.tokens[index]
+        delims = np.flatnonzero(self.flags[ids] & DELIM)
+        # 各行の区切りが delims の何番目から何番目か
+        bounds = np.searchsorted(delims, np.append(line_starts, total)).tolist()
+        ids = ids.tolist()
+        delims = delims.tolist()
+        return [(ids[start:start + n], [d - start for d in delims[bounds[k]:bounds[k + 1]]])
+                for k, (start, n) in enumerate(zip(line_starts.tolist(), n_tokens.tolist()))]
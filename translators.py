@@ -0,0 +1,47 @@
+'''
+translators.py: 逆翻訳 (back-translation) に使う翻訳関数
+    翻訳関数は文のリストを受け取り，同じ順序・同じ長さの翻訳文のリストを返す callable
+
+    identity             入力をそのまま返す (テスト用)
+    dict:FILE            "原文<TAB>翻訳文" の TSV ファイルで引く (ない文はそのまま返す)
+    http://HOST:PORT/PATH  翻訳サーバーに並行して依頼する (btclient.py)
+    module:function      import した module の function を使う
+'''
+import importlib
+
+
+def identity(sentences):
+    return list(sentences)
+
+
+class DictionaryTranslator:
+    def __init__(self, path):
+        self.table = {}
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                line = line.rstrip('\n')
+                if '\t' not in line:
+                    continue
+                source, translated = line.split('\t', 1)
+                self.table[source] = translated
+
+    def __call__(self, sentences):
+        return [self.table.get(s, s) for s in sentences]
+
+
+def load_translator(spec):
+    '''
+    指定された翻訳関数を返す
+    :param spec: 'identity', 'dict:FILE', 'http://...' または 'module:function'
+    '''
+    if spec == 'identity':
+        return identity
+    if spec.startswith('dict:'):
+        return DictionaryTranslator(spec[len('dict:'):])
+    if spec.startswith(('http://', 'https://')):
+        import btclient
+        return btclient.HTTPTranslator(spec)
+    if ':' in spec:
+        module_name, function_name = spec.split(':', 1)
+        return getattr(importlib.import_module(module_name), function_name)
+    raise ValueError('unknown translator: {0}'.format(spec))